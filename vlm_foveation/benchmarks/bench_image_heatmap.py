@@ -0,0 +1,84 @@
+"""Benchmark the batched image attention map against the per-fixation reference loop."""
+
+import argparse
+import os
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), "..", "datasets", "VQA_MHUG", "VQA_MHUG")
+)
+from gaze_index import FIELDS  # noqa: E402
+from generate_deliverables import gaussian_heatmap, makeImageHeatmap  # noqa: E402
+
+
+def reference_image_heatmap(fixations, bboxes, duration_scaled=True):
+    """Original makeImageHeatmap: one full-resolution gaussian per fixation."""
+    _, y_min, x_min, y_max, x_max = bboxes[1]
+    width = int(x_max - x_min)
+    height = int(y_max - y_min)
+    heatmap = np.zeros((height, width))
+    for fix in fixations:
+        if (x_min <= fix["x"] <= x_max) and (y_min <= fix["y"] <= y_max):
+            x = int(fix["x"] - x_min)
+            y = int(fix["y"] - y_min)
+            gaussian = gaussian_heatmap(
+                center=(x, y),
+                image_size=(width, height),
+                sig=(fix["ppd_x"] / 1.5, fix["ppd_y"] / 1.5),
+            )
+            if duration_scaled:
+                gaussian *= fix["duration"]
+            heatmap += gaussian
+    heatmap = heatmap / heatmap.max()
+    return heatmap
+
+
+def synthetic_sample(num_fixations, rng, width=660, height=660):
+    """Return (fixations, bboxes) shaped like one VQA-MHUG image plate sample."""
+    x_min, y_min = 630.0, 100.0
+    bboxes = [
+        ["TXT", 760.0, 200.0, 980.0, 1720.0],
+        ["IMG", y_min, x_min, y_min + height, x_min + width],
+    ]
+    fixations = [
+        {
+            # ~10% of the fixations land outside of the image bbox
+            "x": int(rng.integers(x_min - 60, x_min + width + 60)),
+            "y": int(rng.integers(y_min - 60, y_min + height + 60)),
+            "ppd_x": float(rng.normal(36.0, 1.5)),
+            "ppd_y": float(rng.normal(36.0, 1.5)),
+            "duration": float(rng.gamma(2.6, 85.0)),
+            "pupil": float(rng.normal(650.0, 180.0)),
+        }
+        for _ in range(num_fixations)
+    ]
+    return fixations, bboxes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="makeImageHeatmap benchmark")
+    parser.add_argument("--fixations", nargs="+", type=int, default=[8, 32, 130])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    print(f"{'fixations':>9} {'reference ms':>13} {'batched ms':>11} {'speedup':>8} {'max abs err':>12}")
+    for num_fixations in args.fixations:
+        fixations, bboxes = synthetic_sample(num_fixations, rng)
+        columns = {field: np.array([fix[field] for fix in fixations], dtype=np.float64) for field in FIELDS}
+        expected = reference_image_heatmap(fixations, bboxes)
+        actual = makeImageHeatmap(columns, bboxes)
+        error = np.abs(expected - actual).max()
+        assert np.allclose(expected, actual, rtol=1e-7, atol=1e-9), error
+
+        t_ref = min(timeit.repeat(lambda: reference_image_heatmap(fixations, bboxes), number=1, repeat=args.repeats))
+        t_new = min(timeit.repeat(lambda: makeImageHeatmap(columns, bboxes), number=1, repeat=args.repeats))
+        print(f"{num_fixations:>9} {t_ref * 1e3:>13.2f} {t_new * 1e3:>11.2f} {t_ref / t_new:>7.1f}x {error:>12.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Benchmark the vectorized VQAEval against a per-question reference implementation."""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "datasets", "VQA_MHUG"))
+from vqaTools.vqa import VQA  # noqa: E402
+from vqaTools.vqaEval import VQAEval, cleanAnswer, processDigitArticle, processPunctuation  # noqa: E402
+from synthetic import write_synthetic_vqa  # noqa: E402
+
+
+def reference_accuracy(vqa, vqa_res):
+    """Official per-question evaluation loop, returns {question_id: accuracy in [0, 1]}."""
+    res = {ann["question_id"]: ann for ann in vqa_res.dataset["annotations"]}
+    accuracy = {}
+    for ques_id in vqa.getQuesIds():
+        gt_answers = [cleanAnswer(ans["answer"]) for ans in vqa.qa[ques_id]["answers"]]
+        res_ans = cleanAnswer(res[ques_id]["answer"])
+        if len(set(gt_answers)) > 1:
+            gt_answers = [processDigitArticle(processPunctuation(ans)) for ans in gt_answers]
+            res_ans = processDigitArticle(processPunctuation(res_ans))
+        gt_acc = []
+        for k in range(len(gt_answers)):
+            others = gt_answers[:k] + gt_answers[k + 1:]
+            gt_acc.append(min(1, float(sum(ans == res_ans for ans in others)) / 3))
+        accuracy[ques_id] = sum(gt_acc) / len(gt_acc)
+    return accuracy
+
+
+def main():
+    parser = argparse.ArgumentParser(description="VQAEval benchmark")
+    parser.add_argument("--images", type=int, default=20000, help="5 questions per image")
+    parser.add_argument("--reference_images", type=int, default=4000,
+                        help="size of the subset the slow reference is run on")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        for num_images, check in ((args.reference_images, True), (args.images, False)):
+            ann_file, ques_file, res_file = write_synthetic_vqa(folder, num_images)
+            vqa = VQA(ann_file, ques_file, cache_dir=os.path.join(folder, f"cache{num_images}"))
+            vqa_res = vqa.loadRes(res_file, ques_file)
+
+            start = time.perf_counter()
+            evaluator = VQAEval(vqa, vqa_res)
+            acc = evaluator.evaluate()
+            t_first = time.perf_counter() - start
+            start = time.perf_counter()
+            evaluator.evaluate()
+            t_cached = time.perf_counter() - start
+            print(f"{len(acc)} questions: vectorized {t_first:.3f}s first call, {t_cached:.3f}s with cached ground truth")
+
+            if check:
+                start = time.perf_counter()
+                expected = reference_accuracy(vqa, vqa_res)
+                t_ref = time.perf_counter() - start
+                actual = dict(zip(vqa.getQuesIds(), acc.tolist()))
+                assert all(abs(expected[q] - actual[q]) < 1e-12 for q in expected)
+                print(f"{len(acc)} questions: reference {t_ref:.3f}s, results identical, "
+                      f"overall accuracy {evaluator.accuracy['overall']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""Throughput and peak-memory benchmarks of the gaze deliverable and VQA indexing hot paths, checked against stored baselines.
+
+Runs offline on synthetic data (see synthetic.py) sized like VQA-MHUG and VQA v2 val2014.
+
+    python run_benchmarks.py --save           # record baselines.json on this machine (gitignored)
+    python run_benchmarks.py                  # compare with baselines.json, exit 1 on a regression
+    python run_benchmarks.py --scale 0.1 -k vqa
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "datasets", "VQA_MHUG"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "datasets", "VQA_MHUG", "VQA_MHUG"))
+from gaze_index import GazeIndex  # noqa: E402
+from generate_deliverables import (  # noqa: E402
+    downsample, gaussian_heatmap, makeImageHeatmap, makeImageHeatmapGrid, makeScanpath, makeTextHeatmap,
+)
+from scanpath_columns import ScanpathColumns, gridRois, scanpathFeatures  # noqa: E402
+from attention_metrics import alignmentScores, fixationMaps, matchResolution  # noqa: E402
+from synthetic import synthetic_mhug, write_synthetic_vqa  # noqa: E402
+from vqaTools import vqaCache  # noqa: E402
+from vqaTools.vqa import VQA  # noqa: E402
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+
+def machine():
+    """Description of this machine stored with the baselines, timings only compare on the same one."""
+    return {"platform": platform.platform(), "processor": platform.processor(), "cpus": os.cpu_count(),
+            "python": platform.python_version()}
+
+# Full-scale sizes: VQA-MHUG (3990 questions, 3 participants each) and VQA v2 val2014 (~40k images).
+MHUG_QUESTIONS = 3990
+VQA_IMAGES = 40000
+SAMPLES = 300
+
+
+class Case:
+    """One benchmark: `run()` processes `items` units of work (samples, calls, questions)."""
+
+    def __init__(self, name, run, items, unit):
+        self.name = name
+        self.run = run
+        self.items = items
+        self.unit = unit
+
+
+def _on_image(fixations, plate):
+    _, y_min, x_min, y_max, x_max = plate[plate["token"] == "IMG"].values[0]
+    return bool(((x_min <= fixations["x"]) & (fixations["x"] <= x_max) & (y_min <= fixations["y"]) & (fixations["y"] <= y_max)).any())
+
+
+def gaze_cases(scale):
+    gaze, bboxes = synthetic_mhug(max(10, int(MHUG_QUESTIONS * scale)), layout="mhug")
+    img_index = GazeIndex(gaze, plate="imgplate")
+    txt_index = GazeIndex(gaze, plate="txtplate")
+    # samples with at least one fixation on the image, like the ones generate_deliverables writes
+    keys = [key for key in img_index.samples if _on_image(img_index[key], bboxes.loc[key[0]])][:SAMPLES]
+    plates = {qid: bboxes.loc[qid][["token", "ymin", "xmin", "ymax", "xmax"]].values.tolist() for qid, _ in keys}
+    samples = [(img_index[key], txt_index[key], plates[key[0]]) for key in keys]
+    _, y_min, x_min, y_max, x_max = samples[0][2][1]
+    size = (int(x_max - x_min), int(y_max - y_min))
+    rng = np.random.default_rng(0)
+    centers = [(int(rng.integers(size[0])), int(rng.integers(size[1]))) for _ in range(100)]
+    attmaps = [makeImageHeatmap(img, plate) for img, _, plate in samples[:20]]
+    columns = ScanpathColumns.fromIndex(img_index, bboxes)
+    rois = gridRois(3, 3)
+    # human maps of every sample against noisy "model attention" on a 24x24 patch grid
+    reference = matchResolution([makeImageHeatmap(img, plate) for img, _, plate in samples], (24, 24))
+    saliency = reference + rng.random(reference.shape)
+    fixations = fixationMaps(columns, (24, 24), keys)
+    boxes = np.tile([[0.2, 0.2, 0.6, 0.7], [0.5, 0.1, 0.9, 0.4]], (len(samples), 1, 1))
+
+    def image_heatmaps():
+        for img, _, plate in samples:
+            makeImageHeatmap(img, plate)
+
+    def grid_heatmaps():
+        for img, _, plate in samples:
+            makeImageHeatmapGrid(img, plate, (14, 14))
+
+    def text_heatmaps():
+        for _, txt, plate in samples:
+            makeTextHeatmap(txt, plate, True)
+
+    def scanpaths():
+        for img, _, plate in samples:
+            makeScanpath(img, plate)
+
+    def gaussians():
+        for center in centers:
+            gaussian_heatmap(center=center, image_size=size, sig=(39.1, 39.6))
+
+    def downsamples():
+        for _ in range(5):
+            for attmap in attmaps:
+                downsample(attmap, (14, 14))
+
+    return [
+        Case("gaze/GazeIndex", lambda: GazeIndex(gaze, plate="imgplate"), len(img_index), "samples"),
+        Case("gaze/makeImageHeatmap", image_heatmaps, len(samples), "samples"),
+        Case("gaze/makeImageHeatmapGrid", grid_heatmaps, len(samples), "samples"),
+        Case("gaze/makeTextHeatmap", text_heatmaps, len(samples), "samples"),
+        Case("gaze/makeScanpath", scanpaths, len(samples), "samples"),
+        Case("gaze/ScanpathColumns", lambda: ScanpathColumns.fromIndex(img_index, bboxes), len(img_index), "samples"),
+        Case("gaze/scanpathFeatures", lambda: scanpathFeatures(columns, rois), len(columns), "samples"),
+        Case("gaze/gaussian_heatmap", gaussians, len(centers), "calls"),
+        Case("gaze/downsample", downsamples, 5 * len(attmaps), "maps"),
+        Case("gaze/matchResolution", lambda: matchResolution(attmaps, (14, 14)), len(attmaps), "maps"),
+        Case("gaze/alignmentScores", lambda: alignmentScores(saliency, reference, fixations, boxes), len(samples), "samples"),
+    ]
+
+
+def vqa_cases(scale, folder):
+    ann_file, ques_file, _ = write_synthetic_vqa(folder, max(10, int(VQA_IMAGES * scale)))
+    dataset, questions = vqaCache.loadJson(ann_file), vqaCache.loadJson(ques_file)
+    cache_dir = os.path.join(folder, "cache")
+    with contextlib.redirect_stdout(io.StringIO()):
+        vqa = VQA(ann_file, ques_file, cache_dir=cache_dir)
+    count = len(vqa.getQuesIds())
+    rng = np.random.default_rng(0)
+    image_sets = [rng.choice(vqa.imgIds, 20).tolist() for _ in range(1000)]
+
+    def create_index():
+        index = VQA()
+        index.dataset, index.questions = dataset, questions
+        with contextlib.redirect_stdout(io.StringIO()):
+            index.createIndex()
+
+    def load_cached():
+        with contextlib.redirect_stdout(io.StringIO()):
+            VQA(ann_file, ques_file, cache_dir=cache_dir)
+
+    def get_ques_ids():
+        for image_ids in image_sets:
+            vqa.getQuesIds(imgIds=image_ids)
+        for question_type in ["how many", "is the", "what color is the"] * 10:
+            vqa.getQuesIds(quesTypes=question_type)
+
+    return [
+        Case("vqa/createIndex", create_index, count, "questions"),
+        Case("vqa/load_cached", load_cached, count, "questions"),
+        Case("vqa/getQuesIds", get_ques_ids, len(image_sets) + 30, "calls"),
+    ]
+
+
+def measure(case, repeats):
+    """Median/min wall seconds over `repeats` timed runs (after a warm-up) and peak traced MiB of one extra run.
+
+    Peak memory is what tracemalloc sees (Python objects and numpy buffers), torch tensors are not traced.
+    """
+    case.run()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        case.run()
+        times.append(time.perf_counter() - start)
+    # traced separately, tracemalloc slows allocations down
+    tracemalloc.start()
+    case.run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    median = statistics.median(times)
+    return {
+        "median_s": median,
+        "min_s": min(times),
+        "throughput": case.items / median,
+        "unit": f"{case.unit}/s",
+        "peak_mb": peak / (1 << 20),
+    }
+
+
+def regressions(results, baselines, time_tolerance, memory_tolerance):
+    """Messages for every case slower or more memory hungry than its baseline beyond the tolerances."""
+    found = []
+    for name, result in results.items():
+        base = baselines.get(name)
+        if base is None:
+            continue
+        if result["median_s"] > base["median_s"] * (1 + time_tolerance):
+            found.append(f"{name}: {result['median_s'] * 1e3:.1f} ms vs baseline {base['median_s'] * 1e3:.1f} ms")
+        # 1 MiB slack for allocator noise on small cases
+        if result["peak_mb"] > base["peak_mb"] * (1 + memory_tolerance) + 1:
+            found.append(f"{name}: peak {result['peak_mb']:.1f} MiB vs baseline {base['peak_mb']:.1f} MiB")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gaze deliverable and VQA indexing benchmarks")
+    parser.add_argument("-k", dest="select", default="", help="only run cases whose name contains this")
+    parser.add_argument("--scale", type=float, default=1.0, help="dataset size relative to VQA-MHUG / VQA v2 val2014")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--baselines", default=BASELINES)
+    parser.add_argument("--save", action="store_true", help="store the results as the new baselines")
+    parser.add_argument("--time_tolerance", type=float, default=0.3, help="allowed relative slowdown")
+    parser.add_argument("--memory_tolerance", type=float, default=0.2, help="allowed relative peak memory growth")
+    args = parser.parse_args()
+
+    stored = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as f:
+            stored = json.load(f)
+    baselines = {}
+    if not stored:
+        print(f"No baselines in {args.baselines}, record them on this machine with --save.")
+    elif stored.get("machine") != machine():
+        print(f"Baselines were recorded on another machine ({stored.get('machine')}), not comparing; re-record them with --save.")
+    elif stored.get("scale") != args.scale:
+        print(f"Baselines were recorded at scale {stored.get('scale')}, not comparing.")
+    else:
+        baselines = stored.get("results", {})
+
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        groups = [("gaze", lambda: gaze_cases(args.scale)), ("vqa", lambda: vqa_cases(args.scale, folder))]
+        print(f"{'case':<24} {'median ms':>10} {'throughput':>22} {'peak MiB':>9} {'baseline':>9}")
+        for prefix, build in groups:
+            # building fixtures is the slow part, "-k vqa/..." skips the gaze fixtures and vice versa
+            if "/" in args.select and not args.select.startswith(prefix + "/"):
+                continue
+            for case in build():
+                if args.select not in case.name:
+                    continue
+                result = results[case.name] = measure(case, args.repeats)
+                base = baselines.get(case.name)
+                ratio = f"{result['median_s'] / base['median_s']:.2f}x" if base else "-"
+                print(f"{case.name:<24} {result['median_s'] * 1e3:>10.2f} "
+                      f"{result['throughput']:>12.0f} {result['unit']:<9} {result['peak_mb']:>9.1f} {ratio:>9}")
+
+    if args.save:
+        merged = dict(baselines, **results)
+        with open(args.baselines, "w") as f:
+            json.dump({"scale": args.scale, "machine": machine(), "results": merged}, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Saved baselines of {len(results)} cases to {args.baselines}")
+        return
+    found = regressions(results, baselines, args.time_tolerance, args.memory_tolerance)
+    for message in found:
+        print(f"REGRESSION {message}")
+    sys.exit(1 if found else 0)
+
+
+if __name__ == "__main__":
+    main()
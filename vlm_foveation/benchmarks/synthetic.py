@@ -0,0 +1,154 @@
+"""Synthetic VQA-MHUG gaze/bbox pickles and VQA v2 json files for the offline benchmarks.
+
+Schemas and value ranges follow the released pickles: bboxes indexed by question_id with
+token/ymin/xmin/ymax/xmax rows (TXT plate, IMG plate, one row per word), gaze indexed by
+(question_id, participant_id, fix_idx) with both eyes recorded and ~37 accurate-eye fixations
+per sample, 3 participants per question.
+"""
+
+import json
+import os
+import random
+
+import numpy as np
+import pandas as pd
+
+QUESTION_TYPES = {
+    "what is": "other",
+    "what color is the": "other",
+    "how many": "number",
+    "is the": "yes/no",
+    "are there": "yes/no",
+    "what sport is": "other",
+}
+ANSWERS = ["yes", "no", "Yes", "2", "two", "Two.", "3", "three", "red", "Red!", "a dog", "the dog",
+           "dog", "blue", "tennis", "dont know", "1,000", "man's hat", "left", "10"]
+WORDS = ["What", "is", "the", "man", "holding", "in", "his", "hand?", "How", "many", "people", "are", "there?",
+         "Is", "this", "a", "dog?", "color", "of", "shirt?"]
+GAZE_COLUMNS = ["eye", "start", "end", "duration", "x", "y", "pupil", "ppd_x", "ppd_y", "plate",
+                "time_since_plate_onset", "trial_id", "accurate_eye"]
+
+# Plate layout of the two recording setups: (TXT box, IMG box) as ymin, xmin, ymax, xmax.
+LAYOUTS = {
+    # image and question on one plate
+    "mhug-jr": ((760.0, 200.0, 980.0, 1720.0), (100.0, 630.0, 760.0, 1290.0)),
+    # question plate, then image plate, at the same position
+    "mhug": ((210.0, 200.0, 870.0, 1720.0), (210.0, 520.0, 870.0, 1400.0)),
+}
+
+
+def write_synthetic_vqa(folder, num_images, questions_per_image=5, seed=0):
+    """Write annotation, question and result files following the VQA v2 json schema."""
+    rng = random.Random(seed)
+    meta = {"info": {"description": "synthetic VQA"}, "license": {"name": "none"},
+            "data_type": "mscoco", "data_subtype": "val2014"}
+    annotations, questions, results = [], [], []
+    for image_id in rng.sample(range(1, 600000), num_images):
+        for j in range(questions_per_image):
+            question_id = image_id * 1000 + j
+            question_type = rng.choice(list(QUESTION_TYPES))
+            # a few popular answers per question, like real human agreement
+            popular = rng.sample(ANSWERS, 3)
+            answers = [{"answer": rng.choice(popular), "answer_confidence": rng.choice(["yes", "maybe", "no"]),
+                        "answer_id": k + 1} for k in range(10)]
+            annotations.append({"question_type": question_type, "multiple_choice_answer": answers[0]["answer"],
+                                "answers": answers, "image_id": image_id,
+                                "answer_type": QUESTION_TYPES[question_type], "question_id": question_id})
+            questions.append({"image_id": image_id, "question": f"{question_type} {j}?", "question_id": question_id})
+            results.append({"question_id": question_id, "answer": rng.choice(popular + ANSWERS[:4])})
+    paths = [os.path.join(folder, name) for name in ("annotations.json", "questions.json", "results.json")]
+    for path, data in zip(paths, (dict(meta, annotations=annotations),
+                                  dict(meta, task_type="Open-Ended", questions=questions), results)):
+        with open(path, "w") as f:
+            json.dump(data, f)
+    return paths
+
+
+def synthetic_bboxes(question_ids, rng, layout="mhug-jr"):
+    """bboxes pickle frame: TXT and IMG plate boxes plus 3-22 word boxes per question."""
+    (txt, img) = LAYOUTS[layout]
+    rows, index = [], []
+    for qid in question_ids:
+        rows += [["TXT", *txt], ["IMG", *img]]
+        index += [qid, qid]
+        num_words = int(np.clip(rng.normal(6.7, 2.4), 3, 22))
+        left = txt[1] + 60.0
+        top = txt[0] + 65.0 if layout == "mhug-jr" else 487.5
+        for word in rng.choice(WORDS, size=num_words):
+            width = 22.0 * len(word) + 20.0
+            if left + width > txt[3]:
+                left, top = txt[1] + 60.0, top + 105.0
+            rows.append([str(word), top, left, top + 90.0, left + width])
+            index.append(qid)
+            left += width + 15.0
+    frame = pd.DataFrame(rows, columns=["token", "ymin", "xmin", "ymax", "xmax"])
+    frame.index = pd.Index(index, name="question_id")
+    return frame
+
+
+def synthetic_gaze(bboxes, participants, rng, fixations=37, layout="mhug-jr"):
+    """Gaze pickle frame for every question of `bboxes`, participants[i] being the list of participant ids of question i.
+
+    Both eyes are recorded per fixation; for mhug the fixations are split between the text and
+    the image plate, for mhug-jr they share one plate. A few fixations fall off the image box.
+    """
+    question_ids = bboxes.index.unique()
+    plates = np.array(("plate",) if layout == "mhug-jr" else ("txtplate", "imgplate"))
+    keys = [(qid, pid) for qid, pids in zip(question_ids, participants) for pid in pids]
+    counts = np.maximum(4, rng.gamma(4.5, fixations / 4.5, len(keys)).astype(np.int64))
+    sample = np.repeat(np.arange(len(keys)), counts)
+    total = len(sample)
+    first = np.repeat(np.cumsum(counts) - counts, counts)
+    duration = np.round(rng.gamma(2.6, 86.0, total)) + 2.0
+    start = 8.0e6 + np.cumsum(duration + rng.integers(20, 60, total))
+    accurate = np.array(["L", "R"])[rng.integers(0, 2, len(keys))][sample]
+    columns = {
+        "question_id": np.array([qid for qid, _ in keys])[sample],
+        "participant_id": np.array([pid for _, pid in keys])[sample],
+        "fix_idx": np.arange(total) - first + 1,
+        "start": start,
+        "end": start + duration,
+        "duration": duration,
+        "x": rng.normal(940.0, 260.0, total).clip(214, 2015).astype(np.int64),
+        "y": rng.normal(690.0, 220.0, total).clip(47, 1120).astype(np.int64),
+        "ppd_x": rng.normal(58.7, 0.56, total).round(1),
+        "ppd_y": rng.normal(59.4, 0.57, total).round(1),
+        "plate": plates[rng.integers(0, len(plates), total)],
+        "time_since_plate_onset": start - start[first],
+        "trial_id": (sample + 1).astype(str),
+        "accurate_eye": accurate,
+    }
+    eyes = []
+    for eye in "LR":
+        frame = pd.DataFrame(columns)
+        frame["eye"] = eye
+        # the other eye sees roughly the same place
+        other = accurate != eye
+        jitter = rng.integers(-12, 12, total) * other
+        frame["x"] += jitter
+        frame["y"] += jitter
+        frame["pupil"] = rng.normal(645.0, 175.0, total).clip(263, 1602)
+        eyes.append(frame)
+    gaze = pd.concat(eyes, ignore_index=True).sort_values(["question_id", "participant_id", "fix_idx"], kind="stable")
+    return gaze.set_index(["question_id", "participant_id", "fix_idx"])[GAZE_COLUMNS]
+
+
+def synthetic_mhug(num_questions, layout="mhug-jr", participants_per_question=3, fixations=37, seed=0):
+    """(gaze, bboxes) frames of a synthetic VQA-MHUG-like dataset, VQA style question ids."""
+    rng = np.random.default_rng(seed)
+    image_ids = rng.choice(np.arange(1, 600000), size=num_questions, replace=False)
+    question_ids = (image_ids * 1000 + rng.integers(0, 5, num_questions)).tolist()
+    bboxes = synthetic_bboxes(question_ids, rng, layout)
+    pool = np.arange(1, 50)
+    participants = [sorted(rng.choice(pool, participants_per_question, replace=False).tolist()) for _ in question_ids]
+    return synthetic_gaze(bboxes, participants, rng, fixations, layout), bboxes
+
+
+def write_synthetic_mhug(folder, dataset, num_questions, seed=0):
+    """Write <dataset>_gaze.pickle and <dataset>_bboxes.pickle, returns their paths."""
+    layout = "mhug-jr" if "jr" in dataset else "mhug"
+    gaze, bboxes = synthetic_mhug(num_questions, layout, seed=seed)
+    paths = [os.path.join(folder, f"{dataset}_{kind}.pickle") for kind in ("gaze", "bboxes")]
+    gaze.to_pickle(paths[0])
+    bboxes.to_pickle(paths[1])
+    return paths
@@ -0,0 +1,340 @@
+import glob, os, json, argparse
+import numpy as np
+from deliverable_store import PackedStoreReader
+from attmap_resize import resizeMaps
+
+#floor of the log ratio and the divisions, as in the MIT saliency benchmark
+EPS = np.finfo(np.float64).eps
+
+def matchResolution(maps, size):
+    '''
+    Bilinearly scale 2D maps of any resolutions to size=(height, width), as an (N, height, width) stack.
+    Maps larger than size are interpolated one by one straight from their memory (copying them into a batch
+    costs more than the interpolation), smaller ones in one resizeMaps call per distinct resolution.
+    Maps already at size are copied as they are.
+    '''
+    maps = [np.asarray(attmap) for attmap in maps]
+    size = tuple(int(side) for side in size)
+    dtype = np.result_type(np.float32, *(attmap.dtype for attmap in maps))
+    interpolate = lambda batch: resizeMaps(batch, size)
+    stack = np.zeros((len(maps), *size), dtype=dtype)
+    by_shape = {}
+    for i, attmap in enumerate(maps):
+        #read-only maps (e.g. PackedStoreReader views) are copied by resizeMaps anyway, they go through the batch copy
+        if attmap.shape != size and attmap.size > stack[0].size and attmap.flags.writeable:
+            stack[i] = interpolate(attmap[None].astype(dtype, copy=False))[0]
+        else:
+            by_shape.setdefault(attmap.shape, []).append(i)
+    for shape, rows in by_shape.items():
+        batch = np.stack([maps[i] for i in rows]).astype(dtype, copy=False)
+        stack[rows] = batch if shape == size else interpolate(batch)
+    return stack
+
+def padMaps(maps, length=None):
+    '''
+    1D maps of different lengths (txt-attmap, one value per word) as a zero padded (N, length) stack
+    and the (N, length) mask of real entries, to be passed as mask to the metrics
+    '''
+    lengths = np.array([len(attmap) for attmap in maps], dtype=np.int64)
+    length = int(lengths.max(initial=0)) if length is None else length
+    mask = np.arange(length) < lengths[:, None]
+    stack = np.zeros((len(maps), length))
+    stack[mask] = np.concatenate([np.asarray(attmap, dtype=np.float64) for attmap in maps]) if len(maps) else []
+    return stack, mask
+
+def _flat(maps, mask=None):
+    '''
+    (N, P) float64 values and (N, P) weights (1 for real entries) of a stack of maps
+    '''
+    values = np.asarray(maps, dtype=np.float64).reshape(len(maps), -1)
+    weights = np.ones_like(values) if mask is None else np.asarray(mask, dtype=np.float64).reshape(len(maps), -1)
+    return values * weights, weights
+
+def _distribution(maps, mask=None):
+    '''
+    Every map scaled to sum 1, NaN rows for maps without any mass
+    '''
+    values, _ = _flat(maps, mask)
+    total = values.sum(axis=1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(total > 0, values / total, np.nan)
+
+def _standardized(maps, mask=None):
+    '''
+    Every map shifted and scaled to zero mean, unit standard deviation over its real entries (masked entries 0)
+    '''
+    values, weights = _flat(maps, mask)
+    count = weights.sum(axis=1, keepdims=True)
+    mean = values.sum(axis=1, keepdims=True) / count
+    centered = (values - mean) * weights
+    std = np.sqrt((centered**2).sum(axis=1, keepdims=True) / count)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return centered / std
+
+def cc(saliency, reference, mask=None):
+    '''
+    Pearson correlation coefficient of every pair of maps, NaN if one of them is constant
+    '''
+    s, r = _standardized(saliency, mask), _standardized(reference, mask)
+    _, weights = _flat(reference, mask)
+    return (s * r).sum(axis=1) / weights.sum(axis=1)
+
+def kld(saliency, reference, mask=None):
+    '''
+    KL divergence of the saliency distribution from the reference distribution (lower is better)
+    '''
+    p, q = _distribution(reference, mask), _distribution(saliency, mask)
+    return (p * np.log(EPS + p / (q + EPS))).sum(axis=1)
+
+def sim(saliency, reference, mask=None):
+    '''
+    Similarity (histogram intersection) of the two maps as distributions, 1 for identical ones
+    '''
+    return np.minimum(_distribution(saliency, mask), _distribution(reference, mask)).sum(axis=1)
+
+def nss(saliency, fixations, mask=None):
+    '''
+    Normalized scanpath saliency: mean of the standardized saliency map over the fixations,
+    fixations are (N, ...) fixation counts per pixel (see fixationMaps). NaN without fixations.
+    '''
+    counts, _ = _flat(fixations, mask)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (_standardized(saliency, mask) * counts).sum(axis=1) / counts.sum(axis=1)
+
+def aucJudd(saliency, fixations, mask=None):
+    '''
+    AUC-Judd of every saliency map: ROC area with the saliency values at the fixated pixels as thresholds,
+    true positives the fixated, false positives the other pixels above the threshold (ties count as above).
+    NaN for maps without fixated or without other pixels.
+    '''
+    values, weights = _flat(saliency, mask)
+    fixated = (_flat(fixations, mask)[0] > 0)
+    #masked entries sort last and are never above a threshold
+    values = np.where(weights > 0, values, -np.inf)
+    order = np.argsort(-values, axis=1, kind='stable')
+    values = np.take_along_axis(values, order, axis=1)
+    fixated = np.take_along_axis(fixated, order, axis=1)
+    n, p = values.shape
+    #position of the last pixel tied with every pixel = number of pixels above its threshold - 1
+    with np.errstate(invalid='ignore'):
+        last = np.where(np.diff(values, axis=1, append=-np.inf) != 0, np.arange(p), p)
+    last = np.minimum.accumulate(last[:, ::-1], axis=1)[:, ::-1]
+    fixation_count = fixated.sum(axis=1)
+    other_count = weights.sum(axis=1) - fixation_count
+    sample, position = np.nonzero(fixated)
+    #i-th fixated pixel of its map (in descending saliency): tp = i / fixations, fp = (above - i) / others
+    rank = np.cumsum(fixated, axis=1)[sample, position]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        tp = rank / fixation_count[sample]
+        fp = (last[sample, position] + 1 - rank) / other_count[sample]
+    #trapezoids between consecutive points of a map, from (0, 0) and to (1, 1)
+    first = np.ones(len(sample), dtype=bool)
+    first[1:] = sample[1:] != sample[:-1]
+    tp_before = np.where(first, 0, np.roll(tp, 1))
+    fp_before = np.where(first, 0, np.roll(fp, 1))
+    area = np.bincount(sample, weights=(fp - fp_before) * (tp + tp_before) / 2, minlength=n)
+    #closing segment from the last point of every map to (1, 1)
+    end = np.ones(len(sample), dtype=bool)
+    end[:-1] = first[1:]
+    area += np.bincount(sample[end], weights=(1 - fp[end]) * (1 + tp[end]) / 2, minlength=n)
+    return np.where((fixation_count > 0) & (other_count > 0), area, np.nan)
+
+def boxMasks(boxes, size, box_valid=None):
+    '''
+    (N, height, width) masks of the pixels whose centers lie in any of the (N, K, 4) normalized
+    xmin, ymin, xmax, ymax boxes of a sample, box_valid (N, K) marks real boxes of padded ones
+    '''
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(len(boxes), -1, 4)
+    valid = np.ones(boxes.shape[:2], dtype=bool) if box_valid is None else np.asarray(box_valid, dtype=bool)
+    height, width = size
+    x = (np.arange(width) + 0.5) / width
+    y = (np.arange(height) + 0.5) / height
+    #a pixel is covered if its row and its column lie in the same box, i.e. (rows x K) @ (K x columns) > 0
+    in_x = (boxes[..., 0:1] <= x) & (x <= boxes[..., 2:3]) & valid[..., None]
+    in_y = (boxes[..., 1:2] <= y) & (y <= boxes[..., 3:4])
+    return np.matmul(in_y.transpose(0, 2, 1).astype(np.float32), in_x.astype(np.float32)) > 0
+
+def boxIou(maps, boxes, box_valid=None, threshold=0.5):
+    '''
+    IoU of the union of every sample's boxes with the region where its map is >= threshold * map maximum
+    (the region GazeTargetConverter draws its boxes around). NaN if both are empty.
+    '''
+    maps = np.asarray(maps, dtype=np.float64)
+    peak = maps.reshape(len(maps), -1).max(axis=1, initial=0)
+    region = (maps >= threshold * peak[:, None, None]) & (peak[:, None, None] > 0)
+    covered = boxMasks(boxes, maps.shape[1:], box_valid)
+    intersection = (region & covered).sum(axis=(1, 2))
+    union = (region | covered).sum(axis=(1, 2))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return intersection / union
+
+def fixationMaps(scanpaths, size, keys=None):
+    '''
+    (N, height, width) fixation counts per pixel of a ScanpathColumns (the samples of keys, default all,
+    samples missing from it get an empty map) or of a list of scanpaths in the deliverable format
+    (list of x, y, duration, pupil dicts, None for breaks). Fixations off the image are left out.
+    '''
+    height, width = size
+    if hasattr(scanpaths, 'columns'):
+        if keys is None:
+            keys = scanpaths.keys
+        positions = [scanpaths.index.get(tuple(key)) for key in keys]
+        starts = np.array([0 if i is None else scanpaths.offsets[i] for i in positions], dtype=np.int64)
+        lengths = np.array([0 if i is None else scanpaths.offsets[i+1] - scanpaths.offsets[i] for i in positions], dtype=np.int64)
+        ends = np.cumsum(lengths)
+        rows = np.repeat(starts - (ends - lengths), lengths) + np.arange(ends[-1] if len(ends) else 0)
+        sample = np.repeat(np.arange(len(keys)), lengths)
+        on_image = ~np.asarray(scanpaths.breaks)[rows]
+        x, y = np.asarray(scanpaths.columns['x'])[rows], np.asarray(scanpaths.columns['y'])[rows]
+        count = len(keys)
+    else:
+        fixations = [(i, fixation['x'], fixation['y']) for i, scanpath in enumerate(scanpaths) for fixation in scanpath if fixation is not None]
+        sample, x, y = (np.array(column, dtype=np.float64).reshape(-1) for column in zip(*fixations)) if fixations else (np.zeros(0),)*3
+        sample = sample.astype(np.int64)
+        on_image = np.ones(len(sample), dtype=bool)
+        count = len(scanpaths)
+    #breaks of the columns and unexpected values of the lists alike
+    on_image &= (0 <= x) & (x <= 1) & (0 <= y) & (y <= 1)
+    row = np.minimum((y[on_image] * height).astype(np.int64), height-1)
+    col = np.minimum((x[on_image] * width).astype(np.int64), width-1)
+    flat = (sample[on_image] * height + row) * width + col
+    return np.bincount(flat, minlength=count*height*width).reshape(count, height, width)
+
+def alignmentScores(saliency, reference, fixations=None, boxes=None, box_valid=None, mask=None, threshold=0.5):
+    '''
+    All metrics that the given inputs allow, for N samples at once, as a dict of (N,) arrays:
+    cc, kld, sim: saliency (e.g. model attention) against the reference (e.g. human img-/txt-attmap) maps
+    nss, auc_judd: saliency against the (N, ...) fixation counts (see fixationMaps)
+    box_iou: (N, K, 4) boxes (e.g. Grounding DINO's) against the reference maps thresholded at threshold * max
+    Maps must share one resolution (see matchResolution, padMaps and its mask for text maps).
+    '''
+    scores = {}
+    if saliency is not None:
+        scores['cc'] = cc(saliency, reference, mask)
+        scores['kld'] = kld(saliency, reference, mask)
+        scores['sim'] = sim(saliency, reference, mask)
+        if fixations is not None:
+            scores['nss'] = nss(saliency, fixations, mask)
+            scores['auc_judd'] = aucJudd(saliency, fixations, mask)
+    if boxes is not None:
+        scores['box_iou'] = boxIou(reference, boxes, box_valid, threshold)
+    return scores
+
+def readMaps(path, keys=None):
+    '''
+    ((qid, pid) keys, maps) of an img-attmap or txt-attmap folder written by generate_deliverables,
+    one file per sample or --STORE packed shards (memory mapped). keys defaults to all samples, sorted.
+    '''
+    if glob.glob(os.path.join(path, 'part-*.index')):
+        reader = PackedStoreReader(path)
+        keys = sorted(reader.keys()) if keys is None else [(str(qid), str(pid)) for qid, pid in keys]
+        return keys, [reader[key] for key in keys]
+    if keys is None:
+        names = sorted(os.path.basename(name)[1:-4] for name in glob.glob(os.path.join(path, 'q*_p*.npy')))
+        keys = [tuple(name.split('_p')) for name in names]
+    keys = [(str(qid), str(pid)) for qid, pid in keys]
+    return keys, [np.load(os.path.join(path, f'q{qid}_p{pid}.npy')) for qid, pid in keys]
+
+def scoreDeliverables(reference_path, saliency_path=None, size=None, scanpaths=None, boxes=None, threshold=0.5):
+    '''
+    Score every sample of a reference attention map folder (see readMaps) in one batch.
+    saliency_path: maps to compare in the same layout, matched by (qid, pid) or else by qid alone
+        (e.g. one model attention map per question, stored under any pid), unmatched samples are left out
+    size: (height, width) all image maps are scaled to, default the resolution of the first saliency
+        (else reference) map; text maps are padded instead
+    scanpaths: ScanpathColumns of the same condition for nss and auc_judd
+    boxes: {qid: list of normalized xmin, ymin, xmax, ymax boxes} for box_iou, NaN for qids not in it
+    Returns (keys, alignmentScores dict).
+    '''
+    keys, reference = readMaps(reference_path)
+    saliency = None
+    if saliency_path is not None:
+        saliency_keys, saliency_maps = readMaps(saliency_path)
+        by_key = dict(zip(saliency_keys, saliency_maps))
+        by_qid = {}
+        for (qid, _), attmap in zip(saliency_keys, saliency_maps):
+            by_qid.setdefault(qid, attmap)
+        matched = [(key, attmap, by_key.get(key, by_qid.get(key[0]))) for key, attmap in zip(keys, reference)]
+        matched = [sample for sample in matched if sample[2] is not None]
+        keys, reference, saliency = ([sample[i] for sample in matched] for i in range(3))
+    mask = None
+    if reference and np.ndim(reference[0]) == 1:
+        length = max(len(attmap) for attmap in reference + (saliency or []))
+        reference, mask = padMaps(reference, length)
+        if saliency is not None:
+            saliency, _ = padMaps(saliency, length)
+    elif reference:
+        if size is None:
+            size = np.shape((saliency or reference)[0])
+        reference = matchResolution(reference, size)
+        if saliency is not None:
+            saliency = matchResolution(saliency, size)
+    fixations = None
+    if scanpaths is not None and mask is None and saliency is not None:
+        fixations = fixationMaps(scanpaths, reference.shape[1:], keys)
+    box_valid = missing = None
+    if boxes is not None and mask is None:
+        missing = np.array([qid not in boxes for qid, _ in keys], dtype=bool)
+        sample_boxes = [boxes.get(qid, []) for qid, _ in keys]
+        count = max([1] + [len(box_list) for box_list in sample_boxes])
+        box_valid = np.arange(count) < np.array([len(box_list) for box_list in sample_boxes])[:, None]
+        boxes = np.zeros((len(keys), count, 4))
+        boxes[box_valid] = [box for box_list in sample_boxes for box in box_list] or np.zeros((0, 4))
+    else:
+        boxes = None
+    scores = alignmentScores(saliency, reference, fixations, boxes, box_valid, mask, threshold)
+    if missing is not None:
+        #no entry is no prediction, unlike an empty list
+        scores['box_iou'][missing] = np.nan
+    return keys, scores
+
+def parse_args():
+    '''
+    Parse input arguments
+    '''
+    parser = argparse.ArgumentParser(description='Alignment of model attention or boxes with VQA-MHUG attention maps')
+    parser.add_argument('--REFERENCE',
+                        dest='REFERENCE',
+                        help='img-attmap or txt-attmap folder written by generate_deliverables',
+                        required=True)
+    parser.add_argument('--SALIENCY',
+                        dest='SALIENCY',
+                        help='Folder of maps to compare in the same layout (q{qid}_p{pid}.npy files or packed shards), matched by (qid, pid) or else by qid')
+    parser.add_argument('--SCANPATHS',
+                        dest='SCANPATHS',
+                        help='scanpath-columns folder of the same condition, adds nss and auc_judd')
+    parser.add_argument('--BOXES',
+                        dest='BOXES',
+                        help='JSON file of {qid: [[xmin, ymin, xmax, ymax], ...]} normalized boxes (e.g. Grounding DINO predictions), adds box_iou')
+    parser.add_argument('--SIZE',
+                        dest='SIZE',
+                        help='Height and width all image maps are scaled to, default the resolution of the saliency maps',
+                        nargs=2,
+                        type=int)
+    parser.add_argument('--THRESHOLD',
+                        dest='THRESHOLD',
+                        help='Reference maps are thresholded at this fraction of their maximum for box_iou',
+                        type=float,
+                        default=0.5)
+    parser.add_argument('--OUT',
+                        dest='OUT',
+                        help='CSV file with the scores of every sample')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    scanpaths = boxes = None
+    if args.SCANPATHS:
+        from scanpath_columns import ScanpathColumns
+        scanpaths = ScanpathColumns.load(args.SCANPATHS)
+    if args.BOXES:
+        with open(args.BOXES, 'r') as f:
+            boxes = json.load(f)
+    keys, scores = scoreDeliverables(args.REFERENCE, args.SALIENCY, args.SIZE, scanpaths, boxes, args.THRESHOLD)
+    print(f'{len(keys)} samples')
+    for name, values in scores.items():
+        print(f'{name:>9}: {np.nanmean(values):.4f} (mean of {np.count_nonzero(~np.isnan(values))} samples)')
+    if args.OUT:
+        import pandas as pd
+        index = pd.MultiIndex.from_tuples(keys, names=['qid', 'pid'])
+        pd.DataFrame(scores, index=index).to_csv(args.OUT)
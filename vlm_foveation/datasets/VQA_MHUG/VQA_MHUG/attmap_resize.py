@@ -0,0 +1,17 @@
+'''
+Bilinear resizing of attention maps, shared by the deliverable generator and attention_metrics.
+'''
+import numpy as np
+
+def resizeMaps(batch, size):
+    '''
+    Bilinearly scale an (N, H, W) stack of maps to size=(height, width), as F.interpolate with align_corners=False.
+    Keeps the float dtype of batch.
+    '''
+    import torch
+    import torch.nn.functional as F
+    batch = np.asarray(batch)
+    #from_numpy shares the memory of writeable arrays, read-only ones (mmap views) are copied
+    batch = batch if batch.flags.writeable else batch.copy()
+    size = tuple(int(side) for side in size)
+    return F.interpolate(torch.from_numpy(batch).unsqueeze(1), size=size, mode='bilinear', align_corners=False).squeeze(1).numpy()
@@ -0,0 +1,136 @@
+import glob, os, json, time
+import numpy as np
+
+class FileStore:
+    '''
+    One file per sample: q{qid}_p{pid}.npy for attention maps, extension-less JSON q{qid}_p{pid} for scanpaths
+    '''
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, qid, pid, value):
+        if isinstance(value, np.ndarray):
+            self._save(f'{self.path}/q{qid}_p{pid}.npy', lambda f: np.save(f, value), 'wb')
+        else:
+            self._save(f'{self.path}/q{qid}_p{pid}', lambda f: json.dump(value, f), 'w')
+
+    def _save(self, path, write, mode):
+        # write to a temporary file and rename it, so a killed run never leaves a truncated output behind
+        with open(f'{path}.tmp', mode) as f:
+            write(f)
+        os.replace(f'{path}.tmp', path)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def clear(path):
+        pass #every sample file is overwritten anyway
+
+class PackedStore:
+    '''
+    All samples of a dataset/format packed into a few large shard files.
+    Every writing process appends to its own part-*.bin and records (qid, pid) -> offset, dtype, shape
+    in the matching part-*.index once the bytes are on disk. Shards roll over after max_shard_bytes.
+    '''
+    ALIGN = 64
+
+    def __init__(self, path, max_shard_bytes=1 << 30):
+        self.path = path
+        self.max_shard_bytes = max_shard_bytes
+        self.data = self.index = None
+
+    @staticmethod
+    def clear(path):
+        '''
+        Remove the shards of a previous run, otherwise the reader would merge them with the new ones
+        '''
+        for shard in glob.glob(os.path.join(path, 'part-*')):
+            os.remove(shard)
+
+    def _open_shard(self):
+        self.close()
+        #names sort in creation order, so the reader can let later entries win
+        name = os.path.join(self.path, f'part-{time.time_ns()}-{os.getpid()}')
+        self.data = open(f'{name}.bin', 'wb')
+        self.index = open(f'{name}.index', 'w')
+
+    def write(self, qid, pid, value):
+        if isinstance(value, np.ndarray):
+            value = np.ascontiguousarray(value)
+            payload, dtype, shape = value.tobytes(), value.dtype.str, value.shape
+        else:
+            payload, dtype, shape = json.dumps(value).encode('utf-8'), 'json', ()
+        if self.data is None or self.data.tell() >= self.max_shard_bytes:
+            self._open_shard()
+        offset = self.data.tell()
+        offset += -offset % self.ALIGN
+        self.data.seek(offset)
+        self.data.write(payload)
+        self.index.write(json.dumps([str(qid), str(pid), offset, len(payload), dtype, list(shape)]) + '\n')
+
+    def flush(self):
+        # index entries must never point to bytes that are not on disk yet
+        if self.data is not None:
+            self.data.flush()
+            self.index.flush()
+
+    def close(self):
+        if self.data is not None:
+            self.flush()
+            self.data.close()
+            self.index.close()
+            self.data = self.index = None
+
+class PackedStoreReader:
+    '''
+    Serves single samples of a PackedStore by (qid, pid) through mmap, without loading the shards.
+    Keys are compared as strings; if a sample was written twice (resumed run) the last entry wins.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.shards = {}
+        for index_file in sorted(glob.glob(os.path.join(path, 'part-*.index'))):
+            shard = index_file[:-len('.index')] + '.bin'
+            with open(index_file, 'r') as f:
+                for line in f:
+                    try:
+                        qid, pid, offset, size, dtype, shape = json.loads(line)
+                    except ValueError:
+                        continue #last line of a killed writer
+                    self.entries[qid, pid] = (shard, offset, size, dtype, tuple(shape))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return tuple(str(k) for k in key) in self.entries
+
+    def keys(self):
+        return self.entries.keys()
+
+    def _shard(self, shard):
+        if shard not in self.shards:
+            self.shards[shard] = np.memmap(shard, dtype=np.uint8, mode='r')
+        return self.shards[shard]
+
+    def __getitem__(self, key):
+        '''
+        Read-only array view into the shard for attention maps, decoded JSON for scanpaths
+        '''
+        shard, offset, size, dtype, shape = self.entries[tuple(str(k) for k in key)]
+        if size == 0:
+            return np.empty(shape, dtype=np.dtype(dtype))
+        payload = self._shard(shard)[offset:offset+size]
+        if dtype == 'json':
+            return json.loads(payload.tobytes().decode('utf-8'))
+        return payload.view(np.dtype(dtype)).reshape(shape)
+
+STORES = {
+    'files': FileStore,
+    'packed': PackedStore
+}
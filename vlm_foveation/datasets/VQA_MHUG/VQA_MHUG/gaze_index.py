@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+
+FIELDS = ('x', 'y', 'ppd_x', 'ppd_y', 'duration', 'pupil')
+
+class GazeIndex:
+    '''
+    Fixations of the accurate eye on one plate, grouped by (qid, pid) into contiguous column arrays.
+    Built once per dataset, so per-sample access is a dict lookup and a slice instead of a DataFrame.query.
+    '''
+    def __init__(self, gaze_data, plate):
+        frame = gaze_data[(gaze_data['accurate_eye'] == gaze_data['eye']) & (gaze_data['plate'] == plate)]
+        codes, keys = pd.factorize(frame.index.droplevel(-1), sort=True)
+        order = np.argsort(codes, kind='stable')
+        #columns[field][offsets[i]:offsets[i+1]] are the fixations of sample keys[i] in recording order
+        self.columns = {field: np.ascontiguousarray(frame[field].to_numpy(dtype=np.float64)[order]) for field in FIELDS}
+        self.offsets = np.zeros(len(keys)+1, dtype=np.int64)
+        np.cumsum(np.bincount(codes, minlength=len(keys)), out=self.offsets[1:])
+        self.samples = list(keys)
+        self.keys = {key: i for i, key in enumerate(self.samples)}
+        #samples are sorted, so all participants of a question are the contiguous range questions[qid]
+        self.questions = {}
+        for i, (qid, _) in enumerate(self.samples):
+            first, _ = self.questions.get(qid, (i, i))
+            self.questions[qid] = (first, i+1)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def span(self, key):
+        '''
+        (start, stop) of a sample in the column arrays, (0, 0) if it has no fixations on the plate
+        '''
+        i = self.keys.get(key)
+        return (0, 0) if i is None else (self.offsets[i], self.offsets[i+1])
+
+    def __getitem__(self, key):
+        '''
+        Fixations of (qid, pid) as a dict of array views, empty arrays if it has no fixations on the plate
+        '''
+        start, stop = self.span(key)
+        return {field: column[start:stop] for field, column in self.columns.items()}
+
+    def question(self, qid):
+        '''
+        All participants of qid at once: (pids, concatenated fixations as dict of array views, offsets)
+        Participant pids[i] owns fixations[field][offsets[i]:offsets[i+1]]
+        '''
+        first, last = self.questions.get(qid, (0, 0))
+        start, stop = self.offsets[first], self.offsets[last]
+        pids = [pid for _, pid in self.samples[first:last]]
+        fixations = {field: column[start:stop] for field, column in self.columns.items()}
+        return pids, fixations, self.offsets[first:last+1] - start
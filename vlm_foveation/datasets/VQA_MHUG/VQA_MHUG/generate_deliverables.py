@@ -1,8 +1,12 @@
-import glob, os, json, argparse, torch
+import glob, os, sys, json, math, argparse
+import multiprocessing as mp
 import pandas as pd
 import numpy as np
-import torch.nn.functional as F
 from tqdm import tqdm
+from gaze_index import GazeIndex
+from deliverable_store import STORES
+from scanpath_columns import ScanpathColumns, normalizeFixations
+from attmap_resize import resizeMaps
 
 PATHS = {
     'vqa-mhug': ['mhug/vqa-mhug_gaze.pickle', 'mhug/vqa-mhug_bboxes.pickle'],
@@ -11,6 +15,9 @@ PATHS = {
     'air-mhug-jr': ['mhug-jr/air-mhug-jr_gaze.pickle', 'mhug-jr/air-mhug-jr_bboxes.pickle']
 }
 
+# Formats built for the whole dataset at once instead of per sample
+DATASET_FORMATS = ('scanpath-columns',)
+
 def parse_args():
     '''
     Parse input arguments
@@ -28,7 +35,8 @@ def parse_args():
                         dest='FORMATS',
                         nargs='+',
                         type=str,
-                        choices=['img-attmap', 'txt-attmap', 'scanpath'],
+                        choices=['img-attmap', 'txt-attmap', 'scanpath', 'scanpath-columns'],
+                        help='scanpath-columns: the image scanpaths of all samples as float32 column arrays in one folder per dataset (read back with scanpath_columns.ScanpathColumns.load)',
                         required=True)
     
     parser.add_argument('--OUT_PATH',
@@ -54,45 +62,159 @@ def parse_args():
                         nargs='+',
                         type=int)
     
+    parser.add_argument('--ATTMAP_MODE',
+                        dest='ATTMAP_MODE',
+                        type=str,
+                        choices=['bilinear', 'area', 'full'],
+                        help='How maps are scaled to ATTMAP_SIZE: full renders at stimulus size and downsamples (previous output); bilinear / area render directly on the grid '
+                             '(much faster) with bilinear sampling or anti-aliased cell averages, as float32 normalized to the max of the grid instead of the full resolution map, '
+                             'and all zeros instead of NaN for samples without fixations on the image',
+                        default='full')
+    
+    parser.add_argument('--WORKERS',
+                        dest='WORKERS',
+                        type=int,
+                        help='Number of worker processes the samples are sharded across',
+                        default=1)
+    
+    parser.add_argument('--STORE',
+                        dest='STORE',
+                        type=str,
+                        choices=list(STORES),
+                        help='files: one file per sample, packed: few large shard files per format with a (qid, pid) index (read back with deliverable_store.PackedStoreReader)',
+                        default='files')
+    
+    parser.add_argument('--RESUME',
+                        dest='RESUME',
+                        action='store_true',
+                        help='Skip samples that are already listed in the per-format manifest of a previous (killed) run')
+    
     args = parser.parse_args()
     return args
 
+def wordBoxes(bboxes):
+    '''
+    Word token boxes bboxes[2:] as one (N, 4) array of top, left, line_height, word_width, built once per question
+    '''
+    return np.array([box[1:] for box in bboxes[2:]], dtype=np.float64).reshape(-1, 4)
+
 def makeTextHeatmap(fixations, bboxes, duration_scaled):
     '''
     Sum up durations of fixations per word bounding box.
     Returns sequence of fixation durations in same length as sentence.
     '''
-    #fixations are dicts of x,y,duration
-    #bboxes are list of TXT, IMG, [N word tokens] each a list of identifier, top, left, line_height, word_width (for image it's ymin, xmin, ymax, xmax)
-    heatmap = np.zeros(len(bboxes)-2)
-    for fix in fixations: 
-        for t, (_, y, x, h, w) in enumerate(bboxes[2:]):
-            if (x <= fix['x'] <= (x+w)) and (y <= fix['y'] <= (y+h)):
-                if duration_scaled:
-                    heatmap[t] += fix['duration']
-                else:
-                    heatmap[t] += 1
-    return heatmap
+    offsets = np.array([0, len(fixations['x'])])
+    return makeTextHeatmaps(fixations, offsets, wordBoxes(bboxes), duration_scaled)[0]
+
+def makeTextHeatmaps(fixations, offsets, words, duration_scaled):
+    '''
+    Text heatmaps of all participants of one question in a single pass (see GazeIndex.question).
+    Participant i owns fixations[offsets[i]:offsets[i+1]], words is the wordBoxes array of the question.
+    Returns (participants, N word tokens) array of summed durations (or fixation counts).
+    '''
+    #fixations are dicts of x,y,duration arrays (see GazeIndex)
+    #words are rows of top, left, line_height, word_width, a fixation counts for every box it falls into
+    fix_x = fixations['x'][:, None]
+    fix_y = fixations['y'][:, None]
+    y, x, h, w = words.T
+    hits = ((x <= fix_x) & (fix_x <= (x+w)) & (y <= fix_y) & (fix_y <= (y+h))).astype(np.float64)
+    if duration_scaled:
+        hits *= fixations['duration'][:, None]
+    participant = np.repeat(np.arange(len(offsets)-1), np.diff(offsets))
+    heatmaps = np.zeros((len(offsets)-1, len(words)))
+    np.add.at(heatmaps, participant, hits)
+    return heatmaps
 
 def makeImageHeatmap(fixations, bboxes, duration_scaled=True):
-    #fixations are dicts of x,y,duration
+    #fixations are dicts of x,y,duration arrays (see GazeIndex)
     #bboxes are list of TXT, IMG, [N word tokens] each a list of identifier, top, left, line_height, word_width (for image it's ymin, xmin, ymax, xmax)
     _, y_min, x_min, y_max, x_max = bboxes[1]
     width = int(x_max - x_min)
     height = int(y_max - y_min)
-    heatmap = np.zeros((height, width))
-    for fix in fixations: 
-        if (x_min <= fix['x'] <= x_max) and (y_min <= fix['y'] <= y_max):
-            x = int(fix['x'] - x_min)
-            y = int(fix['y'] - y_min)
-            gaussian = gaussian_heatmap(center=(x,y), image_size=(width, height), sig=(fix['ppd_x']/1.5, fix['ppd_y']/1.5))
-            if duration_scaled:
-                gaussian *= fix['duration']
-            heatmap += gaussian # 120 pixel corresponds to 2 degree visual angle. A gaussian has about 3 sigma radius (6 sigma diameter) --> 20 px
-            # here we choose smaller sigma (3 sigma diameter), maybe it is better to use 5 degree fovea and correct 6 sigma diameter, also visual acuity is an exponential function not gaussian (cmp. salicon)
+    on_image = (x_min <= fixations['x']) & (fixations['x'] <= x_max) & (y_min <= fixations['y']) & (fixations['y'] <= y_max)
+    x = (fixations['x'][on_image] - x_min).astype(np.int64)
+    y = (fixations['y'][on_image] - y_min).astype(np.int64)
+    sigs = (fixations['ppd_x'][on_image]/1.5, fixations['ppd_y'][on_image]/1.5)
+    weights = fixations['duration'][on_image] if duration_scaled else None
+    # 120 pixel corresponds to 2 degree visual angle. A gaussian has about 3 sigma radius (6 sigma diameter) --> 20 px
+    # here we choose smaller sigma (3 sigma diameter), maybe it is better to use 5 degree fovea and correct 6 sigma diameter, also visual acuity is an exponential function not gaussian (cmp. salicon)
+    heatmap = gaussian_heatmaps(centers=(x, y), image_size=(width, height), sigs=sigs, weights=weights)
     heatmap = heatmap/heatmap.max()
     return heatmap
 
+def makeImageHeatmapGrid(fixations, bboxes, size, duration_scaled=True, mode='bilinear'):
+    '''
+    Image attention map rendered straight onto a size=(height, width) grid, without the full resolution map.
+    bilinear: samples the full resolution heatmap where downsample (F.interpolate bilinear) would
+    area: anti-aliased, every cell is the mean of the gaussians over the pixels it covers
+    Returns a float32 map normalized to max 1 (all zeros without fixations on the image).
+    '''
+    _, y_min, x_min, y_max, x_max = bboxes[1]
+    width = int(x_max - x_min)
+    height = int(y_max - y_min)
+    on_image = (x_min <= fixations['x']) & (fixations['x'] <= x_max) & (y_min <= fixations['y']) & (fixations['y'] <= y_max)
+    x = (fixations['x'][on_image] - x_min).astype(np.int64)
+    y = (fixations['y'][on_image] - y_min).astype(np.int64)
+    weights = fixations['duration'][on_image] if duration_scaled else np.ones(len(x))
+    #the gaussians are separable, so the grid is (height x N) @ (N x width) of 1-D kernels resampled per axis
+    kernel_x = resampledKernels(x, fixations['ppd_x'][on_image]/1.5, width, size[1], mode)
+    kernel_y = resampledKernels(y, fixations['ppd_y'][on_image]/1.5, height, size[0], mode)
+    heatmap = ((kernel_y * weights[:, None]).T @ kernel_x).astype(np.float32)
+    peak = heatmap.max(initial=0)
+    return heatmap/peak if peak > 0 else heatmap
+
+#elementwise math.erf, numpy has no erf of its own
+erf = lambda x: np.frompyfunc(math.erf, 1, 1)(x).astype(np.float64)
+
+def resampledKernels(centers, sigs, in_size, out_size, mode='bilinear'):
+    '''
+    1-D gaussians (N centers on a pixel axis of in_size) resampled to out_size cells, as an (N, out_size) array.
+    Only the taps bilinear reads (2 per cell) or the cell integrals (area) are evaluated.
+    '''
+    centers = np.asarray(centers, dtype=np.float64)[:, None]
+    sigs = np.asarray(sigs, dtype=np.float64)[:, None]
+    scale = in_size / out_size
+    cells = np.arange(out_size, dtype=np.float64)
+    if mode == 'bilinear':
+        #source coordinates of F.interpolate(mode='bilinear', align_corners=False)
+        src = np.maximum((cells + 0.5) * scale - 0.5, 0)
+        low = np.floor(src)
+        high = np.minimum(low + 1, in_size - 1)
+        frac = src - low
+        gauss = lambda pos: np.exp(-0.5 * np.square(pos[None, :] - centers) / np.square(sigs))
+        return gauss(low) * (1 - frac) + gauss(high) * frac
+    if mode == 'area':
+        #mean over the pixel centers of a cell ~ integral over [start - 0.5, end - 0.5] / (end - start)
+        start = np.floor(cells * scale)
+        end = np.ceil((cells + 1) * scale)
+        z = lambda pos: (pos[None, :] - 0.5 - centers) / (np.sqrt(2) * sigs)
+        integral = (erf(z(end)) - erf(z(start))) * (sigs * np.sqrt(np.pi / 2))
+        return integral / (end - start)
+    raise ValueError(f'Unknown attention map resampling mode {mode!r}')
+
+def gaussian_heatmaps(centers, image_size=(10, 10), sigs=(1, 1), weights=None):
+    """
+    Weighted sum of N axis-aligned gaussians in a single pass.
+    Each gaussian is separable, so the stack is the product of an (H, N) and
+    an (N, W) matrix of 1-D kernels instead of N full resolution meshgrids.
+    :param centers: tuple of arrays (X, Y) with the N mean positions
+    :param image_size: The total image size (width, height)
+    :param sigs: tuple of arrays (sig_x, sig_y), scalars are broadcast
+    :param weights: array of N weights, defaults to 1 for every gaussian
+    :return: (height, width) float64 heatmap
+    """
+    center_x = np.atleast_1d(np.asarray(centers[0], dtype=np.float64))
+    center_y = np.atleast_1d(np.asarray(centers[1], dtype=np.float64))
+    sig_x = np.broadcast_to(np.asarray(sigs[0], dtype=np.float64), center_x.shape)
+    sig_y = np.broadcast_to(np.asarray(sigs[1], dtype=np.float64), center_y.shape)
+    if weights is None:
+        weights = np.ones(center_x.shape)
+    x_axis = np.arange(image_size[0], dtype=np.float64)[None, :] - center_x[:, None]
+    y_axis = np.arange(image_size[1], dtype=np.float64)[None, :] - center_y[:, None]
+    kernel_x = np.exp(-0.5 * np.square(x_axis) / np.square(sig_x)[:, None])
+    kernel_y = np.exp(-0.5 * np.square(y_axis) / np.square(sig_y)[:, None])
+    return (kernel_y * np.asarray(weights, dtype=np.float64)[:, None]).T @ kernel_x
+
 def gaussian_heatmap(center=(2, 2), image_size=(10, 10), sig=(1,1)):
     """
     It produces single gaussian at expected center
@@ -111,10 +233,7 @@ def downsample(attmap, size=(14, 14)):
     '''
     Scale down attmap to 14x14 pixel
     '''
-    attmap = torch.tensor(attmap).unsqueeze(0).unsqueeze(0)
-    attmap = F.interpolate(attmap, size=size, mode="bilinear", align_corners=False)
-    attmap = attmap.squeeze(0).squeeze(0)
-    return attmap.numpy()
+    return resizeMaps(np.asarray(attmap)[None], size)[0]
 
 def normalize(attmap):
     '''
@@ -124,23 +243,83 @@ def normalize(attmap):
     return attmap/attmap_sum if attmap_sum > 0 else attmap
 
 def makeScanpath(fixations, bboxes, include_breaks=True):
-    _, y_min, x_min, y_max, x_max = bboxes[1]
-    width = x_max - x_min
-    height = y_max - y_min
-    scanpath = []
-    for fix in fixations: 
-        if (x_min <= fix['x'] <= x_max) and (y_min <= fix['y'] <= y_max):
-            scanpath.append({'x': (fix['x']-x_min)/width, 'y': (fix['y']-y_min)/height, 'duration': fix['duration'], 'pupil': fix['pupil']})
-        elif include_breaks:
-            scanpath.append(None) #to indicate a break in the scanpath due to fixation not on the image
-        else:
-            continue
-    return scanpath
+    '''
+    Image fixations in normalized image coordinates as a list of x, y, duration, pupil dicts,
+    None marks a break (fixation not on the image). Normalized in one pass, see ScanpathColumns for the whole dataset.
+    '''
+    on_image, x, y = normalizeFixations(fixations['x'], fixations['y'], bboxes[1][1:])
+    rows = zip(on_image.tolist(), x.tolist(), y.tolist(), fixations['duration'].tolist(), fixations['pupil'].tolist())
+    scanpath = [{'x': fix_x, 'y': fix_y, 'duration': duration, 'pupil': pupil} if on else None for on, fix_x, fix_y, duration, pupil in rows]
+    return scanpath if include_breaks else [fixation for fixation in scanpath if fixation is not None]
 
 def makePath(path):
     if not os.path.exists(path):
         os.makedirs(path)
 
+def manifestPath(out_path, dataset, form):
+    return os.path.join(out_path, dataset, f'{form}.manifest')
+
+def readManifest(path):
+    '''
+    Set of (qid, pid) that were completely written by a previous run
+    '''
+    if not os.path.exists(path):
+        return set()
+    with open(path, 'r') as f:
+        return {tuple(line.split()) for line in f if line.strip()}
+
+# Per-process state, attached once by initWorker instead of being pickled with every task
+_worker = {}
+
+def initWorker(img_index, txt_index, bboxes_data, dataset, args):
+    if args.WORKERS > 1:
+        #torch is imported on first use (if at all), this limits it whenever that happens
+        os.environ['OMP_NUM_THREADS'] = '1'
+        if 'torch' in sys.modules:
+            sys.modules['torch'].set_num_threads(1)
+    stores = {form: STORES[args.STORE](os.path.join(args.OUT_PATH, dataset, form)) for form in args.FORMATS if form not in DATASET_FORMATS}
+    _worker.update(img_index=img_index, txt_index=txt_index, bboxes_data=bboxes_data, stores=stores, args=args)
+
+def processQuestion(task):
+    '''
+    Generate the pending formats of all (qid, pid) samples of one question, returns the task once everything is on disk
+    '''
+    qid, samples = task
+    bboxes_data, args = _worker['bboxes_data'], _worker['args']
+    bboxes = bboxes_data.loc[qid][['token', 'ymin', 'xmin', 'ymax', 'xmax']].values.tolist()
+    
+    if any('txt-attmap' in forms for _, forms in samples):
+        words = wordBoxes(bboxes)
+        pids, txt_fixations, offsets = _worker['txt_index'].question(qid)
+        txt_attmaps = dict(zip(pids, makeTextHeatmaps(txt_fixations, offsets, words, args.DURATION_SCALED)))
+    
+    stores = _worker['stores']
+    for pid, forms in samples:
+        img_fixations = _worker['img_index'][qid, pid]
+        for form in forms:
+            if form == 'img-attmap':
+                if args.ATTMAP_SIZE and args.ATTMAP_MODE != 'full':
+                    attmap = makeImageHeatmapGrid(img_fixations, bboxes, args.ATTMAP_SIZE, args.DURATION_SCALED, args.ATTMAP_MODE)
+                else:
+                    attmap = makeImageHeatmap(img_fixations, bboxes, args.DURATION_SCALED)
+                    if args.ATTMAP_SIZE:
+                        attmap = downsample(attmap, args.ATTMAP_SIZE)
+                if args.NORMALIZE:
+                    attmap = normalize(attmap)
+                stores[form].write(qid, pid, attmap)
+            elif form == 'txt-attmap':
+                #participants without fixations on the text plate are not in the index
+                attmap = txt_attmaps.get(pid, np.zeros(len(words)))
+                if args.NORMALIZE:
+                    attmap = normalize(attmap)
+                stores[form].write(qid, pid, attmap)
+            elif form == 'scanpath':
+                scanpath = makeScanpath(img_fixations, bboxes)
+                stores[form].write(qid, pid, scanpath)
+    for store in stores.values():
+        store.flush()
+    return task
+
 if __name__ == '__main__':
     args = parse_args()
     
@@ -149,31 +328,55 @@ if __name__ == '__main__':
         bboxes_data = pd.read_pickle(PATHS[dataset][1])
         
         if 'jr' in dataset:
-            img_query = txt_query = 'accurate_eye == eye & plate == "plate"'
+            img_index = txt_index = GazeIndex(gaze_data, plate='plate')
         else:
-            img_query = 'accurate_eye == eye & plate == "imgplate"'
-            txt_query = 'accurate_eye == eye & plate == "txtplate"'
+            img_index = GazeIndex(gaze_data, plate='imgplate')
+            txt_index = GazeIndex(gaze_data, plate='txtplate')
         
-        for qid, pid in tqdm(gaze_data.reset_index(level=-1).index.unique(), desc='sample'):
-            img_fixations = gaze_data.loc[qid, pid].query(img_query)[['x', 'y', 'ppd_x', 'ppd_y', 'duration', 'pupil']].to_dict(orient='records')
-            txt_fixations = gaze_data.loc[qid, pid].query(txt_query)[['x', 'y', 'ppd_x', 'ppd_y', 'duration', 'pupil']].to_dict(orient='records')
-            bboxes = bboxes_data.loc[qid][['token', 'ymin', 'xmin', 'ymax', 'xmax']].values.tolist()
-            
-            for form in args.FORMATS:
-                path = os.path.join(args.OUT_PATH, dataset, form)
-                makePath(path)
-                if form == 'img-attmap':
-                    attmap = makeImageHeatmap(img_fixations, bboxes, args.DURATION_SCALED)
-                    if args.ATTMAP_SIZE:
-                        attmap = downsample(attmap, args.ATTMAP_SIZE)
-                    if args.NORMALIZE:
-                        attmap = normalize(attmap)
-                    np.save(f'{path}/q{qid}_p{pid}.npy', attmap)
-                elif form == 'txt-attmap':
-                    attmap = makeTextHeatmap(txt_fixations, bboxes, args.DURATION_SCALED)
-                    if args.NORMALIZE:
-                        attmap = normalize(attmap)
-                    np.save(f'{path}/q{qid}_p{pid}.npy', attmap)
-                elif form == 'scanpath':
-                    scanpath = makeScanpath(img_fixations, bboxes)
-                    json.dump(scanpath, open(f'{path}/q{qid}_p{pid}', 'w'))
\ No newline at end of file
+        samples = list(gaze_data.reset_index(level=-1).index.unique())
+        if 'scanpath-columns' in args.FORMATS:
+            #one vectorized pass, cheap enough to always rebuild completely
+            ScanpathColumns.fromIndex(img_index, bboxes_data, samples).save(os.path.join(args.OUT_PATH, dataset, 'scanpath-columns'))
+        formats = [form for form in args.FORMATS if form not in DATASET_FORMATS]
+        
+        done = {}
+        for form in formats:
+            makePath(os.path.join(args.OUT_PATH, dataset, form))
+            if args.RESUME:
+                done[form] = readManifest(manifestPath(args.OUT_PATH, dataset, form))
+            else:
+                STORES[args.STORE].clear(os.path.join(args.OUT_PATH, dataset, form))
+                done[form] = set()
+        
+        questions = {}
+        for qid, pid in samples:
+            forms = [form for form in formats if (str(qid), str(pid)) not in done[form]]
+            if forms:
+                questions.setdefault(qid, []).append((pid, forms))
+        tasks = list(questions.items())
+        
+        manifests = {form: open(manifestPath(args.OUT_PATH, dataset, form), 'a' if args.RESUME else 'w', buffering=1) for form in formats}
+        initargs = (img_index, txt_index, bboxes_data, dataset, args)
+        if args.WORKERS > 1:
+            pool = mp.Pool(args.WORKERS, initializer=initWorker, initargs=initargs)
+            results = pool.imap_unordered(processQuestion, tasks, chunksize=4)
+        else:
+            pool = None
+            initWorker(*initargs)
+            results = map(processQuestion, tasks)
+        
+        try:
+            with tqdm(total=sum(len(samples) for _, samples in tasks), desc='sample') as progress:
+                for qid, samples in results:
+                    for pid, forms in samples:
+                        for form in forms:
+                            manifests[form].write(f'{qid} {pid}\n')
+                    progress.update(len(samples))
+        finally:
+            for manifest in manifests.values():
+                manifest.close()
+            if pool is not None:
+                pool.terminate()
+            else:
+                for store in _worker['stores'].values():
+                    store.close()
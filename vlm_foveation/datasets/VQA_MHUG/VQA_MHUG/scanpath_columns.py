@@ -0,0 +1,195 @@
+import json, os, shutil
+import numpy as np
+
+FIELDS = ('x', 'y', 'duration', 'pupil')
+
+def normalizeFixations(x, y, boxes):
+    '''
+    Fixation positions relative to the image box, one ymin, xmin, ymax, xmax box for all or an (N, 4) array of one per fixation.
+    Returns (on_image mask, x, y), x and y in [0, 1] on the image and outside of it for breaks.
+    '''
+    y_min, x_min, y_max, x_max = boxes.T if isinstance(boxes, np.ndarray) else boxes
+    on_image = (x_min <= x) & (x <= x_max) & (y_min <= y) & (y <= y_max)
+    return on_image, (x - x_min)/(x_max - x_min), (y - y_min)/(y_max - y_min)
+
+def imageBoxes(bboxes_data, qids):
+    '''
+    IMG box (ymin, xmin, ymax, xmax) of every qid from a bboxes pickle frame, as a (len(qids), 4) array
+    '''
+    img = bboxes_data[bboxes_data['token'] == 'IMG']
+    return img[['ymin', 'xmin', 'ymax', 'xmax']].reindex(list(qids)).to_numpy(dtype=np.float64)
+
+class ScanpathColumns:
+    '''
+    Image scanpaths of a whole dataset as ragged float32 columns instead of one list of dicts per sample.
+    columns[field][offsets[i]:offsets[i+1]] is the scanpath of keys[i] in recording order, x and y normalized
+    to the image box, breaks[j] marks fixations off the image (None in the scanpath deliverable, their x/y
+    are outside [0, 1]). sizes[i] is the image (width, height) in stimulus pixels.
+    Saved as one .npy per column, so load() can mmap all samples without parsing anything.
+    '''
+    def __init__(self, keys, columns, breaks, offsets, sizes):
+        self.keys = [tuple(key) for key in keys]
+        self.columns = columns
+        self.breaks = breaks
+        self.offsets = offsets
+        self.sizes = sizes
+        self.index = {key: i for i, key in enumerate(self.keys)}
+
+    @classmethod
+    def fromIndex(cls, gaze_index, bboxes_data, keys=None):
+        '''
+        Columns of the given (qid, pid) keys (default: all samples of the GazeIndex) in a single vectorized pass.
+        Keys without fixations on the plate get an empty scanpath.
+        '''
+        keys = list(gaze_index.samples if keys is None else keys)
+        spans = np.array([gaze_index.span(key) for key in keys], dtype=np.int64).reshape(-1, 2)
+        lengths = spans[:, 1] - spans[:, 0]
+        offsets = np.zeros(len(keys)+1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        #gather rows of the requested samples: start of the sample in the index + position within the sample
+        rows = np.repeat(spans[:, 0] - offsets[:-1], lengths) + np.arange(offsets[-1])
+        sample = np.repeat(np.arange(len(keys)), lengths)
+        boxes = imageBoxes(bboxes_data, [qid for qid, _ in keys])
+        source = gaze_index.columns
+        on_image, x, y = normalizeFixations(source['x'][rows], source['y'][rows], boxes[sample])
+        columns = {
+            'x': x.astype(np.float32),
+            'y': y.astype(np.float32),
+            'duration': source['duration'][rows].astype(np.float32),
+            'pupil': source['pupil'][rows].astype(np.float32)
+        }
+        sizes = np.stack([boxes[:, 3] - boxes[:, 1], boxes[:, 2] - boxes[:, 0]], axis=1).astype(np.float32)
+        return cls(keys, columns, ~on_image, offsets, sizes)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return tuple(key) in self.index
+
+    def __getitem__(self, key):
+        '''
+        Scanpath of (qid, pid) as a dict of array views, including the 'break' mask
+        '''
+        i = self.index[tuple(key)]
+        start, stop = self.offsets[i], self.offsets[i+1]
+        sample = {field: column[start:stop] for field, column in self.columns.items()}
+        sample['break'] = self.breaks[start:stop]
+        return sample
+
+    def scanpath(self, key, include_breaks=True):
+        '''
+        Scanpath of (qid, pid) in the makeScanpath format: list of dicts, None for breaks
+        '''
+        sample = self[key]
+        rows = zip(*(sample[field].tolist() for field in FIELDS))
+        scanpath = [None if off else dict(zip(FIELDS, row)) for off, row in zip(sample['break'].tolist(), rows)]
+        return scanpath if include_breaks else [fixation for fixation in scanpath if fixation is not None]
+
+    def sampleIds(self):
+        '''
+        Sample number of every fixation row
+        '''
+        return np.repeat(np.arange(len(self.keys)), np.diff(self.offsets))
+
+    def padded(self, max_len=None):
+        '''
+        (samples, max_len) float32 arrays of every column, zero padded and truncated to max_len (default: longest
+        scanpath), plus boolean 'valid' (not padding) and 'break' masks
+        '''
+        lengths = np.diff(self.offsets)
+        max_len = int(lengths.max(initial=0)) if max_len is None else max_len
+        position = np.arange(self.offsets[-1]) - np.repeat(self.offsets[:-1], lengths)
+        keep = position < max_len
+        sample, position = self.sampleIds()[keep], position[keep]
+        padded = {}
+        for field, column in self.columns.items():
+            padded[field] = np.zeros((len(self.keys), max_len), dtype=np.float32)
+            padded[field][sample, position] = column[keep]
+        padded['valid'] = np.zeros((len(self.keys), max_len), dtype=bool)
+        padded['valid'][sample, position] = True
+        padded['break'] = np.zeros((len(self.keys), max_len), dtype=bool)
+        padded['break'][sample, position] = self.breaks[keep]
+        return padded
+
+    def save(self, path):
+        '''
+        Write all columns to the folder path, replacing a previous one only once everything is on disk
+        '''
+        tmp = f'{path}.tmp'
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        arrays = dict(self.columns, breaks=self.breaks, offsets=self.offsets, sizes=self.sizes)
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp, f'{name}.npy'), array)
+        with open(os.path.join(tmp, 'keys.json'), 'w') as f:
+            json.dump([[str(qid), str(pid)] for qid, pid in self.keys], f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        '''
+        Columns written by save(), memory mapped read-only unless mmap=False. Keys are read back as strings.
+        '''
+        read = lambda name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r' if mmap else None)
+        with open(os.path.join(path, 'keys.json'), 'r') as f:
+            keys = json.load(f)
+        columns = {field: read(field) for field in FIELDS}
+        return cls(keys, columns, read('breaks'), np.asarray(read('offsets')), np.asarray(read('sizes')))
+
+def gridRois(rows, cols):
+    '''
+    rows x cols grid of regions over the image, as an (rows*cols, 4) array of normalized xmin, ymin, xmax, ymax
+    '''
+    x = np.linspace(0, 1, cols+1)
+    y = np.linspace(0, 1, rows+1)
+    xx, yy = np.meshgrid(np.arange(cols), np.arange(rows))
+    return np.stack([x[xx], y[yy], x[xx+1], y[yy+1]], axis=-1).reshape(-1, 4)
+
+def scanpathFeatures(scanpaths, rois=None):
+    '''
+    Scanpath statistics of every sample of a ScanpathColumns at once, each an array with one row per sample:
+    fixation_count, break_count: fixations on / off the image
+    dwell_time, mean_fixation_duration: summed / mean duration of the fixations on the image
+    saccade_count, mean_saccade_amplitude, total_saccade_amplitude: saccades between consecutive fixations
+        on the image (not across breaks), amplitudes in stimulus pixels
+    dwell_per_roi: (samples, R) summed duration inside each of the R regions, only if rois is given, either
+        (R, 4) shared or (samples, R, 4) per sample normalized xmin, ymin, xmax, ymax boxes (see gridRois),
+        a box covers [xmin, xmax) x [ymin, ymax) plus its edges on the right / bottom image border
+    '''
+    count = len(scanpaths)
+    sample = scanpaths.sampleIds()
+    on_image = ~np.asarray(scanpaths.breaks)
+    x = np.asarray(scanpaths.columns['x'], dtype=np.float64)
+    y = np.asarray(scanpaths.columns['y'], dtype=np.float64)
+    duration = np.asarray(scanpaths.columns['duration'], dtype=np.float64) * on_image
+    features = {
+        'fixation_count': np.bincount(sample, weights=on_image, minlength=count).astype(np.int64),
+        'break_count': np.bincount(sample, weights=~on_image, minlength=count).astype(np.int64),
+        'dwell_time': np.bincount(sample, weights=duration, minlength=count)
+    }
+    features['mean_fixation_duration'] = features['dwell_time'] / np.maximum(features['fixation_count'], 1)
+
+    #a saccade joins row j and j+1 of the same sample, both on the image
+    saccade = (sample[1:] == sample[:-1]) & on_image[1:] & on_image[:-1]
+    owner = sample[1:][saccade]
+    width, height = np.asarray(scanpaths.sizes, dtype=np.float64)[owner].T
+    amplitude = np.hypot(np.diff(x)[saccade] * width, np.diff(y)[saccade] * height)
+    features['saccade_count'] = np.bincount(owner, minlength=count)
+    features['total_saccade_amplitude'] = np.bincount(owner, weights=amplitude, minlength=count)
+    features['mean_saccade_amplitude'] = features['total_saccade_amplitude'] / np.maximum(features['saccade_count'], 1)
+
+    if rois is not None:
+        rois = np.asarray(rois, dtype=np.float64)
+        #(fixations, R) boxes of the fixation's sample
+        boxes = rois[sample] if rois.ndim == 3 else rois[None]
+        x_min, y_min, x_max, y_max = np.moveaxis(boxes, -1, 0)
+        x, y = x[:, None], y[:, None]
+        #half-open, closed at the image border, so the cells of a grid get every fixation exactly once
+        inside = (x_min <= x) & ((x < x_max) | ((x == x_max) & (x_max >= 1))) & (y_min <= y) & ((y < y_max) | ((y == y_max) & (y_max >= 1)))
+        #rows are grouped by sample, so per-sample sums are differences of the running sum at the offsets
+        total = np.zeros((len(sample)+1, rois.shape[-2]))
+        np.cumsum(inside * duration[:, None], axis=0, out=total[1:])
+        features['dwell_per_roi'] = total[scanpaths.offsets[1:]] - total[scanpaths.offsets[:-1]]
+    return features
@@ -13,18 +13,28 @@ __version__ = '0.9'
 #  loadQA     - Load questions and answers with the specified question ids.
 #  showQA     - Display the specified questions and answers.
 #  loadRes    - Load result file and create result object.
+#  (accuracy evaluation of a result object lives in vqaEval.py)
+
+# Annotation and question files are cached as memory-mapped columns on first load (see vqaCache.py),
+# pass use_cache=False to parse the json files into plain dicts instead.
 
 # Help on each function can be accessed by: "help(COCO.function)"
 
 import json
 import datetime
 import copy
+import numpy as np
+
+from . import vqaCache
 
 class VQA:
-    def __init__(self, annotation_file=None, question_file=None):
+    def __init__(self, annotation_file=None, question_file=None, use_cache=True, cache_dir=None):
         """
            Constructor of VQA helper class for reading and visualizing questions and answers.
         :param annotation_file (str): location of VQA annotation file
+        :param question_file (str)  : location of VQA question file
+        :param use_cache (bool)     : memory-map the binary cache of the two files, built on first use
+        :param cache_dir (str)      : folder of the binary caches, defaults to the per-user vqaCache.defaultCacheDir()
         :return:
         """
         # load dataset
@@ -32,36 +42,113 @@ class VQA:
         self.questions = {}
         self.qa = {}
         self.qqa = {}
-        self.imgToQA = {}
+        self._imgToQA = None
+        self.cache = None
+        self.createColumns([])
         if not annotation_file == None and not question_file == None:
             print('loading VQA annotations and questions into memory...')
             time_t = datetime.datetime.utcnow()
-            dataset = json.load(open(annotation_file, 'r'))
-            questions = json.load(open(question_file, 'r'))
-            print(datetime.datetime.utcnow() - time_t)
-            self.dataset = dataset
-            self.questions = questions
-            self.createIndex()
+            cache = vqaCache.load(annotation_file, question_file, cache_dir) if use_cache else None
+            if cache is not None:
+                print(datetime.datetime.utcnow() - time_t)
+                self.loadIndex(cache)
+            else:
+                dataset = vqaCache.loadJson(annotation_file)
+                questions = vqaCache.loadJson(question_file)
+                print(datetime.datetime.utcnow() - time_t)
+                self.dataset = dataset
+                self.questions = questions
+                self.createIndex()
 
     def createIndex(self):
         # create index
         print('creating index...')
-        imgToQA = {ann['image_id']: [] for ann in self.dataset['annotations']}
-        qa =  {ann['question_id']:       [] for ann in self.dataset['annotations']}
-        qqa = {ann['question_id']:       [] for ann in self.dataset['annotations']}
-        for ann in self.dataset['annotations']:
-            imgToQA[ann['image_id']] += [ann]
-            qa[ann['question_id']] = ann
-        for ques in self.questions['questions']:
-              qqa[ques['question_id']] = ques
-        
+        anns = self.dataset['annotations']
+        qa  = dict(zip([ann['question_id'] for ann in anns], anns))
+        qqa = {ques['question_id']: ques for ques in self.questions['questions']}
+        self.createColumns(anns)
         print('index created!')
-        
 
          # create class members
         self.qa = qa
         self.qqa = qqa
-        self.imgToQA = imgToQA
+        self._imgToQA = None
+
+    def loadIndex(self, cache):
+        """
+        Take dataset, questions and the columnar index from a memory-mapped vqaCache.Cache.
+        Annotation and question dicts are decoded lazily on access.
+        :param cache (vqaCache.Cache) : cached columns of the annotation/question files
+        :return:
+        """
+        self.cache = cache
+        self.dataset = cache.dataset
+        self.questions = cache.questions
+        self.qa = cache.qa
+        self.qqa = cache.qqa
+        self.annQuesIds, self.annImgIds = cache.annQuesIds, cache.annImgIds
+        self.quesTypeCodes = {name: code for code, name in enumerate(cache.quesTypes)}
+        self.ansTypeCodes  = {name: code for code, name in enumerate(cache.ansTypes)}
+        self.annQuesTypes, self.annAnsTypes = cache.annQuesTypes, cache.annAnsTypes
+        self.imgAnns, self.imgIds, self.imgPtr = cache.imgAnns, cache.imgIds, cache.imgPtr
+        self.quesOrder = cache.quesOrder
+        self._imgToQA = None
+
+    def createColumns(self, anns):
+        """
+        Build the columnar index over the annotation list: integer id arrays, categorical codes
+        for question_type / answer_type and CSR offsets from image ids to annotation positions.
+        :param anns (object array) : annotations in file order
+        :return:
+        """
+        n = len(anns)
+        self.annQuesIds = np.fromiter((ann['question_id'] for ann in anns), dtype=np.int64, count=n)
+        self.annImgIds  = np.fromiter((ann['image_id'] for ann in anns), dtype=np.int64, count=n)
+        quesTypes, self.annQuesTypes = vqaCache.encodeCategories([ann['question_type'] for ann in anns])
+        ansTypes,  self.annAnsTypes  = vqaCache.encodeCategories([ann['answer_type'] for ann in anns])
+        self.quesTypeCodes = {name: code for code, name in enumerate(quesTypes)}
+        self.ansTypeCodes  = {name: code for code, name in enumerate(ansTypes)}
+        # annotation positions sorted by image id (stable, so file order is kept per image)
+        self.imgAnns = np.argsort(self.annImgIds, kind='stable')
+        self.imgIds, imgStarts = np.unique(self.annImgIds[self.imgAnns], return_index=True)
+        self.imgPtr = np.append(imgStarts, n).astype(np.int64)
+        self.quesOrder = np.argsort(self.annQuesIds, kind='stable')
+
+    @staticmethod
+    def _typeMask(codes, arr, types):
+        wanted = [codes[t] for t in types if t in codes]
+        return np.isin(arr, np.asarray(wanted, dtype=arr.dtype))
+
+    def _annsOfImgs(self, imgIds):
+        # positions of all annotations of the given images, in the order of imgIds
+        imgIds = np.asarray(imgIds, dtype=np.int64)
+        slot = np.searchsorted(self.imgIds, imgIds)
+        found = slot < len(self.imgIds)
+        found[found] = self.imgIds[slot[found]] == imgIds[found]
+        starts = self.imgPtr[slot[found]]
+        counts = self.imgPtr[slot[found] + 1] - starts
+        ragged = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return self.imgAnns[np.repeat(starts, counts) + ragged]
+
+    def _annsOfQues(self, quesIds):
+        # positions of the annotations of the given question ids, in the order of quesIds
+        quesIds = np.asarray(quesIds, dtype=np.int64)
+        sortedIds = self.annQuesIds[self.quesOrder]
+        slot = np.searchsorted(sortedIds, quesIds)
+        found = slot < len(sortedIds)
+        found[found] = sortedIds[slot[found]] == quesIds[found]
+        return self.quesOrder[slot[found]]
+
+    @property
+    def imgToQA(self):
+        """
+        image_id -> list of annotations, materialized from the columnar index on first access.
+        """
+        if self._imgToQA is None:
+            anns = self.dataset.get('annotations', [])
+            self._imgToQA = {int(imgId): [anns[i] for i in self.imgAnns[start:stop]]
+                             for imgId, start, stop in zip(self.imgIds, self.imgPtr[:-1], self.imgPtr[1:])}
+        return self._imgToQA
 
     def info(self):
         """
@@ -83,16 +170,8 @@ class VQA:
         quesTypes = quesTypes if type(quesTypes) == list else [quesTypes]
         ansTypes  = ansTypes  if type(ansTypes)  == list else [ansTypes]
 
-        if len(imgIds) == len(quesTypes) == len(ansTypes) == 0:
-            anns = self.dataset['annotations']
-        else:
-            if not len(imgIds) == 0:
-                anns = sum([self.imgToQA[imgId] for imgId in imgIds if imgId in self.imgToQA],[])
-            else:
-                 anns = self.dataset['annotations']
-            anns = anns if len(quesTypes) == 0 else [ann for ann in anns if ann['question_type'] in quesTypes]
-            anns = anns if len(ansTypes)  == 0 else [ann for ann in anns if ann['answer_type'] in ansTypes]
-        ids = [ann['question_id'] for ann in anns]
+        pos = self._filter(self._annsOfImgs(imgIds) if len(imgIds) else None, quesTypes, ansTypes)
+        ids = self.annQuesIds[pos].tolist() if pos is not None else self.annQuesIds.tolist()
         return ids
 
     def getImgIds(self, quesIds=[], quesTypes=[], ansTypes=[]):
@@ -107,18 +186,21 @@ class VQA:
         quesTypes = quesTypes if type(quesTypes) == list else [quesTypes]
         ansTypes  = ansTypes  if type(ansTypes)  == list else [ansTypes]
 
-        if len(quesIds) == len(quesTypes) == len(ansTypes) == 0:
-            anns = self.dataset['annotations']
-        else:
-            if not len(quesIds) == 0:
-                anns = sum([self.qa[quesId] for quesId in quesIds if quesId in self.qa],[])
-            else:
-                anns = self.dataset['annotations']
-            anns = anns if len(quesTypes) == 0 else [ann for ann in anns if ann['question_type'] in quesTypes]
-            anns = anns if len(ansTypes)  == 0 else [ann for ann in anns if ann['answer_type'] in ansTypes]
-        ids = [ann['image_id'] for ann in anns]
+        pos = self._filter(self._annsOfQues(quesIds) if len(quesIds) else None, quesTypes, ansTypes)
+        ids = self.annImgIds[pos].tolist() if pos is not None else self.annImgIds.tolist()
         return ids
 
+    def _filter(self, pos, quesTypes, ansTypes):
+        # annotation positions passing the type filters, None stands for all annotations unfiltered
+        if len(quesTypes) == len(ansTypes) == 0:
+            return pos
+        mask = np.ones(len(self.annQuesIds), dtype=bool)
+        if len(quesTypes):
+            mask &= self._typeMask(self.quesTypeCodes, self.annQuesTypes, quesTypes)
+        if len(ansTypes):
+            mask &= self._typeMask(self.ansTypeCodes, self.annAnsTypes, ansTypes)
+        return np.flatnonzero(mask) if pos is None else pos[mask[pos]]
+
     def loadQA(self, ids=[]):
         """
         Load questions and answers with the specified question ids.
@@ -151,28 +233,29 @@ class VQA:
         :return: res (obj)         : result api object
         """
         res = VQA()
-        res.questions = json.load(open(quesFile))
-        res.dataset['info'] = copy.deepcopy(self.questions['info'])
-        res.dataset['task_type'] = copy.deepcopy(self.questions['task_type'])
-        res.dataset['data_type'] = copy.deepcopy(self.questions['data_type'])
-        res.dataset['data_subtype'] = copy.deepcopy(self.questions['data_subtype'])
-        res.dataset['license'] = copy.deepcopy(self.questions['license'])
+        res.questions = vqaCache.loadJson(quesFile)
+        # metadata values are plain strings / small dicts, a shallow copy is enough
+        for key in ('info', 'task_type', 'data_type', 'data_subtype', 'license'):
+            res.dataset[key] = copy.copy(self.questions[key])
 
         print('Loading and preparing results...     ')
         time_t = datetime.datetime.utcnow()
-        anns    = json.load(open(resFile))
+        anns    = vqaCache.loadJson(resFile)
         assert type(anns) == list, 'results is not an array of objects'
-        annsQuesIds = [ann['question_id'] for ann in anns]
-        assert set(annsQuesIds) == set(self.getQuesIds()), \
+        annsQuesIds = np.fromiter((ann['question_id'] for ann in anns), dtype=np.int64, count=len(anns))
+        assert np.array_equal(np.unique(annsQuesIds), np.unique(self.annQuesIds)), \
         'Results do not correspond to current VQA set. Either the results do not have predictions for all question ids in annotation file or there is atleast one question id that does not belong to the question ids in the annotation file.'
-        for ann in anns:
+        # every result id is known at this point, look all of them up in the columnar index at once
+        pos = self._annsOfQues(annsQuesIds)
+        quesTypes = list(self.quesTypeCodes)
+        ansTypes  = list(self.ansTypeCodes)
+        for ann, imgId, quesType, ansType in zip(anns, self.annImgIds[pos].tolist(), self.annQuesTypes[pos].tolist(), self.annAnsTypes[pos].tolist()):
             quesId 			     = ann['question_id']
             if res.dataset['task_type'] == 'Multiple Choice':
                 assert ann['answer'] in self.qqa[quesId]['multiple_choices'], 'predicted answer is not one of the multiple choices' # type: ignore
-            qaAnn                = self.qa[quesId]
-            ann['image_id']      = qaAnn['image_id']       # type: ignore
-            ann['question_type'] = qaAnn['question_type']  # type: ignore
-            ann['answer_type']   = qaAnn['answer_type']    # type: ignore
+            ann['image_id']      = imgId
+            ann['question_type'] = quesTypes[quesType]
+            ann['answer_type']   = ansTypes[ansType]
         print('DONE (t=%0.2fs)'%((datetime.datetime.utcnow() - time_t).total_seconds()))
 
         res.dataset['annotations'] = anns
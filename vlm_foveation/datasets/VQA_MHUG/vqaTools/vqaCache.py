@@ -0,0 +1,406 @@
+# Streaming loader and binary cache for VQA annotation and question files.
+
+# The first construction of a VQA object streams the 'annotations' / 'questions' arrays
+# (with ijson if it is installed, plain json.load otherwise) into columns and writes them,
+# together with a string table and the lookup index, as .npy files into a cache folder keyed
+# by path, size and mtime of both json files (in the per-user cache folder unless a cache_dir is
+# given). Later constructions memory-map that folder and hand out annotation / question dicts
+# lazily, so nothing is parsed again.
+
+# The following functions are defined:
+#  load        - Return the cached columns of an annotation/question file pair, building them if needed.
+#  defaultCacheDir - Per-user folder the caches go to by default.
+#  loadJson    - json.load a file and close the handle.
+
+import glob
+import hashlib
+import json
+import os
+import shutil
+from collections.abc import Mapping, Sequence
+
+import numpy as np
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+CACHE_VERSION = 1
+META_KEYS = ('info', 'license', 'task_type', 'data_type', 'data_subtype')
+ANN_KEYS  = {'question_type', 'multiple_choice_answer', 'answers', 'image_id', 'answer_type', 'question_id'}
+QUES_KEYS = {'image_id', 'question', 'question_id'}
+
+
+def loadJson(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def cacheKey(*paths):
+    """
+    Key of a set of files, changes whenever one of them is replaced or modified.
+    """
+    h = hashlib.sha1(str(CACHE_VERSION).encode())
+    for path in paths:
+        stat = os.stat(path)
+        h.update(('%s|%d|%d' % (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)).encode())
+    return h.hexdigest()[:16]
+
+
+def headerMeta(f, key):
+    """
+    META_KEYS members of a json object that come before its `key` array. Stops where the array starts.
+    """
+    meta, name, builder = {}, None, None
+    for prefix, event, value in ijson.parse(f, use_float=True):
+        if prefix == '':
+            if event == 'map_key':
+                name = value
+            continue
+        if prefix == key and event == 'start_array':
+            break
+        if name not in META_KEYS:
+            continue
+        if builder is None:
+            builder = ijson.ObjectBuilder()
+        builder.event(event, value)
+        # scalars and closed containers of the member itself finish its value
+        if prefix == name and event not in ('start_map', 'start_array', 'map_key'):
+            meta[name] = builder.value
+            builder = None
+    return meta
+
+
+def _escaped(text, i):
+    backslashes = 0
+    while i - backslashes > 0 and text[i - backslashes - 1] == 0x5c:
+        backslashes += 1
+    return backslashes % 2 == 1
+
+
+def trailerMeta(tail, key):
+    """
+    META_KEYS members of a json object that come after its `key` array, from the bytes `tail` that
+    start somewhere inside (or before) that array and run to the end of the file.
+    Returns None if the end of the array is not in tail.
+    """
+    # walk backwards from the closing brace, quotes toggle strings (escaped ones excluded)
+    depth, opened, end = 0, [], None
+    inString = False
+    i = len(tail)
+    while i > 0:
+        i -= 1
+        c = tail[i]
+        if c == 0x22 and not _escaped(tail, i):
+            inString = not inString
+        elif inString:
+            continue
+        elif c in b'}]':
+            if depth == 1 and c == 0x5d:
+                opened.append(i)
+            depth += 1
+        elif c in b'{[':
+            depth -= 1
+            if depth == 1 and c == 0x5b:
+                j = opened.pop()
+                if tail[:i].rstrip().endswith(b':') and tail[:i].rstrip()[:-1].rstrip().endswith(json.dumps(key).encode()):
+                    end = j
+                    break
+    if end is None:
+        # the array started before tail: its end is the top-level ']' without a matching '['
+        if not opened:
+            return None
+        end = opened[0]
+    rest = tail[end + 1:].strip()
+    rest = rest[1:] if rest.startswith(b',') else rest
+    members = json.loads(b'{' + rest if rest != b'}' else b'{}')
+    return {name: value for name, value in members.items() if name in META_KEYS}
+
+
+class _TrackedReader:
+    """
+    File wrapper remembering the offsets of the last two chunks handed to the parser.
+    """
+    def __init__(self, f):
+        self.f = f
+        self.offsets = (0, 0)
+
+    def read(self, size=-1):
+        self.offsets = (self.offsets[1], self.f.tell())
+        return self.f.read(size)
+
+
+def streamJson(path, key, chunkSize=1 << 16):
+    """
+    Return the top-level metadata of a VQA json file and an iterator over its `key` array, in one parse.
+    Members after the array are added to the metadata once the iterator is exhausted.
+    """
+    if ijson is None:
+        print('ijson is not installed, reading %s with json.load...' % path)
+        data = loadJson(path)
+        records = data.pop(key)
+        return data, iter(records)
+    with open(path, 'rb') as f:
+        meta = headerMeta(f, key)
+
+    def records():
+        with open(path, 'rb') as f:
+            reader = _TrackedReader(f)
+            # the parser reads ahead at most one chunk: the array ends after the chunk before the one
+            # that was read last when the last record came out
+            last = 0
+            for record in ijson.items(reader, key + '.item', use_float=True, buf_size=chunkSize):
+                last = reader.offsets[0]
+                yield record
+            if set(META_KEYS) - set(meta):
+                f.seek(last)
+                trailer = trailerMeta(f.read(), key)
+                if trailer is None:
+                    # no record and the array starts before the tail, read the members the slow way
+                    f.seek(0)
+                    trailer = {name: value for name, value in ijson.kvitems(f, '', use_float=True) if name in META_KEYS}
+                meta.update((name, value) for name, value in trailer.items() if name not in meta)
+    return meta, records()
+
+
+class StringTable:
+    """
+    Deduplicated strings, stored as one utf-8 blob plus offsets.
+    """
+    def __init__(self, blob=None, offsets=None):
+        self.ids = {}
+        self.strings = []
+        self.blob = blob
+        self.offsets = offsets
+
+    def add(self, string):
+        sid = self.ids.get(string)
+        if sid is None:
+            sid = self.ids[string] = len(self.strings)
+            self.strings.append(string)
+        return sid
+
+    def arrays(self):
+        encoded = [s.encode('utf-8') for s in self.strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(e) for e in encoded], out=offsets[1:])
+        return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+    def __getitem__(self, sid):
+        return self.blob[self.offsets[sid]:self.offsets[sid + 1]].tobytes().decode('utf-8')
+
+
+def encodeCategories(values):
+    """
+    Categorical codes of a list of strings: (names in order of first appearance, int32 code array).
+    """
+    codes = {}
+    arr = np.fromiter((codes.setdefault(value, len(codes)) for value in values), dtype=np.int32, count=len(values))
+    return list(codes), arr
+
+
+def build(annotation_file, question_file, path):
+    """
+    Stream both files into columns and write them to the cache folder `path`.
+    Returns False (and writes nothing) if the records do not follow the VQA schema.
+    """
+    strings = StringTable()
+    annMeta, anns = streamJson(annotation_file, 'annotations')
+    ann = {name: [] for name in ('quesIds', 'imgIds', 'quesTypes', 'ansTypes', 'mcAnswer', 'ansCount', 'ansText', 'ansConf', 'ansId')}
+    for a in anns:
+        if set(a) != ANN_KEYS:
+            return False
+        ann['quesIds'].append(a['question_id'])
+        ann['imgIds'].append(a['image_id'])
+        ann['quesTypes'].append(a['question_type'])
+        ann['ansTypes'].append(a['answer_type'])
+        ann['mcAnswer'].append(strings.add(a['multiple_choice_answer']))
+        ann['ansCount'].append(len(a['answers']))
+        for answer in a['answers']:
+            ann['ansText'].append(strings.add(answer['answer']))
+            ann['ansConf'].append(answer['answer_confidence'])
+            ann['ansId'].append(answer['answer_id'])
+    quesMeta, questions = streamJson(question_file, 'questions')
+    ques = {name: [] for name in ('quesIds', 'imgIds', 'text')}
+    for q in questions:
+        if set(q) != QUES_KEYS:
+            return False
+        ques['quesIds'].append(q['question_id'])
+        ques['imgIds'].append(q['image_id'])
+        ques['text'].append(strings.add(q['question']))
+
+    quesTypes, annQuesTypes = encodeCategories(ann['quesTypes'])
+    ansTypes, annAnsTypes = encodeCategories(ann['ansTypes'])
+    confidences, ansConf = encodeCategories(ann['ansConf'])
+    annImgIds = np.asarray(ann['imgIds'], dtype=np.int64)
+    imgAnns = np.argsort(annImgIds, kind='stable')
+    imgIds, imgStarts = np.unique(annImgIds[imgAnns], return_index=True)
+    ansPtr = np.zeros(len(ann['ansCount']) + 1, dtype=np.int64)
+    np.cumsum(ann['ansCount'], out=ansPtr[1:])
+    strBlob, strOffsets = strings.arrays()
+    arrays = {
+        'annQuesIds': np.asarray(ann['quesIds'], dtype=np.int64),
+        'annImgIds': annImgIds,
+        'annQuesTypes': annQuesTypes,
+        'annAnsTypes': annAnsTypes,
+        'annMcAnswer': np.asarray(ann['mcAnswer'], dtype=np.int64),
+        'ansPtr': ansPtr,
+        'ansText': np.asarray(ann['ansText'], dtype=np.int64),
+        'ansConf': ansConf,
+        'ansId': np.asarray(ann['ansId'], dtype=np.int64),
+        'quesIds': np.asarray(ques['quesIds'], dtype=np.int64),
+        'quesImgIds': np.asarray(ques['imgIds'], dtype=np.int64),
+        'quesText': np.asarray(ques['text'], dtype=np.int64),
+        'imgAnns': imgAnns,
+        'imgIds': imgIds,
+        'imgPtr': np.append(imgStarts, len(annImgIds)).astype(np.int64),
+        'strBlob': strBlob,
+        'strOffsets': strOffsets,
+    }
+    arrays['quesOrder'] = np.argsort(arrays['annQuesIds'], kind='stable')
+    arrays['quesQOrder'] = np.argsort(arrays['quesIds'], kind='stable')
+    meta = {'version': CACHE_VERSION, 'dataset': annMeta, 'questions': quesMeta,
+            'quesTypes': quesTypes, 'ansTypes': ansTypes, 'confidences': confidences}
+
+    # write into a temporary folder and rename it, readers never see a half written cache
+    tmp = '%s.tmp%d' % (path, os.getpid())
+    os.makedirs(tmp, exist_ok=True)
+    for name, arr in arrays.items():
+        np.save(os.path.join(tmp, name + '.npy'), arr)
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    try:
+        os.replace(tmp, path)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)  # another process built it first
+    return True
+
+
+def _position(i, n):
+    if i < 0:
+        i += n
+    if not 0 <= i < n:
+        raise IndexError('record index out of range')
+    return i
+
+
+class Annotations(Sequence):
+    """
+    Read-only list of annotation dicts, each one decoded from the cached columns on access.
+    """
+    def __init__(self, cache):
+        self.c = cache
+
+    def __len__(self):
+        return len(self.c.annQuesIds)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        i = _position(i, len(self))
+        c = self.c
+        start, stop = c.ansPtr[i], c.ansPtr[i + 1]
+        answers = [{'answer': c.strings[text], 'answer_confidence': c.confidences[conf], 'answer_id': aid}
+                   for text, conf, aid in zip(c.ansText[start:stop].tolist(), c.ansConf[start:stop].tolist(), c.ansId[start:stop].tolist())]
+        return {'question_type': c.quesTypes[c.annQuesTypes[i]],
+                'multiple_choice_answer': c.strings[c.annMcAnswer[i]],
+                'answers': answers,
+                'image_id': int(c.annImgIds[i]),
+                'answer_type': c.ansTypes[c.annAnsTypes[i]],
+                'question_id': int(c.annQuesIds[i])}
+
+
+class Questions(Sequence):
+    """
+    Read-only list of question dicts, each one decoded from the cached columns on access.
+    """
+    def __init__(self, cache):
+        self.c = cache
+
+    def __len__(self):
+        return len(self.c.quesIds)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        i = _position(i, len(self))
+        c = self.c
+        return {'image_id': int(c.quesImgIds[i]), 'question': c.strings[c.quesText[i]], 'question_id': int(c.quesIds[i])}
+
+
+class RecordsById(Mapping):
+    """
+    Read-only id -> record mapping over a record sequence, resolved with a binary search.
+    """
+    def __init__(self, ids, order, records):
+        self.ids = ids
+        self.order = order
+        self.sortedIds = ids[order]
+        self.records = records
+
+    def _pos(self, key):
+        slot = np.searchsorted(self.sortedIds, key)
+        if slot < len(self.sortedIds) and self.sortedIds[slot] == key:
+            return self.order[slot]
+        return None
+
+    def __getitem__(self, key):
+        pos = self._pos(key)
+        if pos is None:
+            raise KeyError(key)
+        return self.records[pos]
+
+    def __contains__(self, key):
+        return self._pos(key) is not None
+
+    def __iter__(self):
+        return (int(i) for i in self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class Cache:
+    """
+    Memory-mapped columns of one annotation/question file pair.
+    """
+    def __init__(self, path):
+        with open(os.path.join(path, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+        for arr in glob.glob(os.path.join(path, '*.npy')):
+            # plain ndarray views on the mapping, element access on np.memmap objects is slow
+            setattr(self, os.path.basename(arr)[:-4], np.load(arr, mmap_mode='r').view(np.ndarray))
+        self.quesTypes = meta['quesTypes']
+        self.ansTypes = meta['ansTypes']
+        self.confidences = meta['confidences']
+        self.strings = StringTable(self.strBlob, self.strOffsets)
+        self.dataset = dict(meta['dataset'], annotations=Annotations(self))
+        self.questions = dict(meta['questions'], questions=Questions(self))
+        self.qa = RecordsById(self.annQuesIds, self.quesOrder, self.dataset['annotations'])
+        self.qqa = RecordsById(self.quesIds, self.quesQOrder, self.questions['questions'])
+
+
+def defaultCacheDir():
+    """
+    Per-user cache folder: %LOCALAPPDATA% on Windows, $XDG_CACHE_HOME or ~/.cache elsewhere.
+    The dataset folder is left alone, it may be read-only or shared.
+    """
+    base = os.environ.get('LOCALAPPDATA') if os.name == 'nt' else os.environ.get('XDG_CACHE_HOME')
+    return os.path.join(base or os.path.join(os.path.expanduser('~'), '.cache'), 'vlm_foveation', 'vqa')
+
+
+def load(annotation_file, question_file, cache_dir=None):
+    """
+    Return the Cache of an annotation/question file pair, building it on first use.
+    Returns None if the files can not be cached (non VQA schema), the caller falls back to json.
+    :param cache_dir (str) : folder for the caches, defaults to defaultCacheDir()
+    """
+    if cache_dir is None:
+        cache_dir = defaultCacheDir()
+    path = os.path.join(cache_dir, 'vqa_' + cacheKey(annotation_file, question_file))
+    if not os.path.exists(os.path.join(path, 'meta.json')):
+        print('building VQA cache in %s...' % path)
+        if not build(annotation_file, question_file, path):
+            return None
+    return Cache(path)
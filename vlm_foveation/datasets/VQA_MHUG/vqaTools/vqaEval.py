@@ -0,0 +1,234 @@
+# Vectorized accuracy evaluation for VQA results.
+
+# Follows the official VQA evaluation: answers are normalized (punctuation, digits, articles,
+# contractions) whenever the human answers of a question disagree, and a prediction scores
+# min(#matching humans / 3, 1) averaged over the 10 leave-one-out subsets of the human answers.
+# Ground-truth answers are normalized once per annotation set and kept as an integer code matrix,
+# predictions are normalized once per distinct answer string, so scoring is a single array compare.
+
+# The following functions are defined:
+#  VQAEval          - Evaluator for a VQA annotation object and a result object from VQA.loadRes.
+#  evaluate         - Compute overall, per question type and per answer type accuracies.
+#  normalizeAnswer  - Official answer normalization (processPunctuation + processDigitArticle).
+
+import re
+import weakref
+from functools import lru_cache
+
+import numpy as np
+
+contractions = {
+    "aint": "ain't", "arent": "aren't", "cant": "can't", "couldve": "could've", "couldnt": "couldn't",
+    "couldn'tve": "couldn't've", "couldnt've": "couldn't've", "didnt": "didn't", "doesnt": "doesn't", "dont": "don't", "hadnt": "hadn't",
+    "hadnt've": "hadn't've", "hadn'tve": "hadn't've", "hasnt": "hasn't", "havent": "haven't", "hed": "he'd", "hed've": "he'd've",
+    "he'dve": "he'd've", "hes": "he's", "howd": "how'd", "howll": "how'll", "hows": "how's", "Id've": "I'd've", "I'dve": "I'd've",
+    "Im": "I'm", "Ive": "I've", "isnt": "isn't", "itd": "it'd", "itd've": "it'd've", "it'dve": "it'd've", "itll": "it'll", "let's": "let's",
+    "maam": "ma'am", "mightnt": "mightn't", "mightnt've": "mightn't've", "mightn'tve": "mightn't've", "mightve": "might've",
+    "mustnt": "mustn't", "mustve": "must've", "neednt": "needn't", "notve": "not've", "oclock": "o'clock", "oughtnt": "oughtn't",
+    "ow's'at": "'ow's'at", "'ows'at": "'ow's'at", "'ow'sat": "'ow's'at", "shant": "shan't", "shed've": "she'd've", "she'dve": "she'd've",
+    "she's": "she's", "shouldve": "should've", "shouldnt": "shouldn't", "shouldnt've": "shouldn't've", "shouldn'tve": "shouldn't've",
+    "somebody'd": "somebodyd", "somebodyd've": "somebody'd've", "somebody'dve": "somebody'd've", "somebodyll": "somebody'll",
+    "somebodys": "somebody's", "someoned": "someone'd", "someoned've": "someone'd've", "someone'dve": "someone'd've",
+    "someonell": "someone'll", "someones": "someone's", "somethingd": "something'd", "somethingd've": "something'd've",
+    "something'dve": "something'd've", "somethingll": "something'll", "thats": "that's", "thered": "there'd", "thered've": "there'd've",
+    "there'dve": "there'd've", "therere": "there're", "theres": "there's", "theyd": "they'd", "theyd've": "they'd've",
+    "they'dve": "they'd've", "theyll": "they'll", "theyre": "they're", "theyve": "they've", "twas": "'twas", "wasnt": "wasn't",
+    "wed've": "we'd've", "we'dve": "we'd've", "weve": "we've", "werent": "weren't", "whatll": "what'll", "whatre": "what're",
+    "whats": "what's", "whatve": "what've", "whens": "when's", "whered": "where'd", "wheres": "where's", "whereve": "where've",
+    "whod": "who'd", "whod've": "who'd've", "who'dve": "who'd've", "wholl": "who'll", "whos": "who's", "whove": "who've", "whyll": "why'll",
+    "whyre": "why're", "whys": "why's", "wont": "won't", "wouldve": "would've", "wouldnt": "wouldn't", "wouldnt've": "wouldn't've",
+    "wouldn'tve": "wouldn't've", "yall": "y'all", "yall'll": "y'all'll", "y'allll": "y'all'll", "yall'd've": "y'all'd've",
+    "y'alld've": "y'all'd've", "y'all'dve": "y'all'd've", "youd": "you'd", "youd've": "you'd've", "you'dve": "you'd've",
+    "youll": "you'll", "youre": "you're", "youve": "you've"
+}
+manualMap = {'none': '0', 'zero': '0', 'one': '1', 'two': '2', 'three': '3', 'four': '4', 'five': '5',
+             'six': '6', 'seven': '7', 'eight': '8', 'nine': '9', 'ten': '10'}
+articles = ['a', 'an', 'the']
+punct = [';', r"/", '[', ']', '"', '{', '}', '(', ')', '=', '+', '\\', '_', '-', '>', '<', '@', '`', ',', '?', '!']
+periodStrip = re.compile(r"(?!<=\d)(\.)(?!\d)")
+commaStrip = re.compile(r"(\d)(,)(\d)")
+
+# word -> replacement after digit mapping, contraction fixing and article removal (None drops the word)
+_wordTable = {word: None for word in articles}
+_wordTable.update({word: contractions.get(digit, digit) for word, digit in manualMap.items()})
+_punctSpaced = [(p, p + ' ', ' ' + p) for p in punct]
+
+
+def processPunctuation(inText):
+    outText = inText
+    stripAll = commaStrip.search(inText) is not None
+    for p, trailing, leading in _punctSpaced:
+        if stripAll or trailing in inText or leading in inText:
+            outText = outText.replace(p, '')
+        else:
+            outText = outText.replace(p, ' ')
+    # the official evaluation passes re.UNICODE as the `count` argument, kept for identical scores
+    outText = periodStrip.sub('', outText, re.UNICODE)
+    return outText
+
+
+def processDigitArticle(inText):
+    outText = []
+    for word in inText.lower().split():
+        word = _wordTable.get(word, contractions.get(word, word))
+        if word is not None:
+            outText.append(word)
+    return ' '.join(outText)
+
+
+def cleanAnswer(answer):
+    return answer.replace('\n', ' ').replace('\t', ' ').strip()
+
+
+@lru_cache(maxsize=1 << 20)
+def normalizeAnswer(answer):
+    """
+    Official VQA answer normalization, memoized per distinct answer string.
+    :param answer (str) : raw answer
+    :return: (str)      : normalized answer
+    """
+    return processDigitArticle(processPunctuation(cleanAnswer(answer)))
+
+
+class GroundTruth:
+    """
+    Human answers of a VQA object as integer codes, computed once per annotation set.
+    Row i of `raw` / `normalized` holds the answer codes of question quesIds[i], padded with -1.
+    `multi` marks the questions whose humans disagree, only those are compared after normalization.
+    """
+    _byVqa = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def of(cls, vqa):
+        gt = cls._byVqa.get(vqa)
+        if gt is None:
+            gt = cls._byVqa[vqa] = cls(vqa)
+        return gt
+
+    def __init__(self, vqa):
+        self.quesIds = vqa.annQuesIds
+        self.quesTypes, self.ansTypes = list(vqa.quesTypeCodes), list(vqa.ansTypeCodes)
+        self.annQuesTypes, self.annAnsTypes = vqa.annQuesTypes, vqa.annAnsTypes
+        ansPtr, strings, answers = self.flatAnswers(vqa)
+
+        # every distinct answer string is cleaned and normalized exactly once
+        self.vocab = {}
+        raw = np.array([self.code(cleanAnswer(ans)) for ans in strings], dtype=np.int64)[answers]
+        normalized = np.array([self.code(normalizeAnswer(ans)) for ans in strings], dtype=np.int64)[answers]
+
+        counts = np.diff(ansPtr)
+        self.numAnswers = counts
+        row = np.repeat(np.arange(len(counts)), counts)
+        col = np.arange(len(answers)) - np.repeat(ansPtr[:-1], counts)
+        self.raw = np.full((len(counts), counts.max(initial=0)), -1, dtype=np.int64)
+        self.raw[row, col] = raw
+        self.normalized = np.full_like(self.raw, -1)
+        self.normalized[row, col] = normalized
+        # humans disagree if the smallest and largest raw answer code of a question differ
+        valid = self.raw >= 0
+        lowest = np.where(valid, self.raw, np.iinfo(np.int64).max).min(axis=1, initial=np.iinfo(np.int64).max)
+        self.multi = (counts > 0) & (lowest != self.raw.max(axis=1, initial=-1))
+        self.order = np.argsort(self.quesIds, kind='stable')
+
+    @staticmethod
+    def flatAnswers(vqa):
+        """
+        (answer offsets per annotation, distinct answer strings, index into them for every answer)
+        """
+        if vqa.cache is not None:
+            cache = vqa.cache
+            sids, answers = np.unique(cache.ansText, return_inverse=True)
+            return np.asarray(cache.ansPtr), [cache.strings[sid] for sid in sids.tolist()], answers.ravel()
+        ids = {}
+        answers, counts = [], []
+        for ann in vqa.dataset['annotations']:
+            counts.append(len(ann['answers']))
+            answers.extend(ids.setdefault(ans['answer'], len(ids)) for ans in ann['answers'])
+        ansPtr = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=ansPtr[1:])
+        return ansPtr, list(ids), np.asarray(answers, dtype=np.int64)
+
+    def code(self, answer):
+        return self.vocab.setdefault(answer, len(self.vocab))
+
+    def rows(self, quesIds):
+        """
+        Row of every question id, all ids must be part of the annotation set.
+        """
+        return self.order[np.searchsorted(self.quesIds, quesIds, sorter=self.order)]
+
+
+def accuracyFromMatches(matches, numAnswers):
+    """
+    Mean of min(1, matching humans / 3) over all leave-one-out subsets of the human answers.
+    A held-out matching answer leaves matches-1 in its subset, a held-out other answer leaves matches.
+    """
+    matches = matches.astype(np.float64)
+    held = np.minimum(1.0, (matches - 1) / 3) * matches + np.minimum(1.0, matches / 3) * (numAnswers - matches)
+    return held / np.maximum(numAnswers, 1)
+
+
+class VQAEval:
+    def __init__(self, vqa, vqaRes, n=2):
+        """
+        :param vqa    (VQA) : ground-truth annotations
+        :param vqaRes (VQA) : results, as returned by vqa.loadRes
+        :param n      (int) : number of decimals of the reported accuracies
+        """
+        self.n = n
+        self.vqa = vqa
+        self.vqaRes = vqaRes
+        self.params = {'question_id': vqa.getQuesIds()}
+        self.accuracy = {}
+        self.evalQA = {}
+        self.evalQuesType = {}
+        self.evalAnsType = {}
+
+    def evaluate(self, quesIds=None):
+        """
+        Score all results (or the given question ids) and fill accuracy / evalQA / evalQuesType / evalAnsType.
+        :param quesIds (int array) : question ids to evaluate, defaults to all annotated questions
+        :return: accQA (float array) : accuracy in [0, 1] of every evaluated question
+        """
+        gt = GroundTruth.of(self.vqa)
+        resAnns = self.vqaRes.dataset['annotations']
+        resIds = np.fromiter((ann['question_id'] for ann in resAnns), dtype=np.int64, count=len(resAnns))
+        resAnswers = [ann['answer'] for ann in resAnns]
+        if quesIds is None:
+            quesIds = self.params['question_id']
+        quesIds = np.asarray(quesIds, dtype=np.int64)
+
+        # the last prediction of a question wins, as with the dict based official evaluation
+        resOrder = np.argsort(resIds, kind='stable')
+        last = np.searchsorted(resIds, quesIds, side='right', sorter=resOrder) - 1
+        found = (last >= 0) & (resIds[resOrder[np.maximum(last, 0)]] == quesIds)
+        assert found.all(), 'Results are missing for %d question ids' % (~found).sum()
+        resPos = resOrder[last]
+        rows = gt.rows(quesIds)
+
+        multi = gt.multi[rows]
+        pred = np.empty(len(quesIds), dtype=np.int64)
+        for i, (pos, m) in enumerate(zip(resPos.tolist(), multi.tolist())):
+            answer = normalizeAnswer(resAnswers[pos]) if m else cleanAnswer(resAnswers[pos])
+            pred[i] = gt.vocab.get(answer, -2)
+        codes = np.where(multi[:, None], gt.normalized[rows], gt.raw[rows])
+        matches = (codes == pred[:, None]).sum(axis=1)
+        accQA = accuracyFromMatches(matches, gt.numAnswers[rows])
+
+        self.setAccuracy(quesIds, accQA, gt.annQuesTypes[rows], gt.annAnsTypes[rows], gt)
+        return accQA
+
+    def setAccuracy(self, quesIds, accQA, quesTypes, ansTypes, gt):
+        scale = lambda acc: round(100 * float(acc), self.n)
+        self.accuracy['overall'] = scale(accQA.mean()) if len(accQA) else 0.0
+        self.evalQA = dict(zip(quesIds.tolist(), np.round(100 * accQA, self.n).tolist()))
+        self.accuracy['perQuestionType'] = self._breakdown(accQA, quesTypes, gt.quesTypes, scale)
+        self.accuracy['perAnswerType'] = self._breakdown(accQA, ansTypes, gt.ansTypes, scale)
+        self.evalQuesType = self.accuracy['perQuestionType']
+        self.evalAnsType = self.accuracy['perAnswerType']
+
+    @staticmethod
+    def _breakdown(accQA, codes, names, scale):
+        total = np.bincount(codes, weights=accQA, minlength=len(names))
+        count = np.bincount(codes, minlength=len(names))
+        return {names[c]: scale(total[c] / count[c]) for c in np.flatnonzero(count)}
@@ -0,0 +1,42 @@
+"""Build the gaze_targets store of a finetuning split from generate_deliverables output.
+
+python build_targets.py --deliverables <deliverables>/vqa-mhug --split_dir <dataset_root>/train
+"""
+
+import logging
+import os
+
+from finetune_helper.argument_reader import parse_build_args
+from finetune_helper.gaze_dataset import split_images, split_questions, vqa_image_id
+from finetune_helper.gaze_targets import GazeTargetConverter, GazeTargetStore, deliverable_keys, iter_deliverables
+
+
+def main():
+    """Convert the deliverables whose image (and question, with questions.json) belongs to --split_dir."""
+    args = parse_build_args()
+    logging.basicConfig(level=logging.INFO)
+    images = split_images(args.split_dir)
+    if not images:
+        raise FileNotFoundError(f"No images in '{args.split_dir}/images'")
+    questions = split_questions(args.split_dir)
+    keys = [
+        key
+        for key in deliverable_keys(args.deliverables)
+        if vqa_image_id(key[0]) in images and (not questions or key[0] in questions)
+    ]
+    if not keys:
+        raise ValueError(f"No deliverables in '{args.deliverables}' match the images of '{args.split_dir}'")
+    converter = GazeTargetConverter(
+        mask_size=tuple(args.mask_size),
+        box_method=args.box_method,
+        threshold=args.threshold,
+        coverage=args.coverage,
+        max_boxes=args.max_boxes,
+    )
+    path = os.path.join(args.split_dir, "gaze_targets")
+    store = GazeTargetStore.build(iter_deliverables(args.deliverables, keys), path, converter, args.batch_size)
+    logging.info("Wrote gaze targets of %d samples to %s", len(store), path)
+
+
+if __name__ == "__main__":
+    main()
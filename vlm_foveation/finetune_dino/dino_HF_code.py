@@ -1,34 +1,58 @@
-import requests
-
-import torch
-from PIL import Image
-from transformers import AutoProcessor, AutoModelForZeroShotObjectDetection
-from accelerate import Accelerator
-
-model_id = "IDEA-Research/grounding-dino-tiny"
-device = Accelerator().device
-
-processor = AutoProcessor.from_pretrained(model_id)
-model = AutoModelForZeroShotObjectDetection.from_pretrained(model_id).to(device)
-
-image_url = "http://images.cocodataset.org/val2017/000000039769.jpg"
-image = Image.open(requests.get(image_url, stream=True).raw)
-# Check for cats and remote controls
-text_labels = [["a cat", "a remote control"]]
-
-inputs = processor(images=image, text=text_labels, return_tensors="pt").to(model.device)
-with torch.no_grad():
-    outputs = model(**inputs)
-
-results = processor.post_process_grounded_object_detection(
-    outputs,
-    inputs.input_ids,
-    threshold=0.4,
-    text_threshold=0.3,
-    target_sizes=[image.size[::-1]]
-)
-
-result = results[0]
-for box, score, labels in zip(result["boxes"], result["scores"], result["labels"]):
-    box = [round(x, 2) for x in box.tolist()]
-    print(f"Detected {labels} with confidence {round(score.item(), 3)} at location {box}")
\ No newline at end of file
+"""Zero-shot Grounding DINO detection on local images."""
+
+import argparse
+import sys
+
+from finetune_helper.startup import StartupProfiler
+
+# Started before the remaining imports so they are profiled too; the flag is parsed again with the other arguments.
+PROFILER = StartupProfiler(enabled=any(arg in ("--profile_startup", "--profile-startup") for arg in sys.argv)).start()
+
+from finetune_helper.grounding_detector import DEFAULT_MODEL_ID, PRECISIONS, GroundingDINODetector  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Zero-shot Grounding DINO detection on local images.")
+    parser.add_argument("--model_id", default=DEFAULT_MODEL_ID, help="Hub id or local folder of the model.")
+    parser.add_argument("--images", nargs="+", default=["family.jpg"], help="Local image files.")
+    parser.add_argument("--labels", nargs="+", default=["a person", "a shirt"], help="Labels searched on every image.")
+    parser.add_argument("--thresholds", nargs="+", type=float, default=[0.4, 0.3],
+                        help="threshold/text_threshold pairs, all served by one forward pass.")
+    parser.add_argument("--precision", choices=PRECISIONS, default="fp32")
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--device", default=None,
+                        help="Device to run on (cpu, cuda, cuda:1); default: the one accelerate picks for this process.")
+    parser.add_argument("--profile_startup", "--profile-startup", action="store_true",
+                        help="Report import time per package and the time of model loading and detection.")
+    return parser.parse_args()
+
+
+def main():
+    with PROFILER.phase("arguments"):
+        args = parse_args()
+    device = args.device
+    if device is None:
+        # accelerate only picks the device, importing it costs about as much as torch itself
+        with PROFILER.phase("accelerate"):
+            from accelerate import Accelerator
+
+            device = str(Accelerator().device)
+    with PROFILER.phase("model"):
+        detector = GroundingDINODetector(args.model_id, device=device, precision=args.precision)
+    thresholds = list(zip(args.thresholds[::2], args.thresholds[1::2]))
+    with PROFILER.phase("detection"):
+        results = detector.detect(args.images, [args.labels] * len(args.images), thresholds, args.batch_size)
+
+    for image, per_setting in zip(args.images, results):
+        for (threshold, text_threshold), result in zip(thresholds, per_setting):
+            print(f"{image} (threshold={threshold}, text_threshold={text_threshold}):")
+            for box, score, labels in zip(result["boxes"], result["scores"], result["labels"]):
+                box = [round(x, 2) for x in box.tolist()]
+                print(f"  Detected {labels} with confidence {round(score.item(), 3)} at location {box}")
+    if PROFILER.enabled:
+        PROFILER.stop()
+        print(PROFILER.report())
+
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,12 @@ def parse_args():
         default="configs/grounding_dino_tiny.py",
         help="Path to model config file.",
     )
+    parser.add_argument(
+        "--model",
+        default="tiny",
+        choices=["tiny"],
+        help="Model to finetune (tiny: CPU stand-in with the Grounding DINO output contract).",
+    )
     parser.add_argument(
         "--pretrained_ckpt",
         default="checkpoints/grounding_dino_tiny.pth",
@@ -29,14 +35,73 @@ def parse_args():
     parser.add_argument(
         "--lr", type=float, default=1e-4, help="Learning rate for optimizer."
     )
+    parser.add_argument(
+        "--batch_size", type=int, default=8, help="Samples per batch on every process."
+    )
+    parser.add_argument(
+        "--grad_accum_steps",
+        type=int,
+        default=1,
+        help="Batches accumulated per optimizer step.",
+    )
+    parser.add_argument(
+        "--precision",
+        default="fp32",
+        choices=["fp32", "bf16", "fp16"],
+        help="Autocast precision of the forward pass.",
+    )
+    parser.add_argument(
+        "--localization_mode",
+        default="boxes",
+        choices=["boxes", "masks"],
+        help="Gaze supervision as ROI boxes or soft masks.",
+    )
+    parser.add_argument(
+        "--layers_to_train",
+        nargs="*",
+        default=None,
+        help="Parameter name prefixes to train, everything else is frozen (default: train all).",
+    )
+    parser.add_argument(
+        "--image_size",
+        type=int,
+        nargs=2,
+        default=[224, 224],
+        help="Width and height images are resized to.",
+    )
+    parser.add_argument(
+        "--num_workers", type=int, default=2, help="DataLoader worker processes."
+    )
+    parser.add_argument(
+        "--feature_cache",
+        default=None,
+        help="Folder for cached frozen-encoder features; enables head-only training from the cache.",
+    )
     parser.add_argument(
         "--device", default="cuda", help="Target device identifier (cuda, cuda:0, cpu)."
     )
+    parser.add_argument(
+        "--backend",
+        default="gloo",
+        help="torch.distributed backend when launched with torchrun (gloo for CPU, nccl for GPUs).",
+    )
     parser.add_argument(
         "--output_dir",
         default="runs/finetune_dino",
         help="Directory to store checkpoints and logs.",
     )
+    parser.add_argument(
+        "--keep_checkpoints",
+        type=int,
+        default=3,
+        help="Number of most recent checkpoints kept in output_dir.",
+    )
+    parser.add_argument(
+        "--profile_startup",
+        "--profile-startup",
+        action="store_true",
+        help="Report import time per package and the time of every init phase before training starts.",
+    )
     parser.add_argument(
         "--seed",
         type=int,
@@ -44,3 +109,46 @@ def parse_args():
         help="Seed for deterministic training components.",
     )
     return parser.parse_args()
+
+
+def parse_build_args():
+    """Define and parse the arguments of build_targets.py."""
+    parser = argparse.ArgumentParser(
+        description="Convert gaze deliverables into the gaze_targets store of a finetuning split."
+    )
+    parser.add_argument(
+        "--deliverables",
+        required=True,
+        help="generate_deliverables output of one condition, holding img-attmap/ and optionally scanpath/.",
+    )
+    parser.add_argument(
+        "--split_dir",
+        required=True,
+        help="Split folder with images/ (and optional questions.json); the store goes to <split_dir>/gaze_targets.",
+    )
+    parser.add_argument(
+        "--mask_size",
+        type=int,
+        nargs=2,
+        default=[64, 64],
+        help="Height and width of the soft mask targets.",
+    )
+    parser.add_argument(
+        "--box_method",
+        default="components",
+        choices=["components", "percentile"],
+        help="ROI boxes around attention map regions or around the central fixation mass (needs scanpaths).",
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=0.5, help="Region threshold of components boxes, relative to the map peak."
+    )
+    parser.add_argument(
+        "--coverage", type=float, default=0.9, help="Fixation duration share inside percentile boxes."
+    )
+    parser.add_argument(
+        "--max_boxes", type=int, default=3, help="Boxes per sample."
+    )
+    parser.add_argument(
+        "--batch_size", type=int, default=256, help="Samples converted per batch."
+    )
+    return parser.parse_args()
@@ -0,0 +1,91 @@
+"""Background-thread checkpoint writer with retention of the most recent files."""
+
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import logging
+import os
+import queue
+import threading
+
+import torch
+
+
+def snapshot(state: Any) -> Any:
+    """Copy every tensor of a (nested) state dict to CPU so training can keep mutating the originals."""
+    if isinstance(state, torch.Tensor):
+        return state.detach().to("cpu", copy=True)
+    if isinstance(state, dict):
+        return {key: snapshot(value) for key, value in state.items()}
+    if isinstance(state, (list, tuple)):
+        return type(state)(snapshot(value) for value in state)
+    return state
+
+
+class AsyncCheckpointer:
+    """Serialize checkpoints on a worker thread and keep only the newest `keep_last` of them.
+
+    `save` only pays for the CPU snapshot; at most `max_pending` snapshots wait for the disk,
+    after that `save` blocks so a slow filesystem cannot pile up copies of the model in memory.
+    """
+
+    def __init__(self, directory: str, keep_last: int = 3, max_pending: int = 1) -> None:
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.keep_last = keep_last
+        self.saved: List[Path] = []
+        self._error: Optional[BaseException] = None
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue(maxsize=max(1, max_pending))
+        self._thread = threading.Thread(target=self._run, name="checkpointer", daemon=True)
+        self._thread.start()
+
+    def save(self, name: str, state: Dict[str, Any]) -> Path:
+        """Queue `state` to be written to directory/name, returns the final path."""
+        self._raise_pending_error()
+        path = self.directory / name
+        self._queue.put((path, snapshot(state)))
+        return path
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                path, state = item
+                # write to a temporary file and rename it, a crash never leaves a truncated checkpoint
+                tmp = path.with_name(path.name + ".tmp")
+                torch.save(state, tmp)
+                os.replace(tmp, path)
+                self.saved.append(path)
+                logging.info("Saved checkpoint to %s", path)
+                self._rotate()
+            except BaseException as error:  # surfaced on the training thread by the next save/close
+                self._error = error
+            finally:
+                self._queue.task_done()
+
+    def _rotate(self) -> None:
+        if self.keep_last <= 0:
+            return
+        while len(self.saved) > self.keep_last:
+            old = self.saved.pop(0)
+            if old.exists() and old not in self.saved:
+                old.unlink()
+
+    def _raise_pending_error(self) -> None:
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError("Writing a checkpoint failed") from error
+
+    def wait(self) -> None:
+        """Block until every queued checkpoint is on disk."""
+        self._queue.join()
+        self._raise_pending_error()
+
+    def close(self) -> None:
+        """Flush pending checkpoints and stop the worker thread."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._raise_pending_error()
@@ -0,0 +1,87 @@
+"""torch.distributed process-group helpers for multi-process finetuning (torchrun)."""
+
+from dataclasses import dataclass
+from typing import Dict, Iterable
+
+import logging
+import os
+
+import torch
+import torch.distributed as dist
+from torch._utils import _flatten_dense_tensors, _unflatten_dense_tensors
+
+
+@dataclass(frozen=True)
+class DistContext:
+    """Rank layout of the current process; a single process is rank 0 of world size 1."""
+
+    rank: int = 0
+    world_size: int = 1
+    local_rank: int = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.world_size > 1
+
+    @property
+    def is_main(self) -> bool:
+        return self.rank == 0
+
+
+def init_distributed(backend: str = "gloo") -> DistContext:
+    """Join the process group described by the torchrun environment, if there is one.
+
+    gloo runs on CPU-only machines; use nccl for multi-GPU nodes.
+    """
+    world_size = int(os.environ.get("WORLD_SIZE", 1))
+    if world_size <= 1:
+        return DistContext()
+    if not dist.is_initialized():
+        dist.init_process_group(backend=backend)
+    ctx = DistContext(dist.get_rank(), dist.get_world_size(), int(os.environ.get("LOCAL_RANK", 0)))
+    if not ctx.is_main:
+        # only rank 0 reports progress
+        logging.getLogger().setLevel(logging.WARNING)
+    return ctx
+
+
+def cleanup_distributed() -> None:
+    if dist.is_available() and dist.is_initialized():
+        dist.destroy_process_group()
+
+
+def barrier(ctx: DistContext) -> None:
+    if ctx.enabled:
+        dist.barrier()
+
+
+def broadcast_parameters(ctx: DistContext, tensors: Iterable[torch.Tensor]) -> None:
+    """Copy rank 0's parameters and buffers to every rank, so all replicas start identical."""
+    if not ctx.enabled:
+        return
+    for tensor in tensors:
+        dist.broadcast(tensor.data, src=0)
+
+
+def all_reduce_gradients(ctx: DistContext, params: Iterable[torch.nn.Parameter]) -> None:
+    """Average the gradients of params over all ranks in one flattened all-reduce."""
+    if not ctx.enabled:
+        return
+    grads = [param.grad for param in params if param.grad is not None]
+    if not grads:
+        return
+    flat = _flatten_dense_tensors(grads)
+    dist.all_reduce(flat, op=dist.ReduceOp.SUM)
+    flat /= ctx.world_size
+    for grad, synced in zip(grads, _unflatten_dense_tensors(flat, grads)):
+        grad.copy_(synced)
+
+
+def all_reduce_sums(ctx: DistContext, values: Dict[str, float], device: torch.device) -> Dict[str, float]:
+    """Sum scalar metrics over all ranks."""
+    if not ctx.enabled:
+        return dict(values)
+    names = sorted(values)
+    buffer = torch.tensor([float(values[name]) for name in names], dtype=torch.float64, device=device)
+    dist.all_reduce(buffer, op=dist.ReduceOp.SUM)
+    return dict(zip(names, buffer.tolist()))
@@ -0,0 +1,159 @@
+"""Sharded, memory-mapped cache of frozen encoder features for finetuning only the heads."""
+
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+import torch
+from torch import nn
+
+
+def model_hash(model: nn.Module, prefixes: Sequence[str], config: Optional[Dict[str, Any]] = None) -> str:
+    """Hash of the frozen encoder weights under `prefixes` plus the config that shapes its inputs."""
+    digest = hashlib.sha1(json.dumps(config or {}, sort_keys=True, default=str).encode())
+    for name, tensor in model.state_dict().items():
+        if name.startswith(tuple(prefixes)):
+            digest.update(f"{name}|{tuple(tensor.shape)}|{tensor.dtype}".encode())
+            digest.update(tensor.detach().cpu().contiguous().view(torch.uint8).numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+
+def feature_key(image_id: Any, question: Optional[str]) -> str:
+    """Cache key of one (image, question) input."""
+    return hashlib.sha1(f"{image_id}|{question or ''}".encode("utf-8")).hexdigest()
+
+
+def as_feature_dict(features: Any) -> Dict[str, torch.Tensor]:
+    """Encoders may return one tensor or a dict of named tensors, the cache always stores the dict."""
+    return features if isinstance(features, dict) else {"features": features}
+
+
+class FeatureCache:
+    """Read side of a feature cache: {name}-{shard}.npy arrays of rows, mapped on first access."""
+
+    def __init__(self, path: str) -> None:
+        self.path = Path(path)
+        with open(self.path / "index.json", "r") as f:
+            meta = json.load(f)
+        self.names: List[str] = meta["names"]
+        self.single = meta["single"]
+        self.rows: Dict[str, Tuple[int, int]] = {key: tuple(loc) for key, loc in meta["rows"].items()}
+        self._shards: Dict[Tuple[str, int], np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.rows
+
+    def _shard(self, name: str, shard: int) -> np.ndarray:
+        if (name, shard) not in self._shards:
+            self._shards[name, shard] = np.load(self.path / f"{name}-{shard:05d}.npy", mmap_mode="r")
+        return self._shards[name, shard]
+
+    def batch(self, keys: Sequence[str], dtype: torch.dtype = torch.float32) -> Any:
+        """Gather the features of keys, in the same layout the encoder returned them."""
+        locations = np.array([self.rows[key] for key in keys], dtype=np.int64).reshape(-1, 2)
+        out = {}
+        for name in self.names:
+            parts = [None] * len(keys)
+            for shard in np.unique(locations[:, 0]):
+                members = np.flatnonzero(locations[:, 0] == shard)
+                # one fancy-indexed read per shard, in row order
+                order = members[np.argsort(locations[members, 1], kind="stable")]
+                rows = self._shard(name, int(shard))[locations[order, 1]]
+                for i, row in zip(order, rows):
+                    parts[i] = row
+            out[name] = torch.from_numpy(np.stack(parts)).to(dtype)
+        return out["features"] if self.single else out
+
+
+class FeatureCacheWriter:
+    """Append encoder outputs into fixed-size preallocated shards, then publish the index atomically."""
+
+    def __init__(self, path: str, shard_rows: int = 4096, dtype: np.dtype = np.float16) -> None:
+        self.path = Path(path)
+        self.tmp = Path(f"{path}.tmp{os.getpid()}")
+        shutil.rmtree(self.tmp, ignore_errors=True)
+        self.tmp.mkdir(parents=True)
+        self.shard_rows = shard_rows
+        self.dtype = np.dtype(dtype)
+        self.rows: Dict[str, Tuple[int, int]] = {}
+        self.names: Optional[List[str]] = None
+        self.single = True
+        self._arrays: Dict[str, np.ndarray] = {}
+        self._shard = -1
+        self._fill = shard_rows
+
+    def _open_shard(self, features: Dict[str, np.ndarray]) -> None:
+        self._arrays = {}
+        self._shard += 1
+        self._fill = 0
+        for name, array in features.items():
+            self._arrays[name] = np.lib.format.open_memmap(
+                self.tmp / f"{name}-{self._shard:05d}.npy",
+                mode="w+",
+                dtype=self.dtype,
+                shape=(self.shard_rows, *array.shape[1:]),
+            )
+
+    def write(self, keys: Sequence[str], features: Any) -> None:
+        """Store one batch of encoder output, row i under keys[i]."""
+        if self.names is None:
+            self.single = not isinstance(features, dict)
+        features = {name: value.detach().float().cpu().numpy() for name, value in as_feature_dict(features).items()}
+        if self.names is None:
+            self.names = sorted(features)
+        start = 0
+        while start < len(keys):
+            if self._fill == self.shard_rows:
+                self._open_shard(features)
+            count = min(len(keys) - start, self.shard_rows - self._fill)
+            for name in self.names:
+                self._arrays[name][self._fill : self._fill + count] = features[name][start : start + count]
+            for offset, key in enumerate(keys[start : start + count]):
+                self.rows[key] = (self._shard, self._fill + offset)
+            self._fill += count
+            start += count
+
+    def close(self) -> FeatureCache:
+        """Flush the shards, write the index and move the finished cache into place."""
+        for array in self._arrays.values():
+            array.flush()
+        self._arrays = {}
+        with open(self.tmp / "index.json", "w") as f:
+            json.dump({"names": self.names or [], "single": self.single, "rows": self.rows}, f)
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.replace(self.tmp, self.path)
+        return FeatureCache(self.path)
+
+
+def build_feature_cache(
+    model: nn.Module,
+    batches: Iterable[Dict[str, Any]],
+    path: str,
+    device: torch.device,
+    shard_rows: int = 4096,
+) -> FeatureCache:
+    """Run model.encode once over every distinct (image_id, question) of batches and cache the output."""
+    writer = FeatureCacheWriter(path, shard_rows)
+    model.eval()
+    with torch.inference_mode():
+        for batch in batches:
+            questions = batch.get("question") or [None] * len(batch["image_id"])
+            keys = [feature_key(image_id, question) for image_id, question in zip(batch["image_id"], questions)]
+            todo = [i for i, key in enumerate(keys) if key not in writer.rows]
+            if not todo:
+                continue
+            images = batch["image"][todo].to(device, non_blocking=True)
+            features = model.encode(images, [questions[i] for i in todo])
+            writer.write([keys[i] for i in todo], features)
+    cache = writer.close()
+    logging.info("Cached encoder features of %d inputs in %s", len(cache), path)
+    return cache
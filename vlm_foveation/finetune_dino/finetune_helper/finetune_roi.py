@@ -1,12 +1,107 @@
-"""Skeleton finetuning pipeline for Grounding DINO ROI prediction with gaze supervision."""
+"""Finetuning pipeline for Grounding DINO ROI prediction with gaze supervision."""
 
 from pathlib import Path
-from typing import Any, Dict, Iterable, Optional
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
 
 import logging
+import time
+from contextlib import nullcontext
+
 import torch
+import torch.nn.functional as F
 from torch import nn
 
+from .checkpointing import AsyncCheckpointer
+from .distributed import DistContext, all_reduce_gradients, all_reduce_sums, barrier, broadcast_parameters
+from .feature_cache import FeatureCache, build_feature_cache, feature_key, model_hash
+from .gaze_targets import GazeTargetConverter, GazeTargetStore
+
+PRECISIONS = ("fp32", "bf16", "fp16")
+
+
+def box_cxcywh_to_xyxy(boxes: torch.Tensor) -> torch.Tensor:
+    """Convert (cx, cy, w, h) boxes to (x0, y0, x1, y1)."""
+    cx, cy, w, h = boxes.unbind(-1)
+    return torch.stack([cx - 0.5 * w, cy - 0.5 * h, cx + 0.5 * w, cy + 0.5 * h], dim=-1)
+
+
+def generalized_box_iou(boxes_a: torch.Tensor, boxes_b: torch.Tensor) -> torch.Tensor:
+    """Element-wise GIoU of two broadcastable (x0, y0, x1, y1) box tensors."""
+    area_a = (boxes_a[..., 2] - boxes_a[..., 0]).clamp_min(0) * (boxes_a[..., 3] - boxes_a[..., 1]).clamp_min(0)
+    area_b = (boxes_b[..., 2] - boxes_b[..., 0]).clamp_min(0) * (boxes_b[..., 3] - boxes_b[..., 1]).clamp_min(0)
+    inter_wh = (torch.minimum(boxes_a[..., 2:], boxes_b[..., 2:]) - torch.maximum(boxes_a[..., :2], boxes_b[..., :2])).clamp_min(0)
+    inter = inter_wh[..., 0] * inter_wh[..., 1]
+    union = area_a + area_b - inter
+    hull_wh = (torch.maximum(boxes_a[..., 2:], boxes_b[..., 2:]) - torch.minimum(boxes_a[..., :2], boxes_b[..., :2])).clamp_min(0)
+    hull = hull_wh[..., 0] * hull_wh[..., 1]
+    iou = inter / union.clamp_min(1e-7)
+    return iou - (hull - union) / hull.clamp_min(1e-7)
+
+
+class GazeBoxLoss(nn.Module):
+    """L1 + GIoU loss between every valid gaze box and its closest predicted box."""
+
+    def __init__(self, l1_weight: float = 5.0, giou_weight: float = 2.0) -> None:
+        super().__init__()
+        self.l1_weight = l1_weight
+        self.giou_weight = giou_weight
+
+    def forward(self, outputs: Dict[str, torch.Tensor], targets: Dict[str, torch.Tensor]) -> torch.Tensor:
+        pred, target, valid = outputs["boxes"].float(), targets["boxes"].float(), targets["box_valid"]
+        # [B, K, Q] L1 cost of every target/prediction pair, each target takes its cheapest prediction
+        cost = (target[:, :, None, :] - pred[:, None, :, :]).abs().sum(-1)
+        match = cost.argmin(dim=-1)
+        matched = pred.gather(1, match[..., None].expand(-1, -1, 4))
+        l1 = (matched - target).abs().sum(-1)
+        giou = generalized_box_iou(box_cxcywh_to_xyxy(matched), box_cxcywh_to_xyxy(target))
+        per_box = self.l1_weight * l1 + self.giou_weight * (1 - giou)
+        return (per_box * valid).sum() / valid.sum().clamp_min(1)
+
+
+class GazeMaskLoss(nn.Module):
+    """MSE between predicted and gaze soft masks, predictions resampled to the target resolution."""
+
+    def forward(self, outputs: Dict[str, torch.Tensor], targets: Dict[str, torch.Tensor]) -> torch.Tensor:
+        pred, target = outputs["masks"].float(), targets["masks"].float()
+        if pred.shape[-2:] != target.shape[-2:]:
+            pred = F.interpolate(pred[:, None], size=target.shape[-2:], mode="bilinear", align_corners=False)[:, 0]
+        return F.mse_loss(pred, target)
+
+
+class TinyROIModel(nn.Module):
+    """Small CPU stand-in with Grounding DINO's output contract, used to exercise the trainer end-to-end.
+
+    Returns {"boxes": [B, Q, 4] normalized cxcywh, "masks": [B, h, w]} for a [B, 3, H, W] image batch.
+    `encode` is the part under `encoder_prefixes`, whose output can be cached while it is frozen.
+    """
+
+    encoder_prefixes = ("backbone",)
+
+    def __init__(self, num_queries: int = 8, width: int = 16) -> None:
+        super().__init__()
+        self.num_queries = num_queries
+        self.backbone = nn.Sequential(
+            nn.Conv2d(3, width, 3, stride=2, padding=1),
+            nn.ReLU(),
+            nn.Conv2d(width, width, 3, stride=2, padding=1),
+            nn.ReLU(),
+        )
+        self.box_head = nn.Linear(width, num_queries * 4)
+        self.mask_head = nn.Conv2d(width, 1, 1)
+
+    def encode(self, images: torch.Tensor, questions: Optional[Sequence[str]] = None) -> torch.Tensor:
+        return self.backbone(images)
+
+    def decode(self, features: torch.Tensor) -> Dict[str, torch.Tensor]:
+        boxes = self.box_head(features.mean(dim=(2, 3))).sigmoid()
+        return {
+            "boxes": boxes.view(len(features), self.num_queries, 4),
+            "masks": self.mask_head(features)[:, 0].sigmoid(),
+        }
+
+    def forward(self, images: torch.Tensor, questions: Optional[Sequence[str]] = None) -> Dict[str, torch.Tensor]:
+        return self.decode(self.encode(images, questions))
+
 
 class GroundingDINOROITrainer:
     """Manage Grounding DINO finetuning with gaze-conditioned supervision signals."""
@@ -16,72 +111,248 @@ class GroundingDINOROITrainer:
         config: Dict[str, Any],
         checkpoints_dir: str,
         layers_to_train: Optional[Iterable[str]] = None,
+        dist_ctx: Optional[DistContext] = None,
     ) -> None:
         self.config = config
+        self.dist = dist_ctx or DistContext()
         self.device = torch.device(
             config.get("device", "cuda") if torch.cuda.is_available() else "cpu"
         )
+        if self.device.type == "cuda" and self.dist.enabled:
+            self.device = torch.device("cuda", self.dist.local_rank)
         self.checkpoints_dir = Path(checkpoints_dir)
         self.checkpoints_dir.mkdir(parents=True, exist_ok=True)
         self.localization_mode = config.get("localization_mode", "boxes")
+        self.precision = config.get("precision", "fp32")
+        if self.precision not in PRECISIONS:
+            raise ValueError(f"precision must be one of {PRECISIONS}, got {self.precision!r}")
+        self.grad_accum_steps = max(1, int(config.get("grad_accum_steps", 1)))
+        self.max_grad_norm = config.get("max_grad_norm")
 
         logging.basicConfig(level=logging.INFO)
 
         self.model = self._load_pretrained_model(
             checkpoint_path=config.get("pretrained_ckpt", "checkpoints/grounding_dino.pth")
         )
+        self.gaze_converter = GazeTargetConverter(
+            mask_size=tuple(config.get("mask_size", (64, 64))),
+            box_method=config.get("box_method", "components"),
+            threshold=config.get("box_threshold", 0.5),
+            coverage=config.get("box_coverage", 0.9),
+            max_boxes=config.get("max_boxes", 3),
+        )
+        # Targets precomputed offline with GazeTargetStore.build, so epochs only read tensors.
+        target_store = config.get("gaze_target_store")
+        self.target_store = GazeTargetStore(target_store) if target_store else None
         self._freeze_backbone(layers_to_train=layers_to_train)
+        broadcast_parameters(self.dist, list(self.model.parameters()) + list(self.model.buffers()))
         self.criterion = self._configure_loss()
-        self.optimizer = None  # TODO: instantiate optimizer once trainable params are finalized.
+        trainable = [param for param in self.model.parameters() if param.requires_grad]
+        self.optimizer = torch.optim.AdamW(
+            trainable, lr=config.get("lr", 1e-4), weight_decay=config.get("weight_decay", 1e-4)
+        )
+        # fp16 needs loss scaling, bf16 has the fp32 exponent range and does not
+        self.scaler = torch.amp.GradScaler("cuda", enabled=self.precision == "fp16" and self.device.type == "cuda")
+        self.feature_cache: Optional[FeatureCache] = None
+        # rank 0 writes every checkpoint, the replicas are identical
+        self.checkpointer = None
+        if self.dist.is_main:
+            self.checkpointer = AsyncCheckpointer(self.checkpoints_dir, keep_last=config.get("keep_checkpoints", 3))
 
     def _load_pretrained_model(self, checkpoint_path: str) -> nn.Module:
-        """Load Grounding DINO weights and move to the correct device."""
-        # TODO: Replace with actual Grounding DINO loading + config driven instantiation.
-        model = nn.Module()  # Placeholder container until the user integrates real model code.
+        """Build the model named by config["model"] and load matching weights from checkpoint_path."""
+        model = self.config.get("model", "tiny")
+        if model == "tiny":
+            model = TinyROIModel(num_queries=self.config.get("num_queries", 8))
+        elif not isinstance(model, nn.Module):
+            raise ValueError(f"Unknown model {model!r}, pass 'tiny' or an nn.Module")
+        if checkpoint_path and Path(checkpoint_path).exists():
+            state = torch.load(checkpoint_path, map_location="cpu")
+            missing, unexpected = model.load_state_dict(state.get("model", state), strict=False)
+            logging.info("Loaded %s (%d missing, %d unexpected keys)", checkpoint_path, len(missing), len(unexpected))
         model.to(self.device)
         return model
 
     def _freeze_backbone(self, layers_to_train: Optional[Iterable[str]]) -> None:
-        """Freeze all model parameters except the selected layers."""
-        # TODO: Iterate over model.named_parameters() and toggle requires_grad based on layers_to_train.
-        pass
+        """Freeze all model parameters except the selected layers (parameter name prefixes)."""
+        if layers_to_train is None:
+            return
+        prefixes = tuple(layers_to_train)
+        trained = 0
+        for name, param in self.model.named_parameters():
+            param.requires_grad = name.startswith(prefixes)
+            trained += param.numel() if param.requires_grad else 0
+        if trained == 0:
+            raise ValueError(f"layers_to_train {list(prefixes)} matches no parameter of the model")
+        total = sum(param.numel() for param in self.model.parameters())
+        logging.info("Training %d of %d parameters", trained, total)
 
     def _configure_loss(self) -> nn.Module:
         """Return localization or mask loss module depending on the supervision mode."""
         if self.localization_mode == "boxes":
-            # TODO: Combine L1 and GIoU losses for bounding box regression.
-            return nn.L1Loss()
-        # TODO: Provide KLDivLoss or MSELoss depending on heatmap target distribution.
-        return nn.MSELoss()
+            return GazeBoxLoss(self.config.get("l1_weight", 5.0), self.config.get("giou_weight", 2.0))
+        return GazeMaskLoss()
+
+    def _to_device(self, tensor: torch.Tensor) -> torch.Tensor:
+        # pinned host memory makes the non-blocking copy a true async DMA on CUDA
+        if self.device.type == "cuda" and not tensor.is_pinned():
+            tensor = tensor.pin_memory()
+        return tensor.to(self.device, non_blocking=True)
 
     def convert_gaze_supervision(self, gaze_signal: Dict[str, Any]) -> Dict[str, Any]:
-        """Map gaze inputs to bounding boxes or soft masks as required by the training mode."""
-        # TODO: Implement conversion using VQA-MHUG gaze heatmaps/points.
-        raise NotImplementedError("Gaze conversion logic must be implemented by the user.")
-
-    def train(self, dataloader: Iterable[Dict[str, Any]], num_epochs: int) -> None:
-        """Run the finetuning loop, logging epoch losses and saving checkpoints."""
-        # NOTE: `dataloader` should originate from a placeholder dataset providing
-        # image tensors, question text tokens, and gaze annotations per batch.
-        for epoch in range(num_epochs):
-            epoch_loss = 0.0
-            # TODO: Replace with actual training steps once dataset + model are wired.
-            # Example pseudocode:
-            # for batch in dataloader:
-            #     images = batch["image"].to(self.device)
-            #     gaze_targets = self.convert_gaze_supervision(batch["gaze"])
-            #     outputs = self.model(images, batch["question"], gaze_targets)
-            #     loss = self.criterion(outputs, gaze_targets)
-            #     loss.backward()
-            #     self.optimizer.step()
-            #     self.optimizer.zero_grad()
-            #     epoch_loss += loss.item()
-            logging.info("Epoch %03d | loss=%.4f", epoch + 1, epoch_loss)
-            self._save_checkpoint(epoch)
+        """Map gaze inputs to bounding boxes or soft masks as required by the training mode.
+
+        `gaze_signal` holds either (qid, pid) "keys" of the cached target store, or the raw
+        "attention_maps" / "scanpaths" deliverables of the batch, which are converted on the fly.
+        """
+        if self.target_store is not None and "keys" in gaze_signal:
+            targets = self.target_store.batch(gaze_signal["keys"])
+        else:
+            targets = self.gaze_converter(gaze_signal.get("attention_maps"), gaze_signal.get("scanpaths"))
+        if self.localization_mode == "boxes":
+            targets = {"boxes": targets["boxes"], "box_valid": targets["box_valid"]}
+        else:
+            targets = {"masks": targets["masks"]}
+        return {name: self._to_device(value) for name, value in targets.items()}
+
+    def precompute_features(self, dataloader: Iterable[Dict[str, Any]], cache_root: str) -> FeatureCache:
+        """Run the frozen encoder once over dataloader; later epochs train the heads from the cache.
+
+        Batches need an "image_id" list next to "image" and "question". The cache folder under
+        cache_root is named by the encoder weights and input config, so it is reused until they change.
+        """
+        prefixes = tuple(getattr(self.model, "encoder_prefixes", ()))
+        if not prefixes or not hasattr(self.model, "encode"):
+            raise ValueError("Feature caching needs a model with encode/decode and encoder_prefixes")
+        trainable = [name for name, param in self.model.named_parameters() if param.requires_grad and name.startswith(prefixes)]
+        if trainable:
+            raise ValueError(f"Cached features would go stale, encoder parameters are trained: {trainable[:3]}")
+        inputs = {key: self.config.get(key) for key in ("image_size", "mask_size")}
+        path = Path(cache_root) / f"features_{model_hash(self.model, prefixes, inputs)}"
+        # rank 0 fills the cache from the unsharded dataloader, the other ranks wait and map it
+        if self.dist.is_main and not (path / "index.json").exists():
+            build_feature_cache(self.model, dataloader, path, self.device)
+        barrier(self.dist)
+        self.feature_cache = FeatureCache(path)
+        return self.feature_cache
+
+    def _device_batches(self, dataloader: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """Yield batches on the device, issuing the copy of batch i+1 before batch i is computed."""
+        pending = None
+        for batch in dataloader:
+            staged = dict(batch)
+            if self.feature_cache is not None:
+                questions = batch.get("question") or [None] * len(batch["image_id"])
+                keys = [feature_key(image_id, question) for image_id, question in zip(batch["image_id"], questions)]
+                features = self.feature_cache.batch(keys)
+                if isinstance(features, dict):
+                    staged["features"] = {name: self._to_device(value) for name, value in features.items()}
+                else:
+                    staged["features"] = self._to_device(features)
+            else:
+                staged["image"] = self._to_device(batch["image"])
+            staged["targets"] = self.convert_gaze_supervision(batch["gaze"])
+            if pending is not None:
+                yield pending
+            pending = staged
+        if pending is not None:
+            yield pending
+
+    def _autocast(self):
+        if self.precision == "fp32":
+            return nullcontext()
+        dtype = torch.bfloat16 if self.precision == "bf16" else torch.float16
+        return torch.autocast(self.device.type, dtype=dtype)
+
+    def _optimizer_step(self) -> None:
+        # one all-reduce per optimizer step, accumulated micro-batches are synced together
+        all_reduce_gradients(self.dist, [param for param in self.model.parameters() if param.requires_grad])
+        if self.max_grad_norm:
+            self.scaler.unscale_(self.optimizer)
+            torch.nn.utils.clip_grad_norm_(
+                [param for param in self.model.parameters() if param.requires_grad], self.max_grad_norm
+            )
+        self.scaler.step(self.optimizer)
+        self.scaler.update()
+        self.optimizer.zero_grad(set_to_none=True)
+
+    def _forward(self, batch: Dict[str, Any]) -> Dict[str, torch.Tensor]:
+        with self._autocast():
+            if "features" in batch:
+                return self.model.decode(batch["features"])
+            return self.model(batch["image"], batch.get("question"))
+
+    def _mean_over_ranks(self, total: Any, batches: int) -> float:
+        sums = all_reduce_sums(self.dist, {"loss": float(total), "batches": batches}, self.device)
+        return sums["loss"] / max(sums["batches"], 1)
+
+    def train_epoch(self, dataloader: Iterable[Dict[str, Any]]) -> float:
+        """Run one pass over dataloader, stepping the optimizer every grad_accum_steps batches.
+
+        Returns the mean batch loss over all ranks.
+        """
+        self.model.train()
+        total, batches, micro = 0.0, 0, 0
+        self.optimizer.zero_grad(set_to_none=True)
+        for batch in self._device_batches(dataloader):
+            loss = self.criterion(self._forward(batch), batch["targets"])
+            self.scaler.scale(loss / self.grad_accum_steps).backward()
+            micro += 1
+            if micro == self.grad_accum_steps:
+                self._optimizer_step()
+                micro = 0
+            # a tensor sum avoids a device sync per step, .item() happens once per epoch
+            total = loss.detach() + total
+            batches += 1
+        if micro:
+            self._optimizer_step()
+        return self._mean_over_ranks(total, batches)
+
+    def evaluate(self, dataloader: Iterable[Dict[str, Any]]) -> float:
+        """Mean batch loss of dataloader over all ranks, without updating the model."""
+        self.model.eval()
+        total, batches = 0.0, 0
+        with torch.inference_mode():
+            for batch in self._device_batches(dataloader):
+                total = self.criterion(self._forward(batch), batch["targets"]) + total
+                batches += 1
+        return self._mean_over_ranks(total, batches)
+
+    def train(self, dataloader: Iterable[Dict[str, Any]], num_epochs: int) -> List[float]:
+        """Run the finetuning loop, logging epoch losses and saving checkpoints.
+
+        `dataloader` yields dicts with an "image" tensor batch (unused, may be None, once
+        precompute_features filled the cache), "image_id" and "question" lists and the "gaze" signal
+        accepted by convert_gaze_supervision. Returns the mean loss of every epoch.
+        """
+        losses = []
+        sampler = getattr(dataloader, "sampler", None)
+        try:
+            for epoch in range(num_epochs):
+                if hasattr(sampler, "set_epoch"):
+                    sampler.set_epoch(epoch)  # reshuffles the DistributedSampler shards
+                start = time.perf_counter()
+                epoch_loss = self.train_epoch(dataloader)
+                losses.append(epoch_loss)
+                logging.info("Epoch %03d | loss=%.4f | %.1fs", epoch + 1, epoch_loss, time.perf_counter() - start)
+                self._save_checkpoint(epoch)
+        finally:
+            if self.checkpointer is not None:
+                self.checkpointer.wait()
+        return losses
 
     def _save_checkpoint(self, epoch: int) -> None:
-        """Persist model (and optimizer) state to disk for reproducibility."""
+        """Persist model and optimizer state to disk on the background checkpoint thread (rank 0 only)."""
+        if self.checkpointer is None:
+            return
         checkpoint_path = self.checkpoints_dir / f"roi_trainer_epoch_{epoch+1:03d}.pt"
-        # TODO: Serialize actual model/optimizer states here.
-        torch.save({"epoch": epoch + 1}, checkpoint_path)
-        logging.info("Saved checkpoint to %s", checkpoint_path)
+        self.checkpointer.save(
+            checkpoint_path.name,
+            {
+                "epoch": epoch + 1,
+                "model": self.model.state_dict(),
+                "optimizer": self.optimizer.state_dict(),
+                "scaler": self.scaler.state_dict(),
+                "config": {key: value for key, value in self.config.items() if key != "model"},
+            },
+        )
@@ -0,0 +1,95 @@
+"""Map-style dataset over the gaze-supervised samples of one finetuning split."""
+
+from pathlib import Path
+from typing import Any, Dict, List, Sequence, Tuple
+
+import json
+import re
+
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import Dataset
+
+from .gaze_targets import GazeTargetStore
+
+IMAGENET_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+IMAGENET_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+
+def vqa_image_id(question_id: str) -> int:
+    """VQA v2 question ids are image_id * 1000 + question index."""
+    return int(question_id) // 1000
+
+
+def split_images(split_dir: Path) -> Dict[int, Path]:
+    """{image_id: path} of `<split_dir>/images/*<image_id>.jpg`, COCO file names work as is."""
+    images = {}
+    for path in (Path(split_dir) / "images").glob("*.jpg"):
+        match = re.search(r"(\d+)$", path.stem)
+        if match:
+            images[int(match.group(1))] = path
+    return images
+
+
+def split_questions(split_dir: Path) -> Dict[str, str]:
+    """{question_id: text} of the optional `<split_dir>/questions.json`, empty without it."""
+    questions_file = Path(split_dir) / "questions.json"
+    if not questions_file.exists():
+        return {}
+    with open(questions_file, "r") as f:
+        return {str(qid): text for qid, text in json.load(f).items()}
+
+
+class GazeROIDataset(Dataset):
+    """One item per (qid, pid) of `<split_dir>/gaze_targets`, with its image and question.
+
+    Images are read from `<split_dir>/images/*<image_id>.jpg` (COCO file names work as is) and
+    question texts from the optional `<split_dir>/questions.json` ({question_id: text}). The
+    target store is written by build_targets.py. With `load_images` off (training from cached
+    encoder features) items carry no image and nothing is decoded.
+    """
+
+    def __init__(self, split_dir: str, image_size: Tuple[int, int] = (224, 224), load_images: bool = True) -> None:
+        self.split_dir = Path(split_dir)
+        self.image_size = tuple(image_size)
+        self.load_images = load_images
+        self.target_store_path = self.split_dir / "gaze_targets"
+        self.keys: List[Tuple[str, str]] = list(GazeTargetStore(self.target_store_path).index)
+        self.images = split_images(self.split_dir)
+        self.questions = split_questions(self.split_dir)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def load_image(self, image_id: int) -> torch.Tensor:
+        """Decode, resize and ImageNet-normalize an image into a [3, H, W] float tensor."""
+        with Image.open(self.images[image_id]) as img:
+            img.draft("RGB", self.image_size)
+            array = np.asarray(img.convert("RGB").resize(self.image_size, Image.BILINEAR), dtype=np.float32)
+        array = (array / 255.0 - IMAGENET_MEAN) / IMAGENET_STD
+        return torch.from_numpy(array.transpose(2, 0, 1).copy())
+
+    def __getitem__(self, idx: int) -> Dict[str, Any]:
+        qid, pid = self.keys[idx]
+        image_id = vqa_image_id(qid)
+        return {
+            "image": self.load_image(image_id) if self.load_images else None,
+            "image_id": image_id,
+            "question": self.questions.get(qid, ""),
+            "key": (qid, pid),
+        }
+
+
+def collate_gaze_batch(items: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+    """Stack images and gather the target store keys in the batch layout GroundingDINOROITrainer expects.
+
+    "image" is None for items of a dataset that does not load images.
+    """
+    images = [item["image"] for item in items]
+    return {
+        "image": torch.stack(images) if images[0] is not None else None,
+        "image_id": [item["image_id"] for item in items],
+        "question": [item["question"] for item in items],
+        "gaze": {"keys": [item["key"] for item in items]},
+    }
@@ -0,0 +1,308 @@
+"""Vectorized conversion of VQA-MHUG gaze deliverables into ROI boxes and soft masks."""
+
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import glob
+import json
+import os
+import shutil
+import sys
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+DELIVERABLES_ROOT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "datasets", "VQA_MHUG", "VQA_MHUG"
+)
+BOX_METHODS = ("components", "percentile")
+
+Key = Tuple[str, str]
+
+
+def pad_scanpaths(scanpaths: Sequence[Optional[Sequence[Optional[Dict[str, float]]]]]) -> Dict[str, torch.Tensor]:
+    """Pad scanpath deliverables (normalized x/y, None for breaks) into [B, N] tensors plus a valid mask."""
+    scanpaths = [path or [] for path in scanpaths]
+    length = max([len(path) for path in scanpaths] + [1])
+    columns = np.zeros((3, len(scanpaths), length), dtype=np.float32)
+    valid = np.zeros((len(scanpaths), length), dtype=bool)
+    for row, path in enumerate(scanpaths):
+        for col, fixation in enumerate(path):
+            if fixation is not None:
+                columns[:, row, col] = fixation["x"], fixation["y"], fixation["duration"]
+                valid[row, col] = True
+    x, y, duration = torch.from_numpy(columns)
+    return {"x": x, "y": y, "duration": duration, "valid": torch.from_numpy(valid)}
+
+
+def resize_maps(attmaps: Sequence[np.ndarray], size: Tuple[int, int]) -> torch.Tensor:
+    """Area-resample attention maps of any resolution to a [B, H, W] float32 batch scaled to max 1."""
+    out = torch.zeros((len(attmaps), *size), dtype=torch.float32)
+    by_shape: Dict[Tuple[int, ...], List[int]] = {}
+    for i, attmap in enumerate(attmaps):
+        by_shape.setdefault(np.shape(attmap), []).append(i)
+    # one interpolate call per distinct input resolution
+    for shape, rows in by_shape.items():
+        batch = torch.from_numpy(np.stack([np.asarray(attmaps[i], dtype=np.float32) for i in rows]))
+        if shape != tuple(size):
+            batch = F.interpolate(batch[:, None], size=size, mode="area")[:, 0]
+        out[rows] = batch
+    peak = out.flatten(1).amax(dim=1).clamp_min(1e-12)
+    return out / peak[:, None, None]
+
+
+def fixation_masks(
+    fixations: Dict[str, torch.Tensor],
+    size: Tuple[int, int],
+    sigma: float = 0.05,
+    duration_scaled: bool = True,
+) -> torch.Tensor:
+    """Render padded fixations as duration-weighted Gaussians on a [B, H, W] grid, scaled to max 1.
+
+    sigma is relative to the image side; every Gaussian is separable, so the batch is one matmul.
+    """
+    height, width = size
+    weights = fixations["duration"] if duration_scaled else torch.ones_like(fixations["x"])
+    weights = weights * fixations["valid"]
+    grid_y = (torch.arange(height, dtype=torch.float32) + 0.5) / height
+    grid_x = (torch.arange(width, dtype=torch.float32) + 0.5) / width
+    kernel_y = torch.exp(-0.5 * ((grid_y[None, None, :] - fixations["y"][..., None]) / sigma) ** 2)
+    kernel_x = torch.exp(-0.5 * ((grid_x[None, None, :] - fixations["x"][..., None]) / sigma) ** 2)
+    masks = torch.einsum("bnh,bnw->bhw", kernel_y * weights[..., None], kernel_x)
+    peak = masks.flatten(1).amax(dim=1).clamp_min(1e-12)
+    return masks / peak[:, None, None]
+
+
+def label_components(foreground: torch.Tensor, max_iterations: Optional[int] = None) -> torch.Tensor:
+    """Label 8-connected foreground regions of a [B, H, W] bool batch.
+
+    Every pixel starts with its own id and takes the largest id of its neighbourhood until
+    nothing changes, so the whole batch is labelled with max-pool sweeps. Background is 0.
+    """
+    batch, height, width = foreground.shape
+    fg = foreground[:, None].float()
+    ids = torch.arange(1, height * width + 1, dtype=torch.float32).view(1, 1, height, width)
+    labels = ids * fg
+    for _ in range(max_iterations or height * width):
+        spread = F.max_pool2d(labels, kernel_size=3, stride=1, padding=1) * fg
+        if torch.equal(spread, labels):
+            break
+        labels = spread
+    return labels[:, 0].long()
+
+
+def component_boxes(
+    masks: torch.Tensor, threshold: float = 0.5, max_boxes: int = 3
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Boxes around the connected regions of masks >= threshold * max, heaviest regions first.
+
+    Returns normalized (x0, y0, x1, y1) boxes [B, max_boxes, 4] and their valid flags [B, max_boxes].
+    """
+    batch, height, width = masks.shape
+    peak = masks.flatten(1).amax(dim=1).clamp_min(1e-12)
+    labels = label_components(masks >= threshold * peak[:, None, None]).flatten(1)
+    slots = height * width + 1
+    index = (labels + slots * torch.arange(batch)[:, None]).flatten()
+    rows = torch.arange(height).repeat_interleave(width).repeat(batch).float()
+    cols = torch.arange(width).repeat(height * batch).float()
+
+    def reduce(values: torch.Tensor, how: str, initial: float) -> torch.Tensor:
+        out = torch.full((batch * slots,), initial)
+        return out.scatter_reduce(0, index, values, how, include_self=True).view(batch, slots)
+
+    mass = reduce(masks.flatten().float(), "sum", 0.0)
+    mass[:, 0] = 0  # background
+    y0, x0 = reduce(rows, "amin", float(height)), reduce(cols, "amin", float(width))
+    y1, x1 = reduce(rows, "amax", -1.0) + 1, reduce(cols, "amax", -1.0) + 1
+    k = min(max_boxes, slots)
+    top_mass, top = mass.topk(k, dim=1)
+    boxes = torch.stack([x0.gather(1, top) / width, y0.gather(1, top) / height,
+                         x1.gather(1, top) / width, y1.gather(1, top) / height], dim=-1)
+    valid = top_mass > 0
+    return boxes * valid[..., None], valid
+
+
+def percentile_boxes(fixations: Dict[str, torch.Tensor], coverage: float = 0.9) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Central box holding `coverage` of the fixation duration along each axis.
+
+    Returns normalized (x0, y0, x1, y1) boxes [B, 1, 4] and valid flags [B, 1].
+    """
+    weights = fixations["duration"] * fixations["valid"]
+    total = weights.sum(dim=1, keepdim=True)
+    tail = torch.tensor([(1 - coverage) / 2, (1 + coverage) / 2]).expand(len(weights), 2).contiguous()
+    corners = []
+    for axis in ("x", "y"):
+        values = fixations[axis].masked_fill(~fixations["valid"], float("inf"))
+        values, order = values.sort(dim=1)
+        cumulative = weights.gather(1, order).cumsum(dim=1) / total.clamp_min(1e-12)
+        index = torch.searchsorted(cumulative.contiguous(), tail).clamp_max(values.shape[1] - 1)
+        corners.append(values.gather(1, index))
+    (x0, x1), (y0, y1) = (c.unbind(1) for c in corners)
+    valid = total[:, 0] > 0
+    boxes = torch.stack([x0, y0, x1, y1], dim=-1).clamp(0, 1).nan_to_num(0.0, 0.0, 0.0)
+    return (boxes * valid[:, None])[:, None], valid[:, None]
+
+
+def xyxy_to_cxcywh(boxes: torch.Tensor) -> torch.Tensor:
+    """Convert (x0, y0, x1, y1) boxes to the (cx, cy, w, h) layout of Grounding DINO labels."""
+    x0, y0, x1, y1 = boxes.unbind(-1)
+    return torch.stack([(x0 + x1) / 2, (y0 + y1) / 2, x1 - x0, y1 - y0], dim=-1)
+
+
+class GazeTargetConverter:
+    """Turn a batch of attention maps and/or scanpaths into box and soft-mask targets at model resolution."""
+
+    def __init__(
+        self,
+        mask_size: Tuple[int, int] = (64, 64),
+        box_method: str = "components",
+        threshold: float = 0.5,
+        coverage: float = 0.9,
+        max_boxes: int = 3,
+        sigma: float = 0.05,
+    ) -> None:
+        if box_method not in BOX_METHODS:
+            raise ValueError(f"box_method must be one of {BOX_METHODS}, got {box_method!r}")
+        self.mask_size = tuple(mask_size)
+        self.box_method = box_method
+        self.threshold = threshold
+        self.coverage = coverage
+        self.max_boxes = max_boxes
+        self.sigma = sigma
+
+    def __call__(
+        self,
+        attention_maps: Optional[Sequence[np.ndarray]] = None,
+        scanpaths: Optional[Sequence[Sequence[Optional[Dict[str, float]]]]] = None,
+    ) -> Dict[str, torch.Tensor]:
+        """Return {"masks": [B, H, W], "boxes": [B, K, 4] cxcywh, "box_valid": [B, K]}."""
+        fixations = pad_scanpaths(scanpaths) if scanpaths is not None else None
+        if attention_maps is not None:
+            masks = resize_maps(attention_maps, self.mask_size)
+        elif fixations is not None:
+            masks = fixation_masks(fixations, self.mask_size, self.sigma)
+        else:
+            raise ValueError("Gaze conversion needs attention maps or scanpaths")
+        if self.box_method == "percentile":
+            if fixations is None:
+                raise ValueError("Percentile boxes are computed from scanpaths")
+            boxes, valid = percentile_boxes(fixations, self.coverage)
+        else:
+            boxes, valid = component_boxes(masks, self.threshold, self.max_boxes)
+        return {"masks": masks, "boxes": xyxy_to_cxcywh(boxes) * valid[..., None], "box_valid": valid}
+
+
+def _packed_reader(folder: str) -> Any:
+    if DELIVERABLES_ROOT not in sys.path:
+        sys.path.insert(0, DELIVERABLES_ROOT)
+    from deliverable_store import PackedStoreReader
+
+    return PackedStoreReader(folder)
+
+
+def deliverable_keys(root: str) -> List[Key]:
+    """Sorted (qid, pid) keys of the img-attmap deliverables of one generate_deliverables condition."""
+    attmap_dir = os.path.join(root, "img-attmap")
+    if glob.glob(os.path.join(attmap_dir, "part-*.index")):
+        return sorted(_packed_reader(attmap_dir).keys())
+    names = sorted(os.path.basename(path)[:-4] for path in glob.glob(os.path.join(attmap_dir, "q*_p*.npy")))
+    return [tuple(name[1:].split("_p")) for name in names]
+
+
+def iter_deliverables(root: str, keys: Optional[Iterable[Key]] = None) -> Iterator[Tuple[Key, np.ndarray, Any]]:
+    """Yield ((qid, pid), img-attmap, scanpath) from the output folder of one generate_deliverables condition.
+
+    Reads both the one-file-per-sample layout and --STORE packed shards.
+    """
+    attmap_dir, scanpath_dir = os.path.join(root, "img-attmap"), os.path.join(root, "scanpath")
+    if keys is None:
+        keys = deliverable_keys(root)
+    if glob.glob(os.path.join(attmap_dir, "part-*.index")):
+        attmaps, scanpaths = _packed_reader(attmap_dir), _packed_reader(scanpath_dir)
+        for key in keys:
+            yield key, attmaps[key], scanpaths[key] if key in scanpaths else None
+        return
+    for qid, pid in keys:
+        scanpath_file = os.path.join(scanpath_dir, f"q{qid}_p{pid}")
+        scanpath = None
+        if os.path.exists(scanpath_file):
+            with open(scanpath_file, "r") as f:
+                scanpath = json.load(f)
+        yield (str(qid), str(pid)), np.load(os.path.join(attmap_dir, f"q{qid}_p{pid}.npy")), scanpath
+
+
+class GazeTargetStore:
+    """Precomputed gaze targets of a dataset as memory-mapped arrays, looked up by (qid, pid).
+
+    masks.npy is a float16 [N, H, W] stack, boxes.npy / box_valid.npy hold [N, K, 4] / [N, K].
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = Path(path)
+        with open(self.path / "keys.json", "r") as f:
+            meta = json.load(f)
+        self.config = meta["config"]
+        self.index = {tuple(key): i for i, key in enumerate(meta["keys"])}
+        self.masks = np.load(self.path / "masks.npy", mmap_mode="r")
+        self.boxes = np.load(self.path / "boxes.npy", mmap_mode="r")
+        self.box_valid = np.load(self.path / "box_valid.npy", mmap_mode="r")
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, key: Key) -> bool:
+        return (str(key[0]), str(key[1])) in self.index
+
+    def batch(self, keys: Sequence[Key]) -> Dict[str, torch.Tensor]:
+        """Gather the targets of a batch of (qid, pid) keys into tensors."""
+        rows = np.fromiter((self.index[str(q), str(p)] for q, p in keys), dtype=np.int64, count=len(keys))
+        # sorted gathers read the mapped files front to back
+        order = np.argsort(rows, kind="stable")
+        inverse = np.empty_like(order)
+        inverse[order] = np.arange(len(order))
+        sorted_rows = rows[order]
+        return {
+            "masks": torch.from_numpy(self.masks[sorted_rows][inverse].astype(np.float32)),
+            "boxes": torch.from_numpy(self.boxes[sorted_rows][inverse]),
+            "box_valid": torch.from_numpy(self.box_valid[sorted_rows][inverse]),
+        }
+
+    @classmethod
+    def build(
+        cls,
+        records: Iterable[Tuple[Key, np.ndarray, Any]],
+        path: str,
+        converter: GazeTargetConverter,
+        batch_size: int = 256,
+    ) -> "GazeTargetStore":
+        """Convert (key, attention map, scanpath) records in batches and write the store to path."""
+        tmp = f"{path}.tmp{os.getpid()}"
+        os.makedirs(tmp, exist_ok=True)
+        keys: List[Key] = []
+        parts: Dict[str, List[np.ndarray]] = {"masks": [], "boxes": [], "box_valid": []}
+        batch: List[Tuple[Key, np.ndarray, Any]] = []
+
+        def flush() -> None:
+            targets = converter([attmap for _, attmap, _ in batch], [scanpath for _, _, scanpath in batch])
+            parts["masks"].append(targets["masks"].numpy().astype(np.float16))
+            parts["boxes"].append(targets["boxes"].numpy().astype(np.float32))
+            parts["box_valid"].append(targets["box_valid"].numpy())
+            keys.extend((str(q), str(p)) for (q, p), _, _ in batch)
+            batch.clear()
+
+        for record in records:
+            batch.append(record)
+            if len(batch) == batch_size:
+                flush()
+        if batch:
+            flush()
+        for name, arrays in parts.items():
+            np.save(os.path.join(tmp, f"{name}.npy"), np.concatenate(arrays) if arrays else np.zeros((0,)))
+        config = {name: getattr(converter, name) for name in ("mask_size", "box_method", "threshold", "coverage", "max_boxes", "sigma")}
+        with open(os.path.join(tmp, "keys.json"), "w") as f:
+            json.dump({"config": config, "keys": keys}, f)
+        # readers never see a half written store
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp, path)
+        return cls(path)
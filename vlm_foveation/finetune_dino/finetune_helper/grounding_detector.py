@@ -0,0 +1,205 @@
+"""Batched Grounding DINO zero-shot detection service for offline CPU/GPU inference."""
+
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import logging
+import torch
+from PIL import Image
+from torch import nn
+
+from .startup import MODELS
+
+DEFAULT_MODEL_ID = "IDEA-Research/grounding-dino-tiny"
+PRECISIONS = ("fp32", "bf16", "int8")
+
+ImageInput = Union[str, Path, Image.Image]
+Thresholds = Sequence[Tuple[float, float]]
+
+
+def load_image(image: ImageInput) -> Image.Image:
+    """Open a local image file as RGB (PIL images are passed through)."""
+    if isinstance(image, Image.Image):
+        return image.convert("RGB")
+    with Image.open(image) as img:
+        return img.convert("RGB")
+
+
+def merge_labels(labels: Sequence[str]) -> str:
+    """Join candidate labels into the '. '-separated lowercase prompt Grounding DINO expects."""
+    return ". ".join(label.strip().lower() for label in labels) + "."
+
+
+class CachedTextBackbone(nn.Module):
+    """Wrap the text encoder and reuse its output for token sequences seen before.
+
+    Each row of a batch is keyed by its token ids, attention mask, token types and position ids,
+    so repeated label sets skip BERT even when they are batched with new ones.
+    """
+
+    def __init__(self, backbone: nn.Module, max_entries: int = 128) -> None:
+        super().__init__()
+        self.backbone = backbone
+        self.max_entries = max_entries
+        self._cache: "OrderedDict[bytes, torch.Tensor]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, *rows: torch.Tensor) -> bytes:
+        return b"|".join(row.detach().to("cpu", torch.int64).numpy().tobytes() for row in rows)
+
+    def forward(self, input_ids, attention_mask=None, token_type_ids=None, position_ids=None, return_dict=True, **kwargs):
+        columns = (input_ids, attention_mask, token_type_ids, position_ids)
+        keys = [self._key(*(col[i] for col in columns if col is not None)) for i in range(input_ids.shape[0])]
+        # first row of every unseen key, identical label sets within a batch are encoded once
+        missing = list({key: i for i, key in reversed(list(enumerate(keys))) if key not in self._cache}.values())
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            rows = torch.tensor(missing, device=input_ids.device)
+            hidden = self.backbone(
+                *(col.index_select(0, rows) if col is not None else None for col in columns),
+                return_dict=True,
+                **kwargs,
+            ).last_hidden_state
+            for i, state in zip(missing, hidden):
+                self._cache[keys[i]] = state
+        hidden = torch.stack([self._cache[key] for key in keys])
+        for key in keys:
+            self._cache.move_to_end(key)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+        if return_dict:
+            from transformers.modeling_outputs import BaseModelOutput
+
+            return BaseModelOutput(last_hidden_state=hidden)
+        return (hidden,)
+
+
+def load_detector(
+    model_id: str, device: torch.device, precision: str = "fp32", text_cache_size: int = 128, local_files_only: bool = False
+) -> Tuple[Any, nn.Module]:
+    """(processor, eval-mode model on device) of a Grounding DINO checkpoint.
+
+    int8 quantizes the linear layers dynamically, text_cache_size > 0 wraps the text encoder in a CachedTextBackbone.
+    """
+    from transformers import AutoModelForZeroShotObjectDetection, AutoProcessor
+
+    processor = AutoProcessor.from_pretrained(model_id, local_files_only=local_files_only)
+    model = AutoModelForZeroShotObjectDetection.from_pretrained(model_id, local_files_only=local_files_only)
+    model.eval()
+    if precision == "int8":
+        model = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+    model = model.to(device)
+    if text_cache_size > 0:
+        model.model.text_backbone = CachedTextBackbone(model.model.text_backbone, text_cache_size)
+    logging.info("Loaded %s on %s (%s)", model_id, device, precision)
+    return processor, model
+
+
+class GroundingDINODetector:
+    """Load a Grounding DINO processor and model once and detect labels on batches of images.
+
+    One forward pass serves any number of (threshold, text_threshold) settings.
+    """
+
+    def __init__(
+        self,
+        model_id: str = DEFAULT_MODEL_ID,
+        device: Optional[str] = None,
+        precision: str = "fp32",
+        text_cache_size: int = 128,
+        local_files_only: bool = False,
+    ) -> None:
+        if precision not in PRECISIONS:
+            raise ValueError(f"precision must be one of {PRECISIONS}, got {precision!r}")
+        self.device = torch.device(device or ("cuda" if torch.cuda.is_available() else "cpu"))
+        if precision == "int8" and self.device.type != "cpu":
+            raise ValueError("int8 dynamic quantization is only available on CPU")
+        self.precision = precision
+
+        # loaded once per process, detectors with the same settings share processor, weights and text cache
+        self.processor, self.model = MODELS.get(
+            ("zero-shot-object-detection", model_id, str(self.device), precision, text_cache_size, local_files_only),
+            lambda: load_detector(model_id, self.device, precision, text_cache_size, local_files_only),
+        )
+        backbone = self.model.model.text_backbone
+        self.text_cache = backbone if isinstance(backbone, CachedTextBackbone) else None
+        self._phrases: Dict[Tuple[int, ...], str] = {}
+
+    def _autocast(self):
+        return torch.autocast(self.device.type, dtype=torch.bfloat16, enabled=self.precision == "bf16")
+
+    def forward(self, images: Sequence[Image.Image], text_labels: Sequence[Sequence[str]]):
+        """Run one padded forward pass, returning (outputs, input_ids)."""
+        inputs = self.processor(
+            images=list(images),
+            text=[merge_labels(labels) for labels in text_labels],
+            padding="longest",
+            return_tensors="pt",
+        ).to(self.device)
+        with torch.inference_mode(), self._autocast():
+            outputs = self.model(**inputs)
+        return outputs, inputs.input_ids
+
+    def _phrase(self, token_ids: List[int]) -> str:
+        key = tuple(token_ids)
+        if key not in self._phrases:
+            self._phrases[key] = self.processor.tokenizer.decode(token_ids)
+        return self._phrases[key]
+
+    def post_process(
+        self,
+        outputs: Any,
+        input_ids: torch.Tensor,
+        target_sizes: Sequence[Tuple[int, int]],
+        thresholds: Thresholds,
+    ) -> List[List[Dict[str, Any]]]:
+        """Filter one set of raw outputs at every threshold pair.
+
+        Mirrors `processor.post_process_grounded_object_detection`, but the sigmoid and box
+        conversion are shared by all settings. Returns results[image][setting].
+        """
+        probs = outputs.logits.float().sigmoid()
+        scores = probs.max(dim=-1).values
+        cx, cy, w, h = outputs.pred_boxes.float().unbind(-1)
+        boxes = torch.stack([cx - 0.5 * w, cy - 0.5 * h, cx + 0.5 * w, cy + 0.5 * h], dim=-1)
+        sizes = torch.tensor(target_sizes, dtype=boxes.dtype, device=boxes.device)
+        boxes = boxes * sizes[:, [1, 0, 1, 0]][:, None, :]
+        # the first and last text positions never form a phrase
+        probs[..., 0] = 0
+        probs[..., -1] = 0
+
+        results = []
+        for idx in range(len(scores)):
+            ids = input_ids[idx].tolist()
+            per_setting = []
+            for threshold, text_threshold in thresholds:
+                keep = scores[idx] > threshold
+                posmaps = probs[idx][keep] > text_threshold
+                labels = [self._phrase([ids[i] for i in posmap.nonzero(as_tuple=True)[0].tolist()]) for posmap in posmaps]
+                per_setting.append({"scores": scores[idx][keep], "boxes": boxes[idx][keep], "labels": labels})
+            results.append(per_setting)
+        return results
+
+    def detect(
+        self,
+        images: Sequence[ImageInput],
+        text_labels: Sequence[Sequence[str]],
+        thresholds: Thresholds = ((0.4, 0.3),),
+        batch_size: int = 8,
+    ) -> List[List[Dict[str, Any]]]:
+        """Detect text_labels[i] on images[i], batch_size images per forward pass.
+
+        Returns results[image][setting] with scores, boxes (x0, y0, x1, y1 in pixels) and labels.
+        """
+        if len(images) != len(text_labels):
+            raise ValueError("Every image needs its own list of text labels")
+        results = []
+        for start in range(0, len(images), batch_size):
+            batch = [load_image(image) for image in images[start : start + batch_size]]
+            outputs, input_ids = self.forward(batch, text_labels[start : start + batch_size])
+            target_sizes = [image.size[::-1] for image in batch]
+            results.extend(self.post_process(outputs, input_ids, target_sizes, thresholds))
+        return results
@@ -0,0 +1,9 @@
+"""Lazy imports, the process-wide model registry and startup profiling of the VLM pipeline (pipeline/helper/startup.py)."""
+
+import os
+import sys
+
+PIPELINE_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "pipeline")
+if PIPELINE_ROOT not in sys.path:
+    sys.path.insert(0, PIPELINE_ROOT)
+from helper.startup import MODELS, LazyModule, ModelRegistry, StartupProfiler, lazy_import, when_imported  # noqa: E402,F401
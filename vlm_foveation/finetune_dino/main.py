@@ -1,19 +1,105 @@
-"""CLI entry point for finetuning Grounding DINO on custom datasets."""
+"""CLI entry point for finetuning Grounding DINO on custom datasets.
+
+Single process: `python main.py ...`; data parallel: `torchrun --nproc_per_node N main.py ...`.
+"""
+
+import logging
+import os
+import random
+import sys
+
+from finetune_helper.startup import StartupProfiler
+
+# Started before the remaining imports so they are profiled too; the flag is parsed again with the other arguments.
+PROFILER = StartupProfiler(enabled=any(arg in ("--profile_startup", "--profile-startup") for arg in sys.argv)).start()
+
+import numpy as np  # noqa: E402
+import torch  # noqa: E402
+from torch.utils.data import DataLoader, DistributedSampler  # noqa: E402
+
+from finetune_helper.argument_reader import parse_args  # noqa: E402
+from finetune_helper.distributed import cleanup_distributed, init_distributed  # noqa: E402
+from finetune_helper.finetune_roi import GroundingDINOROITrainer  # noqa: E402
+from finetune_helper.gaze_dataset import GazeROIDataset, collate_gaze_batch  # noqa: E402
+from finetune_helper.gaze_targets import GazeTargetStore  # noqa: E402
+
+
+def make_loader(dataset, args, dist_ctx, shuffle):
+    """DataLoader over this rank's shard of dataset."""
+    sampler = None
+    if dist_ctx.enabled:
+        sampler = DistributedSampler(
+            dataset, num_replicas=dist_ctx.world_size, rank=dist_ctx.rank, shuffle=shuffle, seed=args.seed
+        )
+    return DataLoader(
+        dataset,
+        batch_size=args.batch_size,
+        shuffle=shuffle and sampler is None,
+        sampler=sampler,
+        num_workers=args.num_workers,
+        collate_fn=collate_gaze_batch,
+        pin_memory=torch.cuda.is_available(),
+        persistent_workers=args.num_workers > 0,
+    )
 
-from finetune_helper.argument_reader import parse_args
 
 def main():
-    """Finetuning harness placeholder for Grounding DINO."""
-    args = parse_args()
-    print("Finetuning configuration:")
-    for key, value in vars(args).items():
-        print(f"  {key}: {value}")
-
-    # TODO: Initialize distributed / single-device training context and deterministic seeds.
-    # TODO: Load Grounding DINO config plus pretrained weights referenced by args.
-    # TODO: Build training and validation datasets from dataset_root.
-    # TODO: Set up optimizer, learning rate schedule, and evaluation metrics tailored to detection.
-    # TODO: Implement the training loop, periodic evaluation, and checkpointing into output_dir.
+    """Finetune on <dataset_root>/train and report the loss on <dataset_root>/val if it exists."""
+    with PROFILER.phase("arguments"):
+        args = parse_args()
+    with PROFILER.phase("distributed"):
+        dist_ctx = init_distributed(args.backend)
+    logging.basicConfig(level=logging.INFO if dist_ctx.is_main else logging.WARNING)
+    if dist_ctx.is_main:
+        print("Finetuning configuration:")
+        for key, value in vars(args).items():
+            print(f"  {key}: {value}")
+
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    torch.manual_seed(args.seed)
+    # replicas may run on one machine, keep them from oversubscribing the cores
+    if dist_ctx.enabled and args.device == "cpu":
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // dist_ctx.world_size))
+
+    try:
+        with PROFILER.phase("dataset"):
+            train_set = GazeROIDataset(os.path.join(args.dataset_root, "train"), args.image_size)
+        config = {
+            "device": args.device,
+            "model": args.model,
+            "pretrained_ckpt": args.pretrained_ckpt,
+            "lr": args.lr,
+            "precision": args.precision,
+            "grad_accum_steps": args.grad_accum_steps,
+            "localization_mode": args.localization_mode,
+            "image_size": tuple(args.image_size),
+            "keep_checkpoints": args.keep_checkpoints,
+            "gaze_target_store": str(train_set.target_store_path),
+        }
+        with PROFILER.phase("trainer"):
+            trainer = GroundingDINOROITrainer(config, args.output_dir, args.layers_to_train, dist_ctx)
+        if args.feature_cache:
+            full = DataLoader(train_set, batch_size=args.batch_size, num_workers=args.num_workers,
+                              collate_fn=collate_gaze_batch)
+            with PROFILER.phase("feature cache"):
+                trainer.precompute_features(full, args.feature_cache)
+            # epochs read the encoder output from the cache, decoding the images again would be wasted
+            train_set.load_images = False
+        if PROFILER.enabled and dist_ctx.is_main:
+            PROFILER.stop()
+            print(PROFILER.report())
+        trainer.train(make_loader(train_set, args, dist_ctx, shuffle=True), args.epochs)
+
+        val_dir = os.path.join(args.dataset_root, "val")
+        if os.path.exists(os.path.join(val_dir, "gaze_targets")):
+            val_set = GazeROIDataset(val_dir, args.image_size)
+            trainer.target_store = GazeTargetStore(val_set.target_store_path)
+            trainer.feature_cache = None  # cached features only cover the train split
+            val_loss = trainer.evaluate(make_loader(val_set, args, dist_ctx, shuffle=False))
+            logging.info("Validation loss=%.4f", val_loss)
+    finally:
+        cleanup_distributed()
 
 
 if __name__ == "__main__":
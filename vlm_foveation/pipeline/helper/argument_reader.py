@@ -11,7 +11,41 @@ def get_args():
     parser.add_argument(
         "--model_name",
         default="llava-1.6-34b",
-        help="Name or path of the target VLM checkpoint.",
+        help="Name or path of the target VLM checkpoint ('stub' runs the CPU stand-in model).",
+    )
+    parser.add_argument(
+        "--device",
+        default="cpu",
+        help="Device the VLM runs on (cpu, cuda, cuda:0).",
+    )
+    parser.add_argument(
+        "--vlm_batch_size",
+        type=int,
+        default=8,
+        help="Questions answered per VLM batch, filled across loader batches.",
+    )
+    parser.add_argument(
+        "--max_batch_tokens",
+        type=int,
+        default=None,
+        help="Also close a VLM batch before its visual tokens exceed this count.",
+    )
+    parser.add_argument(
+        "--max_new_tokens",
+        type=int,
+        default=10,
+        help="Maximum answer length in tokens.",
+    )
+    parser.add_argument(
+        "--vision_cache_size",
+        type=int,
+        default=256,
+        help="Foveated images whose vision features are cached for the following questions.",
+    )
+    parser.add_argument(
+        "--no_prefix_cache",
+        action="store_true",
+        help="Recompute the shared system prompt for every batch instead of reusing its KV cache.",
     )
     parser.add_argument(
         "--dataset",
@@ -23,15 +57,150 @@ def get_args():
         default="logs",
         help="Directory for saving logs, metrics, and artifacts.",
     )
+    parser.add_argument(
+        "--log_format",
+        default="csv",
+        choices=["csv", "parquet"],
+        help="Table format of the per-question and per-stage logs (parquet needs pyarrow).",
+    )
+    parser.add_argument(
+        "--no_timing",
+        action="store_true",
+        help="Disable per-stage timing.",
+    )
+    parser.add_argument(
+        "--profile_startup",
+        "--profile-startup",
+        action="store_true",
+        help="Report import time per package and the time of every init phase and model load at the end of the run.",
+    )
     parser.add_argument(
         "--sampling_method",
         default="uniform",
         help="Foveation sampling policy (uniform, saliency-guided, etc.).",
     )
+    parser.add_argument(
+        "--gaze_dir",
+        default=None,
+        help="img-attmap folder written by generate_deliverables, drives gaze-based sampling methods.",
+    )
+    parser.add_argument(
+        "--fovea_levels",
+        type=int,
+        default=4,
+        help="Gaussian pyramid levels between the fovea and the most blurred periphery.",
+    )
+    parser.add_argument(
+        "--fovea_sigma",
+        type=float,
+        default=0.08,
+        help="Fovea radius around fixations, relative to the image diagonal.",
+    )
+    parser.add_argument(
+        "--token_budget",
+        type=int,
+        default=1800,
+        help="Visual tokens per sample for token-budget sampling (cost model picked from --model_name).",
+    )
+    parser.add_argument(
+        "--crop_scale",
+        type=float,
+        default=0.5,
+        help="Side of token-budget crops relative to the short image side.",
+    )
+    parser.add_argument(
+        "--crop_sigma",
+        type=float,
+        default=0.05,
+        help="Radius around fixations when ranking token-budget crops, relative to the image diagonal.",
+    )
+    parser.add_argument(
+        "--crop_layout",
+        default="tiled",
+        choices=["tiled", "separate"],
+        help="Send token-budget views as one tiled canvas or as separate images.",
+    )
     parser.add_argument(
         "--seed",
         type=int,
         default=42,
         help="Random seed for reproducibility across sampling and evaluation.",
     )
+    parser.add_argument(
+        "--sweep",
+        default=None,
+        help="YAML/JSON sweep config: every combination of its 'grid' values (plus its 'runs') is run with "
+        "these arguments overridden by its 'base' and the combination's values.",
+    )
+    parser.add_argument(
+        "--sweep_workers",
+        type=int,
+        default=1,
+        help="Processes running sweep groups (configurations sharing a dataset index and model) in parallel.",
+    )
+    parser.add_argument(
+        "--rerun",
+        action="store_true",
+        help="Also run sweep configurations that already have a finished run in their log_dir.",
+    )
+    parser.add_argument(
+        "--data_root",
+        default="datasets/VQA_MHUG",
+        help="Folder holding original_VQA/ (annotations, questions, COCO images) and the gaze pickles.",
+    )
+    parser.add_argument(
+        "--data_subtype",
+        default="val2014",
+        help="VQA/COCO split used to resolve annotation, question and image files.",
+    )
+    parser.add_argument(
+        "--image_size",
+        type=int,
+        nargs=2,
+        default=None,
+        metavar=("WIDTH", "HEIGHT"),
+        help="Resize decoded images to this size; keeps the original size if omitted.",
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=8,
+        help="Number of questions per batch handed to the model.",
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=4,
+        help="Threads decoding and resizing images.",
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=4,
+        help="Number of batches decoded ahead of the model.",
+    )
+    parser.add_argument(
+        "--foveation_workers",
+        type=int,
+        default=2,
+        help="Threads applying the sampling method, overlapping the VLM.",
+    )
+    parser.add_argument(
+        "--eval_workers",
+        type=int,
+        default=1,
+        help="Threads scoring answered questions.",
+    )
+    parser.add_argument(
+        "--queue_size",
+        type=int,
+        default=2,
+        help="Batches waiting between two pipeline stages before the upstream stage blocks.",
+    )
+    parser.add_argument(
+        "--cache_size",
+        type=int,
+        default=256,
+        help="Decoded images kept in the LRU cache (VQA asks ~5 questions per image).",
+    )
     return parser.parse_args()
@@ -0,0 +1,283 @@
+"""Dataset access and prefetching image loading for the VLM foveation pipeline."""
+
+import glob
+import os
+import sys
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+VQA_ROOT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "datasets", "VQA_MHUG"
+)
+if VQA_ROOT not in sys.path:
+    sys.path.insert(0, VQA_ROOT)
+from vqaTools.vqa import VQA  # noqa: E402
+
+DELIVERABLES_ROOT = os.path.join(VQA_ROOT, "VQA_MHUG")
+
+# Question subsets of the gaze datasets, read from the index of their bbox pickles.
+GAZE_SUBSETS = {
+    "VQA-MHUG": "VQA_MHUG/mhug/vqa-mhug_bboxes.pickle",
+    "VQA-MHUG-JR": "VQA_MHUG/mhug-jr/vqa-mhug-jr_bboxes.pickle",
+}
+
+
+def decode_image(path, image_size=None):
+    """Decode an image to a read-only RGB uint8 array, optionally resized to (width, height)."""
+    with Image.open(path) as img:
+        if image_size is not None:
+            # Lets the JPEG decoder downscale in the DCT domain before the exact resize.
+            img.draft("RGB", tuple(image_size))
+        img = img.convert("RGB")
+        if image_size is not None and img.size != tuple(image_size):
+            img = img.resize(tuple(image_size), Image.BILINEAR)
+        array = np.asarray(img)
+    array.flags.writeable = False
+    return array
+
+
+class LRUCache:
+    """Thread-safe least-recently-used cache with a fixed number of entries."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the cached value (marking it as recently used) or None."""
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Insert a value, evicting the least recently used entry when full."""
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.capacity:
+                self._items.popitem(last=False)
+
+
+class AttentionMaps:
+    """Per-question image attention maps from an img-attmap folder written by generate_deliverables.
+
+    Reads both the one-file-per-sample layout and --STORE packed shards; the maps of all
+    participants of a question are averaged.
+    """
+
+    def __init__(self, path):
+        if not os.path.isdir(path):
+            raise FileNotFoundError(f"Gaze folder '{path}' does not exist")
+        self.path = path
+        self.reader = None
+        self.participants = {}
+        if glob.glob(os.path.join(path, "part-*.index")):
+            if DELIVERABLES_ROOT not in sys.path:
+                sys.path.insert(0, DELIVERABLES_ROOT)
+            from deliverable_store import PackedStoreReader
+
+            self.reader = PackedStoreReader(path)
+            keys = self.reader.keys()
+        else:
+            names = (os.path.basename(f)[1:-4] for f in glob.glob(os.path.join(path, "q*_p*.npy")))
+            keys = (tuple(name.split("_p")) for name in names)
+        for qid, pid in keys:
+            self.participants.setdefault(str(qid), []).append(str(pid))
+        if not self.participants:
+            # gaze policies would silently run without gaze on every question
+            raise ValueError(f"Gaze folder '{path}' holds no q*_p*.npy maps or part-*.index shards")
+
+    def __contains__(self, question_id):
+        return str(question_id) in self.participants
+
+    def get(self, question_id):
+        """Mean attention map of a question, or None if nobody's gaze was recorded for it.
+
+        Maps without any finite value (participants with no fixation on the image, NaN in
+        full-resolution deliverables) are left out of the mean.
+        """
+        pids = self.participants.get(str(question_id))
+        if not pids:
+            return None
+        if self.reader is not None:
+            maps = [self.reader[str(question_id), pid] for pid in pids]
+        else:
+            maps = [np.load(os.path.join(self.path, f"q{question_id}_p{pid}.npy")) for pid in pids]
+        maps = [attmap for attmap in maps if np.isfinite(attmap).any()]
+        if not maps:
+            return None
+        return np.nan_to_num(np.nanmean(maps, axis=0))
+
+
+class VQADataset:
+    """Question-level view of a VQA index, with the COCO image path of every question."""
+
+    def __init__(self, vqa, image_dir, data_subtype, question_ids=None, group_by_image=True, attention_maps=None):
+        self.vqa = vqa
+        self.attention_maps = attention_maps
+        self.image_dir = image_dir
+        self.data_subtype = data_subtype
+        if question_ids is None:
+            question_ids = vqa.getQuesIds()
+        else:
+            question_ids = [qid for qid in question_ids if qid in vqa.qa]
+        image_ids = vqa.getImgIds(quesIds=question_ids)
+        if group_by_image:
+            # Questions of the same image become neighbours, so the image cache serves repeats.
+            order = np.argsort(np.asarray(image_ids, dtype=np.int64), kind="stable")
+            question_ids = [question_ids[i] for i in order]
+            image_ids = [image_ids[i] for i in order]
+        self.question_ids = list(question_ids)
+        self.image_ids = list(image_ids)
+
+    def __len__(self):
+        return len(self.question_ids)
+
+    def image_path(self, image_id):
+        """Return the COCO file path of an image id."""
+        filename = f"COCO_{self.data_subtype}_{image_id:012d}.jpg"
+        return os.path.join(self.image_dir, filename)
+
+    def __getitem__(self, idx):
+        question_id = self.question_ids[idx]
+        image_id = self.image_ids[idx]
+        ann = self.vqa.qa[question_id]
+        item = {
+            "question_id": question_id,
+            "image_id": image_id,
+            "question": self.vqa.qqa[question_id]["question"],
+            "answers": [ans["answer"] for ans in ann["answers"]],
+            "image_path": self.image_path(image_id),
+        }
+        if self.attention_maps is not None:
+            item["attention_map"] = self.attention_maps.get(question_id)
+        return item
+
+
+class ImageLoader:
+    """Decode and resize images on a thread pool behind an LRU cache of decoded arrays.
+
+    Concurrent requests for the same image share one decode.
+    """
+
+    def __init__(self, image_size=None, num_workers=4, cache_size=256):
+        self.image_size = tuple(image_size) if image_size else None
+        self.cache = LRUCache(cache_size)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, num_workers))
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.decodes = 0
+
+    def submit(self, image_id, path):
+        """Return a future resolving to the decoded image of image_id."""
+        with self._lock:
+            self.requests += 1
+            future = self._pending.get(image_id)
+            if future is None:
+                # _decode fills the cache before it leaves _pending, so no decode is missed here.
+                cached = self.cache.get(image_id)
+                if cached is not None:
+                    future = Future()
+                    future.set_result(cached)
+                else:
+                    future = self._executor.submit(self._decode, image_id, path)
+                    self._pending[image_id] = future
+                    self.decodes += 1
+        return future
+
+    def _decode(self, image_id, path):
+        try:
+            image = decode_image(path, self.image_size)
+            self.cache.put(image_id, image)
+            return image
+        finally:
+            with self._lock:
+                self._pending.pop(image_id, None)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+class PrefetchLoader:
+    """Iterate over a dataset in batches, decoding up to `prefetch` batches ahead of the consumer."""
+
+    def __init__(self, dataset, image_loader, batch_size=8, prefetch=4):
+        self.dataset = dataset
+        self.image_loader = image_loader
+        self.batch_size = batch_size
+        self.prefetch = max(1, prefetch)
+
+    def __len__(self):
+        return (len(self.dataset) + self.batch_size - 1) // self.batch_size
+
+    def _submit(self, start):
+        items = [self.dataset[i] for i in range(start, min(start + self.batch_size, len(self.dataset)))]
+        futures = [self.image_loader.submit(item["image_id"], item["image_path"]) for item in items]
+        return items, futures
+
+    def __iter__(self):
+        starts = iter(range(0, len(self.dataset), self.batch_size))
+        queue = deque()
+        for start in starts:
+            queue.append(self._submit(start))
+            if len(queue) >= self.prefetch:
+                break
+        while queue:
+            items, futures = queue.popleft()
+            next_start = next(starts, None)
+            if next_start is not None:
+                queue.append(self._submit(next_start))
+            for item, future in zip(items, futures):
+                item["image"] = future.result()
+            yield items
+
+
+def load_question_ids(dataset_name, data_root):
+    """Return the question ids of a gaze dataset subset, or None to use every question."""
+    subset = GAZE_SUBSETS.get(dataset_name)
+    if subset is None or not os.path.exists(os.path.join(data_root, subset)):
+        return None
+    import pandas as pd
+
+    return [int(qid) for qid in pd.read_pickle(os.path.join(data_root, subset)).index.unique()]
+
+
+def build_dataset(args):
+    """Create the dataset index described by the CLI arguments."""
+    vqa_dir = os.path.join(args.data_root, "original_VQA")
+    ann_file = os.path.join(vqa_dir, "Annotations", f"v2_mscoco_{args.data_subtype}_annotations.json")
+    ques_file = os.path.join(
+        vqa_dir, "Questions", f"v2_OpenEnded_mscoco_{args.data_subtype}_questions.json"
+    )
+    image_dir = os.path.join(vqa_dir, "Images", "mscoco", args.data_subtype)
+    vqa = VQA(ann_file, ques_file)
+    return VQADataset(
+        vqa,
+        image_dir,
+        args.data_subtype,
+        question_ids=load_question_ids(args.dataset, args.data_root),
+        attention_maps=AttentionMaps(args.gaze_dir) if args.gaze_dir else None,
+    )
+
+
+def build_loader(args, dataset=None):
+    """Create the prefetching loader described by the CLI arguments, over `dataset` or a new dataset index."""
+    if dataset is None:
+        dataset = build_dataset(args)
+    image_loader = ImageLoader(args.image_size, args.num_workers, args.cache_size)
+    return dataset, PrefetchLoader(dataset, image_loader, args.batch_size, args.prefetch)
@@ -0,0 +1,46 @@
+"""Streaming VQA accuracy of model predictions, scored as batches of answers arrive."""
+
+import threading
+
+import numpy as np
+
+from . import data_loader  # noqa: F401  (puts vqaTools on sys.path)
+from vqaTools.vqaEval import GroundTruth, accuracyFromMatches, cleanAnswer, normalizeAnswer  # noqa: E402
+
+
+class VQAAccuracy:
+    """Official VQA accuracy (same normalization and leave-one-out averaging as VQAEval), one batch at a time.
+
+    Calling it with answered items sets item['accuracy'] in [0, 1] and adds to the running mean,
+    so results can be scored while the rest of the run is still in flight.
+    """
+
+    def __init__(self, vqa):
+        self.ground_truth = GroundTruth.of(vqa)
+        self.total = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, items):
+        gt = self.ground_truth
+        rows = gt.rows(np.asarray([item["question_id"] for item in items], dtype=np.int64))
+        multi = gt.multi[rows]
+        pred = np.array(
+            [
+                gt.vocab.get(normalizeAnswer(item["prediction"]) if m else cleanAnswer(item["prediction"]), -2)
+                for item, m in zip(items, multi.tolist())
+            ],
+            dtype=np.int64,
+        )
+        codes = np.where(multi[:, None], gt.normalized[rows], gt.raw[rows])
+        accuracy = accuracyFromMatches((codes == pred[:, None]).sum(axis=1), gt.numAnswers[rows])
+        for item, value in zip(items, accuracy.tolist()):
+            item["accuracy"] = value
+        with self._lock:
+            self.total += float(accuracy.sum())
+            self.count += len(items)
+        return items
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
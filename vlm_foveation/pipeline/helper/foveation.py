@@ -0,0 +1,310 @@
+"""Foveation policies selected by --sampling_method, applied to whole batches of decoded images."""
+
+import warnings
+
+import numpy as np
+from PIL import Image
+
+from .startup import lazy_import
+from .visual_tokens import token_counter
+
+# only the gaze-driven policies need torch, `uniform` runs start without it
+torch = lazy_import("torch")
+F = lazy_import("torch.nn.functional")
+
+POLICIES = {}
+
+
+def register_policy(name):
+    """Class decorator adding a foveation policy to POLICIES under `name`."""
+
+    def register(cls):
+        POLICIES[name] = cls
+        cls.name = name
+        return cls
+
+    return register
+
+
+def get_policy(name, **kwargs):
+    """Instantiate the foveation policy registered as `name`."""
+    if name not in POLICIES:
+        raise ValueError(f"Unknown sampling method {name!r}, choose from {sorted(POLICIES)}")
+    return POLICIES[name](**kwargs)
+
+
+def _group_by_shape(images):
+    groups = {}
+    for i, image in enumerate(images):
+        groups.setdefault(image.shape, []).append(i)
+    return groups.values()
+
+
+def fixation_acuity(fixations, height, width, sigma):
+    """Acuity map [B, H, W] in [0, 1]: the closest fixation's Gaussian falloff (sigma relative to the image diagonal).
+
+    `fixations` holds one scanpath per image, a list of {'x', 'y'} dicts in normalized image
+    coordinates with None for fixations off the image (the scanpath deliverable format).
+    """
+    points = [[(f["x"], f["y"]) for f in path if f is not None] for path in fixations]
+    count = max([len(p) for p in points] + [1])
+    xy = torch.full((len(points), count, 2), float("nan"))
+    for row, path in enumerate(points):
+        if path:
+            xy[row, : len(path)] = torch.tensor(path, dtype=torch.float32)
+    sigma_px = sigma * float(np.hypot(height, width))
+    grid_y = (torch.arange(height, dtype=torch.float32) + 0.5)[None, None, :]
+    grid_x = (torch.arange(width, dtype=torch.float32) + 0.5)[None, None, :]
+    # separable: exp(-(dx² + dy²) / 2σ²) = exp(-dx²/2σ²) * exp(-dy²/2σ²), padded fixations give 0
+    kernel_y = torch.exp(-0.5 * ((grid_y - xy[..., 1:] * height) / sigma_px) ** 2).nan_to_num(0.0)
+    kernel_x = torch.exp(-0.5 * ((grid_x - xy[..., :1] * width) / sigma_px) ** 2).nan_to_num(0.0)
+    # max over fixations of the outer products, without materializing [B, N, H, W] for long scanpaths
+    acuity = torch.zeros((len(points), height, width))
+    for n in range(count):
+        acuity = torch.maximum(acuity, kernel_y[:, n, :, None] * kernel_x[:, n, None, :])
+    return acuity
+
+
+def attention_acuity(attention_maps, height, width):
+    """Acuity map [B, H, W] in [0, 1] from img-attmap deliverables of any resolution."""
+    maps = torch.from_numpy(np.stack([np.asarray(m, dtype=np.float32) for m in attention_maps]))[:, None]
+    # NaN maps (no fixation on the image) would black out the whole image
+    maps = maps.nan_to_num(0.0, posinf=0.0, neginf=0.0)
+    if maps.shape[-2:] != (height, width):
+        maps = F.interpolate(maps, size=(height, width), mode="bilinear", align_corners=False)
+    maps = maps[:, 0].clamp_min(0)
+    return maps / maps.flatten(1).amax(dim=1).clamp_min(1e-12)[:, None, None]
+
+
+class FoveationPolicy:
+    """Base policy: __call__ maps a list of HxWx3 uint8 images (plus gaze) to foveated uint8 images."""
+
+    name = None
+    uses_gaze = True
+
+    def __call__(self, images, attention_maps=None, fixations=None):
+        raise NotImplementedError
+
+    def cache_key(self, item):
+        """Key of the foveated image of a dataset item: its image, the policy config and the question if gaze shaped it."""
+        config = tuple(sorted((k, v) for k, v in vars(self).items() if isinstance(v, (bool, int, float, str, type(None)))))
+        gaze = item["question_id"] if self.uses_gaze and item.get("attention_map") is not None else None
+        return (item["image_id"], self.name, config, gaze)
+
+
+@register_policy("uniform")
+class UniformPolicy(FoveationPolicy):
+    """Baseline: every pixel keeps full resolution."""
+
+    uses_gaze = False
+
+    def __init__(self, **kwargs):
+        pass
+
+    def __call__(self, images, attention_maps=None, fixations=None):
+        return list(images)
+
+
+@register_policy("saliency-guided")
+class PyramidFoveation(FoveationPolicy):
+    """Keep full resolution where people looked and fade into coarser Gaussian pyramid levels elsewhere.
+
+    Per pixel, acuity a in [0, 1] (from the attention map or fixations) selects the continuous
+    pyramid level (1 - a) * (levels - 1), blended linearly between the two nearest levels.
+    `min_acuity` caps how coarse the periphery gets. Images without gaze are returned unchanged.
+    """
+
+    def __init__(self, levels=4, fovea_sigma=0.08, min_acuity=0.0, **kwargs):
+        self.levels = max(1, levels)
+        self.fovea_sigma = fovea_sigma
+        self.min_acuity = min_acuity
+
+    @staticmethod
+    def reduce(batch):
+        """Blur a [B, 3, H, W] batch with the 5-tap binomial (Burt & Adelson) kernel and keep every second row and column."""
+        x = F.pad(batch, (2, 2, 2, 2), mode="replicate")
+        # separable taps as strided slices, only the kept outputs are computed (depthwise conv2d is slow on CPU)
+        h = x.shape[-2] - 4
+        rows = (x[..., 0:h:2, :] + x[..., 4 : h + 4 : 2, :]) + 4 * (x[..., 1 : h + 1 : 2, :] + x[..., 3 : h + 3 : 2, :]) + 6 * x[..., 2 : h + 2 : 2, :]
+        w = rows.shape[-1] - 4
+        cols = (rows[..., 0:w:2] + rows[..., 4 : w + 4 : 2]) + 4 * (rows[..., 1 : w + 1 : 2] + rows[..., 3 : w + 3 : 2]) + 6 * rows[..., 2 : w + 2 : 2]
+        return cols / 256
+
+    def blend(self, batch, acuity):
+        """Blend pyramid levels of batch [B, 3, H, W] by acuity [B, H, W].
+
+        Collapses the pyramid coarse to fine: every level mixes its own pixels with the upsampled
+        blend of the coarser levels, so only the last step runs at full resolution.
+        """
+        position = ((1 - acuity.clamp(self.min_acuity, 1)) * (self.levels - 1))[:, None]
+        gaussians, positions = [batch], [position]
+        for _ in range(1, self.levels):
+            if min(gaussians[-1].shape[-2:]) < 5:
+                break
+            gaussians.append(self.reduce(gaussians[-1]))
+            positions.append(F.interpolate(positions[-1], size=gaussians[-1].shape[-2:], mode="area"))
+        out = gaussians[-1]
+        for level in range(len(gaussians) - 2, -1, -1):
+            up = F.interpolate(out, size=gaussians[level].shape[-2:], mode="bilinear", align_corners=False)
+            # pixels at position <= level keep this level, position >= level + 1 take the coarser blend
+            weight = (level + 1 - positions[level]).clamp(0, 1)
+            out = torch.lerp(up, gaussians[level], weight)
+        return out
+
+    def __call__(self, images, attention_maps=None, fixations=None):
+        out = [None] * len(images)
+        for rows in _group_by_shape(images):
+            height, width = images[rows[0]].shape[:2]
+            batch = torch.from_numpy(np.stack([images[i] for i in rows])).permute(0, 3, 1, 2).float()
+            acuity = torch.ones((len(rows), height, width))
+            if attention_maps is not None:
+                have = [j for j, i in enumerate(rows) if attention_maps[i] is not None]
+                if have:
+                    acuity[have] = attention_acuity([attention_maps[rows[j]] for j in have], height, width)
+            elif fixations is not None:
+                have = [j for j, i in enumerate(rows) if any(f is not None for f in fixations[i] or [])]
+                if have:
+                    acuity[have] = fixation_acuity([fixations[rows[j]] for j in have], height, width, self.fovea_sigma)
+            with torch.inference_mode():
+                blended = self.blend(batch, acuity).round_().clamp_(0, 255).to(torch.uint8)
+            blended = blended.permute(0, 2, 3, 1).numpy()
+            for j, i in enumerate(rows):
+                out[i] = blended[j]
+        return out
+
+
+@register_policy("token-budget")
+class TokenBudgetCrops(FoveationPolicy):
+    """Spend a visual-token budget on a low-res global view plus the most attended high-res crops.
+
+    The global view is the image downscaled to `view_size` on its long side; crops are squares
+    (side `crop_scale` of the short image side, resized to view_size) picked greedily by attention
+    mass (or by fixation acuity with Gaussian radius `crop_sigma`), each one suppressing the
+    attention it covers. Crops are added while the sample still fits `token_budget` under the token
+    cost of `model_name`; a budget below the cost of the global view alone is rejected (tiled) or
+    warned about (separate, where that cost depends on the image shape).
+
+    layout="tiled" packs the views as view_size tiles into one canvas shaped like an AnyRes grid
+    (global view letterboxed into the first tile), which LLaVA-1.6 encodes far cheaper than
+    separate images; layout="separate" returns the list of views.
+    """
+
+    # views -> (rows, columns) of the canvas, all LLaVA-1.6 grid pinpoints
+    TILED_GRIDS = {1: (1, 1), 2: (1, 2), 3: (1, 3), 4: (2, 2)}
+
+    def __init__(self, token_budget=1800, crop_scale=0.5, crop_sigma=0.05, view_size=336, model_name=None,
+                 layout="tiled", grid=64, max_crops=8, **kwargs):
+        if layout not in ("tiled", "separate"):
+            raise ValueError(f"layout must be 'tiled' or 'separate', got {layout!r}")
+        self.token_budget = token_budget
+        self.crop_scale = crop_scale
+        self.crop_sigma = crop_sigma
+        self.view_size = view_size
+        self.layout = layout
+        self.grid = grid
+        self.max_crops = max_crops if layout == "separate" else min(max_crops, max(self.TILED_GRIDS) - 1)
+        self.count_tokens = token_counter(model_name)
+        if layout == "tiled":
+            # the tiled global view is one view_size tile whatever the image shape; shrinking it saves
+            # nothing, AnyRes models charge a small image as much as a full tile
+            floor = self.sample_tokens(view_size, view_size, 0)
+            if token_budget < floor:
+                raise ValueError(
+                    f"token_budget {token_budget} is below the {floor} visual tokens of the tiled global view alone"
+                )
+
+    def _global_size(self, height, width):
+        scale = self.view_size / max(height, width)
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+    def sample_tokens(self, height, width, crops):
+        """Visual tokens of a height x width image sent as the global view plus `crops` crops."""
+        if self.layout == "tiled":
+            rows, cols = self.TILED_GRIDS[crops + 1]
+            return self.count_tokens(cols * self.view_size, rows * self.view_size)
+        return self.count_tokens(*self._global_size(height, width)) + crops * self.count_tokens(self.view_size, self.view_size)
+
+    def num_crops(self, height, width):
+        """Most crops that fit the budget next to the global view of a height x width image."""
+        if self.sample_tokens(height, width, 0) > self.token_budget:
+            warnings.warn(
+                f"token_budget {self.token_budget} is below the cost of the global view alone for some images, "
+                "they are sent without crops and go over the budget"
+            )
+            return 0
+        crops = 0
+        while crops < self.max_crops and self.sample_tokens(height, width, crops + 1) <= self.token_budget:
+            crops += 1
+        return crops
+
+    def tile(self, views):
+        """Pack the global view (letterboxed) and the crops into one AnyRes-shaped canvas."""
+        rows, cols = self.TILED_GRIDS[len(views)]
+        size = self.view_size
+        canvas = np.full((rows * size, cols * size, 3), 127, dtype=np.uint8)
+        for n, view in enumerate(views):
+            top, left = (n // cols) * size, (n % cols) * size
+            # the global view keeps its aspect ratio, centred in its tile
+            top += (size - view.shape[0]) // 2
+            left += (size - view.shape[1]) // 2
+            canvas[top : top + view.shape[0], left : left + view.shape[1]] = view
+        return canvas
+
+    @staticmethod
+    def select_windows(acuity, side, count):
+        """Greedy top-mass side x side windows of acuity [B, h, w], (top, left) [B, count, 2] plus mass [B, count]."""
+        acuity = acuity.clone()
+        batch, height, width = acuity.shape
+        rows = torch.arange(height)[None, :, None]
+        cols = torch.arange(width)[None, None, :]
+        corners, masses = [], []
+        for _ in range(count):
+            integral = F.pad(acuity.cumsum(1).cumsum(2), (1, 0, 1, 0))
+            # mass of every window position at once from the summed-area table
+            sums = integral[:, side:, side:] - integral[:, :-side, side:] - integral[:, side:, :-side] + integral[:, :-side, :-side]
+            mass, flat = sums.flatten(1).max(dim=1)
+            top, left = flat // sums.shape[2], flat % sums.shape[2]
+            corners.append(torch.stack([top, left], dim=1))
+            masses.append(mass)
+            in_rows = (rows >= top[:, None, None]) & (rows < top[:, None, None] + side)
+            in_cols = (cols >= left[:, None, None]) & (cols < left[:, None, None] + side)
+            acuity.masked_fill_(in_rows & in_cols, 0)
+        if not corners:
+            return torch.zeros((batch, 0, 2), dtype=torch.long), torch.zeros((batch, 0))
+        return torch.stack(corners, dim=1), torch.stack(masses, dim=1)
+
+    def __call__(self, images, attention_maps=None, fixations=None):
+        out = [None] * len(images)
+        for rows in _group_by_shape(images):
+            height, width = images[rows[0]].shape[:2]
+            global_size = self._global_size(height, width)
+            views = [[np.asarray(Image.fromarray(images[i]).resize(global_size, Image.BILINEAR))] for i in rows]
+            count = self.num_crops(height, width)
+            have = []
+            if attention_maps is not None:
+                have = [j for j, i in enumerate(rows) if attention_maps[i] is not None]
+            elif fixations is not None:
+                have = [j for j, i in enumerate(rows) if any(f is not None for f in fixations[i] or [])]
+            if count and have:
+                # acuity on a coarse grid with the image's aspect ratio, crops are mapped back to pixels
+                cell = max(height, width) / self.grid
+                grid_h, grid_w = max(1, round(height / cell)), max(1, round(width / cell))
+                if attention_maps is not None:
+                    acuity = attention_acuity([attention_maps[rows[j]] for j in have], grid_h, grid_w)
+                else:
+                    acuity = fixation_acuity([fixations[rows[j]] for j in have], grid_h, grid_w, self.crop_sigma)
+                side = max(1, min(grid_h, grid_w, round(self.crop_scale * min(grid_h, grid_w))))
+                corners, masses = self.select_windows(acuity, side, count)
+                crop_px = max(1, round(self.crop_scale * min(height, width)))
+                for j, corner, mass in zip(have, corners.tolist(), masses.tolist()):
+                    image = Image.fromarray(images[rows[j]])
+                    for (top, left), weight in zip(corner, mass):
+                        if weight <= 0:
+                            break
+                        y0 = min(height - crop_px, round(top * height / grid_h))
+                        x0 = min(width - crop_px, round(left * width / grid_w))
+                        crop = image.crop((x0, y0, x0 + crop_px, y0 + crop_px))
+                        views[j].append(np.asarray(crop.resize((self.view_size, self.view_size), Image.BICUBIC)))
+            for j, i in enumerate(rows):
+                out[i] = self.tile(views[j]) if self.layout == "tiled" else views[j]
+        return out
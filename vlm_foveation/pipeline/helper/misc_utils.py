@@ -1,10 +1,262 @@
 """Miscellaneous helper utilities for the VLM foveation pipeline."""
 
+import csv
+import functools
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from contextlib import nullcontext
+from datetime import datetime
 
-def create_log_and_csv_files(log_dir, dataset_name):
-    """Placeholder hook for log/csv initialization; implement as needed."""
-    print(
-        f"Initializing log and CSV files in '{log_dir}' for dataset '{dataset_name}'..."
-    )
-    # TODO: User will implement log/csv file creation logic here.
-    return None
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Per-question columns of predictions.csv, in file order.
+PREDICTION_COLUMNS = ("question_id", "image_id", "question", "prediction", "accuracy", "visual_tokens")
+STAGE_COLUMNS = ("stage", "start", "wall_s", "cpu_s", "peak_rss_mb")
+
+
+def git_commit(path=None):
+    """HEAD commit of the repository containing path (suffixed '-dirty' with local changes), or None."""
+    cwd = path or os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=cwd, capture_output=True, text=True, check=True, timeout=10
+        ).stdout.strip()
+        status = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=cwd, capture_output=True, text=True, timeout=10
+        ).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return commit + ("-dirty" if status.strip() else "")
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far, in MiB rounded to 0.1, None if the platform can't tell.
+
+    Windows has no `resource` module, there the peak working set is read through psutil if installed.
+    """
+    if resource is None:
+        try:
+            import psutil
+        except ImportError:
+            return None
+        peak = getattr(psutil.Process().memory_info(), "peak_wset", None)
+        return None if peak is None else round(peak / (1 << 20), 1)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1 << 20) if sys.platform == "darwin" else peak / 1024, 1)
+
+
+class BufferedWriter:
+    """Append-only table file that buffers rows and writes them `buffer_rows` at a time.
+
+    CSV files are opened in append mode per flush (header only for a new file), so an
+    interrupted run keeps every flushed batch. Parquet (needs pyarrow) writes one row group per
+    flush and is only readable after close(). Thread-safe.
+    """
+
+    def __init__(self, path, columns, buffer_rows=1024, file_format="csv"):
+        if file_format not in ("csv", "parquet"):
+            raise ValueError(f"file_format must be 'csv' or 'parquet', got {file_format!r}")
+        self.path = path
+        self.columns = list(columns)
+        self.buffer_rows = max(1, buffer_rows)
+        self.file_format = file_format
+        self.rows_written = 0
+        self._rows = []
+        self._lock = threading.Lock()
+        self._parquet = None
+        if file_format == "parquet":
+            import pyarrow  # noqa: F401  (fail at creation rather than at the first flush)
+
+    def append(self, row):
+        """Buffer one row (dict, missing columns stay empty, extra keys are ignored)."""
+        with self._lock:
+            self._rows.append(row)
+            if len(self._rows) >= self.buffer_rows:
+                self._flush()
+
+    def extend(self, rows):
+        with self._lock:
+            self._rows.extend(rows)
+            if len(self._rows) >= self.buffer_rows:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        rows, self._rows = self._rows, []
+        if not rows:
+            return
+        if self.file_format == "csv":
+            new = not os.path.exists(self.path)
+            with open(self.path, "a", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=self.columns, extrasaction="ignore")
+                if new:
+                    writer.writeheader()
+                writer.writerows(rows)
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pydict({column: [row.get(column) for row in rows] for column in self.columns})
+            if self._parquet is None:
+                self._parquet = pq.ParquetWriter(self.path, table.schema)
+            self._parquet.write_table(table.cast(self._parquet.schema))
+        self.rows_written += len(rows)
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            if self._parquet is not None:
+                self._parquet.close()
+                self._parquet = None
+
+
+class _Span:
+    __slots__ = ("timer", "stage", "start", "cpu_start", "wall_start")
+
+    def __init__(self, timer, stage):
+        self.timer = timer
+        self.stage = stage
+
+    def __enter__(self):
+        self.wall_start = time.time()
+        self.cpu_start = time.thread_time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.start
+        self.timer.record(self.stage, wall, time.thread_time() - self.cpu_start, self.wall_start)
+        return False
+
+
+_DISABLED = nullcontext()
+
+
+class StageTimer:
+    """Accumulate wall-clock and CPU seconds and call counts per named pipeline stage.
+
+    `with timer("stage"):` times a block, `@timer.timed("stage")` a function. Every timed call is
+    also appended to `sink` (a BufferedWriter with STAGE_COLUMNS) when given. A disabled timer
+    hands out one shared no-op context manager and leaves decorated functions unwrapped.
+    Thread-safe; concurrent calls of a stage add up to its busy time. CPU time is that of the
+    calling thread, peak memory the process peak RSS at the end of the call.
+    """
+
+    def __init__(self, enabled=True, sink=None):
+        self.enabled = enabled
+        self.sink = sink
+        self.seconds = {}
+        self.cpu_seconds = {}
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, stage):
+        return _Span(self, stage) if self.enabled else _DISABLED
+
+    def timed(self, stage):
+        """Decorator timing every call of a function as `stage`."""
+
+        def decorate(fn):
+            if not self.enabled:
+                return fn
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with _Span(self, stage):
+                    return fn(*args, **kwargs)
+
+            return wrapper
+
+        return decorate
+
+    def record(self, stage, wall, cpu, start=None):
+        with self._lock:
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + wall
+            self.cpu_seconds[stage] = self.cpu_seconds.get(stage, 0.0) + cpu
+            self.calls[stage] = self.calls.get(stage, 0) + 1
+        if self.sink is not None:
+            self.sink.append(
+                {"stage": stage, "start": start, "wall_s": wall, "cpu_s": cpu, "peak_rss_mb": peak_rss_mb()}
+            )
+
+    def summary(self, samples=None):
+        """One line per stage: total wall and CPU seconds, calls and, given the sample count, milliseconds per sample."""
+        lines = []
+        for stage, seconds in list(self.seconds.items()):
+            line = f"{stage}: {seconds:.3f}s ({self.cpu_seconds[stage]:.3f}s CPU) over {self.calls[stage]} calls"
+            if samples:
+                line += f" ({1000 * seconds / samples:.2f} ms/sample)"
+            lines.append(line)
+        return "\n".join(lines)
+
+    def totals(self):
+        """{stage: {'wall_s', 'cpu_s', 'calls'}} for summaries."""
+        with self._lock:
+            return {
+                stage: {"wall_s": seconds, "cpu_s": self.cpu_seconds[stage], "calls": self.calls[stage]}
+                for stage, seconds in self.seconds.items()
+            }
+
+
+class RunLogger:
+    """Log files of one run in `run_dir`.
+
+    manifest.json: arguments, git commit, seed, platform and start time, written on creation.
+    predictions.<fmt>: one row per answered question (PREDICTION_COLUMNS).
+    stages.<fmt>: one row per timed stage call (STAGE_COLUMNS).
+    summary.json: run-level metrics passed to close().
+    """
+
+    def __init__(self, run_dir, manifest, file_format="csv", buffer_rows=1024, timing=True):
+        self.run_dir = run_dir
+        os.makedirs(run_dir, exist_ok=True)
+        with open(os.path.join(run_dir, "manifest.json"), "w") as f:
+            json.dump(manifest, f, indent=2, default=str)
+        self.predictions = BufferedWriter(
+            os.path.join(run_dir, f"predictions.{file_format}"), PREDICTION_COLUMNS, buffer_rows, file_format
+        )
+        self.stages = BufferedWriter(os.path.join(run_dir, f"stages.{file_format}"), STAGE_COLUMNS, buffer_rows, file_format)
+        self.timer = StageTimer(enabled=timing, sink=self.stages if timing else None)
+
+    def log_predictions(self, items):
+        self.predictions.extend(items)
+
+    def close(self, summary=None):
+        """Flush the tables and write summary.json (with the per-stage timing totals)."""
+        self.predictions.close()
+        self.stages.close()
+        summary = dict(summary or {})
+        summary["stages"] = self.timer.totals()
+        summary["peak_rss_mb"] = peak_rss_mb()
+        with open(os.path.join(self.run_dir, "summary.json"), "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+def create_log_and_csv_files(log_dir, dataset_name, args=None, seed=None, file_format="csv", timing=True):
+    """Create `log_dir/<dataset>_<timestamp>/` with the run manifest and return its RunLogger."""
+    started = datetime.now()
+    run_dir = os.path.join(log_dir, f"{dataset_name}_{started:%Y%m%d-%H%M%S-%f}")
+    manifest = {
+        "dataset": dataset_name,
+        "started": started.isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "seed": seed,
+        "args": vars(args) if args is not None else {},
+        "command": sys.argv,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+    }
+    print(f"Logging run to '{run_dir}'...")
+    return RunLogger(run_dir, manifest, file_format=file_format, timing=timing)
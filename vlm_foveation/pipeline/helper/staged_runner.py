@@ -0,0 +1,128 @@
+"""Pipelined execution of the experiment stages on worker threads connected by bounded queues."""
+
+import queue
+import threading
+
+from .misc_utils import StageTimer
+
+_END = object()
+
+
+class Stage:
+    """One pipeline step: `fn` maps an input to an output (None outputs are dropped) on `workers` threads.
+
+    `flush`, if given, runs once after the last input has been processed and its result (unless
+    None) is passed on as a final output; stages holding state between inputs, such as the VLM
+    backend's dynamic batches, use it to emit what is left.
+    """
+
+    def __init__(self, name, fn, workers=1, flush=None):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.flush = flush
+
+
+class StagedRunner:
+    """Stream inputs through a chain of stages running concurrently.
+
+    Every stage has its own worker threads and a queue of at most `queue_size` pending inputs, so
+    a slow stage blocks the ones upstream (backpressure) instead of letting work pile up in memory,
+    and throughput is set by the slowest stage rather than the sum of all stages. Heavy work
+    (image decoding, torch, numpy) releases the GIL, so threads overlap it. Outputs are yielded as
+    they leave the last stage; with several workers per stage they may come out of order. The
+    first exception raised by any stage stops the pipeline and is re-raised by run().
+    """
+
+    def __init__(self, stages, queue_size=2, timer=None):
+        self.stages = list(stages)
+        self.queue_size = max(1, queue_size)
+        self.timer = timer or StageTimer()
+
+    def run(self, source):
+        """Feed every element of `source` through the stages and yield the outputs of the last one."""
+        stop = threading.Event()
+        errors = []
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+
+        def put(channel, value):
+            while not stop.is_set():
+                try:
+                    channel.put(value, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def get(channel):
+            while not stop.is_set():
+                try:
+                    return channel.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            return _END
+
+        def fail(error):
+            errors.append(error)
+            stop.set()
+
+        def feed():
+            try:
+                for value in source:
+                    if not put(queues[0], value):
+                        return
+                put(queues[0], _END)
+            except BaseException as error:
+                fail(error)
+
+        def work(stage, inbox, outbox, running):
+            try:
+                while True:
+                    value = get(inbox)
+                    if value is _END:
+                        # leave the marker for the other workers of this stage
+                        put(inbox, _END)
+                        break
+                    with self.timer(stage.name):
+                        value = stage.fn(value)
+                    if value is not None and not put(outbox, value):
+                        return
+                with running[1]:
+                    running[0] -= 1
+                    last = running[0] == 0
+                if last and not stop.is_set():
+                    if stage.flush is not None:
+                        with self.timer(stage.name):
+                            value = stage.flush()
+                        if value is not None:
+                            put(outbox, value)
+                    put(outbox, _END)
+            except BaseException as error:
+                fail(error)
+
+        threads = [threading.Thread(target=feed, name="stage-source", daemon=True)]
+        for n, stage in enumerate(self.stages):
+            running = [stage.workers, threading.Lock()]
+            for worker in range(stage.workers):
+                threads.append(
+                    threading.Thread(
+                        target=work,
+                        args=(stage, queues[n], queues[n + 1], running),
+                        name=f"stage-{stage.name}-{worker}",
+                        daemon=True,
+                    )
+                )
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                value = get(queues[-1])
+                if value is _END:
+                    break
+                yield value
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+        if errors:
+            raise errors[0]
@@ -0,0 +1,210 @@
+"""Fast CLI startup: lazily imported modules, a process-wide model registry and startup profiling."""
+
+import importlib
+import importlib.abc
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+_import_hooks = {}
+_hooks_lock = threading.Lock()
+
+
+def when_imported(name, hook):
+    """Call hook(module) now if module `name` is imported, otherwise on the first access of a lazy_import of it."""
+    module = sys.modules.get(name)
+    with _hooks_lock:
+        if module is None:
+            _import_hooks.setdefault(name, []).append(hook)
+            return
+        # hooks still waiting were registered before this one (e.g. an earlier run of a sweep), they must not fire later
+        _import_hooks.pop(name, None)
+    hook(module)
+
+
+class LazyModule:
+    """Stand-in for a module that is imported on first attribute access (`torch = lazy_import("torch")`)."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            module = importlib.import_module(self._name)
+            with _hooks_lock:
+                hooks = _import_hooks.pop(self._name, [])
+            for hook in hooks:
+                hook(module)
+            self._module = module
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._module or self._load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module {self._name!r} ({state})>"
+
+
+def lazy_import(name):
+    """`name` itself if it is already imported, a LazyModule importing it on first use otherwise."""
+    return sys.modules.get(name) or LazyModule(name)
+
+
+class ModelRegistry:
+    """Process-wide cache of loaded models, filled on first use.
+
+    get(key, load) calls load() once per hashable key (e.g. kind, checkpoint, device, dtype) and
+    hands the same object to every later caller, so several backends, detectors or sweep configs
+    in one process share a model instead of loading it again. Different keys load concurrently,
+    callers of one key wait for its single load. Load times are kept in `load_seconds`.
+    """
+
+    def __init__(self):
+        self._models = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self.load_seconds = {}
+
+    def get(self, key, load):
+        with self._lock:
+            if key in self._models:
+                return self._models[key]
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in self._models:
+                start = time.perf_counter()
+                model = load()
+                with self._lock:
+                    self.load_seconds[key] = time.perf_counter() - start
+                    self._models[key] = model
+        return self._models[key]
+
+    def __contains__(self, key):
+        return key in self._models
+
+    def __len__(self):
+        return len(self._models)
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            self._locks.clear()
+
+
+MODELS = ModelRegistry()
+
+
+class _TimedLoader:
+    """Loader wrapper timing exec_module, everything else is passed through."""
+
+    def __init__(self, loader, profiler):
+        self._loader = loader
+        self._profiler = profiler
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        with self._profiler._timed(module.__name__):
+            self._loader.exec_module(module)
+
+    def __getattr__(self, attr):
+        return getattr(self._loader, attr)
+
+
+class _TimingFinder(importlib.abc.MetaPathFinder):
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is None:
+                continue
+            if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                spec.loader = _TimedLoader(spec.loader, self.profiler)
+            return spec
+        return None
+
+
+class StartupProfiler:
+    """Import time per module and wall time of named init phases, for --profile_startup.
+
+    While started, every newly imported module is timed like `python -X importtime`: self time
+    excludes the modules it imports in turn. report() sums self times per top-level package and
+    lists the phases and the model registry loads. A disabled profiler does nothing.
+    """
+
+    def __init__(self, enabled=True, registry=MODELS):
+        self.enabled = enabled
+        self.registry = registry
+        self.imports = {}
+        self.phases = []
+        self._finder = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self.enabled and self._finder is None:
+            self._finder = _TimingFinder(self)
+            sys.meta_path.insert(0, self._finder)
+        return self
+
+    def stop(self):
+        if self._finder is not None:
+            sys.meta_path.remove(self._finder)
+            self._finder = None
+
+    @contextmanager
+    def _timed(self, name):
+        # per-thread stack of the child import time of every module being executed
+        stack = self._local.__dict__.setdefault("stack", [])
+        start = time.perf_counter()
+        stack.append(0.0)
+        try:
+            yield
+        finally:
+            cumulative = time.perf_counter() - start
+            children = stack.pop()
+            if stack:
+                stack[-1] += cumulative
+            with self._lock:
+                self.imports[name] = (cumulative - children, cumulative)
+
+    @contextmanager
+    def phase(self, name):
+        """Time an init step (argument parsing, dataset indexing, model loading, ...)."""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+
+    def packages(self):
+        """{top-level package: (self seconds summed over its modules, module count)}, slowest first."""
+        totals = {}
+        for name, (own, _) in list(self.imports.items()):
+            package = name.split(".")[0]
+            seconds, count = totals.get(package, (0.0, 0))
+            totals[package] = (seconds + own, count + 1)
+        return dict(sorted(totals.items(), key=lambda item: -item[1][0]))
+
+    def report(self, top=15):
+        """Text report of the slowest `top` packages, the phases and the model loads."""
+        packages = self.packages()
+        lines = [f"Startup profile: {len(self.imports)} modules imported in {sum(s for s, _ in packages.values()):.3f}s"]
+        for package, (seconds, count) in list(packages.items())[:top]:
+            lines.append(f"  import {package:<28} {seconds:8.3f}s ({count} modules)")
+        for name, seconds in self.phases:
+            lines.append(f"  phase  {name:<28} {seconds:8.3f}s")
+        for key, seconds in self.registry.load_seconds.items():
+            lines.append(f"  model  {str(key):<28} {seconds:8.3f}s")
+        return "\n".join(lines)
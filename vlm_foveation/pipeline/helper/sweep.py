@@ -0,0 +1,213 @@
+"""Parameter sweeps: a config grid expanded into pipeline runs that share dataset indices and models."""
+
+import argparse
+import csv
+import glob
+import hashlib
+import itertools
+import json
+import multiprocessing as mp
+import os
+import traceback
+from datetime import datetime
+
+from .data_loader import build_dataset
+from .startup import MODELS
+
+# Arguments that change how a run executes, not its results; ignored when matching finished runs.
+RUNTIME_ARGS = frozenset(
+    {
+        "log_dir",
+        "log_format",
+        "no_timing",
+        "profile_startup",
+        "num_workers",
+        "prefetch",
+        "foveation_workers",
+        "eval_workers",
+        "queue_size",
+        "cache_size",
+        "vision_cache_size",
+        "sweep",
+        "sweep_workers",
+        "rerun",
+    }
+)
+# Runs agreeing on these share one dataset index / one loaded model.
+DATASET_ARGS = ("data_root", "data_subtype", "dataset", "gaze_dir")
+MODEL_ARGS = ("model_name", "device")
+SWEEP_KEYS = ("base", "grid", "runs")
+RESULT_COLUMNS = ("accuracy", "mean_visual_tokens", "questions", "vision_encoder_passes", "wall_s")
+
+# Dataset indices built by this process, keyed by their DATASET_ARGS values.
+_DATASETS = {}
+
+
+def load_sweep(path):
+    """Sweep config from a .json or .yaml/.yml file (YAML needs pyyaml).
+
+    `base` holds arguments shared by every run, `grid` maps argument names to lists of values
+    whose combinations are all run, `runs` lists extra configurations outside the grid.
+    """
+    with open(path) as f:
+        if path.endswith((".yaml", ".yml")):
+            import yaml
+
+            spec = yaml.safe_load(f) or {}
+        else:
+            spec = json.load(f)
+    unknown = set(spec) - set(SWEEP_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown sweep config keys {sorted(unknown)}, expected {list(SWEEP_KEYS)}")
+    return spec
+
+
+def config_id(config):
+    """Stable id of the result-relevant arguments of a configuration."""
+    relevant = {key: value for key, value in config.items() if key not in RUNTIME_ARGS}
+    return hashlib.sha1(json.dumps(relevant, sort_keys=True, default=str).encode()).hexdigest()[:12]
+
+
+def expand_sweep(spec, defaults):
+    """Argument dicts of every configuration, later sources winning: defaults, base, one grid combination or `runs` entry.
+
+    Without a grid the base alone is one configuration unless `runs` are given. Duplicates are dropped.
+    """
+    grid = {name: values if isinstance(values, list) else [values] for name, values in spec.get("grid", {}).items()}
+    runs = spec.get("runs", [])
+    for overrides in [spec.get("base", {}), grid, *runs]:
+        unknown = set(overrides) - set(defaults)
+        if unknown:
+            raise ValueError(f"Unknown arguments {sorted(unknown)} in sweep config")
+    base = dict(defaults, **spec.get("base", {}))
+    combinations = [dict(zip(grid, values)) for values in itertools.product(*grid.values())] if grid or not runs else []
+    configs, seen = [], set()
+    for overrides in combinations + runs:
+        # sweep arguments are not passed on, a configuration is a single run
+        config = dict(base, **overrides, sweep=None)
+        key = (config_id(config), config["log_dir"])
+        if key not in seen:
+            seen.add(key)
+            configs.append(config)
+    return configs
+
+
+def finished_runs(log_dir):
+    """{config id: run directory} of the runs in log_dir that got to write their summary.json."""
+    runs = {}
+    for manifest in sorted(glob.glob(os.path.join(log_dir, "*", "manifest.json"))):
+        run_dir = os.path.dirname(manifest)
+        if not os.path.exists(os.path.join(run_dir, "summary.json")):
+            continue
+        try:
+            with open(manifest) as f:
+                runs[config_id(json.load(f)["args"])] = run_dir
+        except (OSError, ValueError, KeyError):
+            continue
+    return runs
+
+
+def group_configs(configs):
+    """Configurations grouped by model, each group ordered by dataset so its runs reuse both."""
+    groups = {}
+    for config in configs:
+        groups.setdefault(tuple(str(config[key]) for key in MODEL_ARGS), []).append(config)
+    dataset_key = lambda config: tuple(str(config[key]) for key in DATASET_ARGS)
+    return [sorted(group, key=dataset_key) for group in groups.values()]
+
+
+def shared_dataset(args):
+    """Dataset index of args, built once per process."""
+    key = tuple(str(getattr(args, name)) for name in DATASET_ARGS)
+    if key not in _DATASETS:
+        _DATASETS[key] = build_dataset(args)
+    return _DATASETS[key]
+
+
+def _read_summary(run_dir):
+    try:
+        with open(os.path.join(run_dir, "summary.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def run_group(task):
+    """Run the configurations of one group in order, the model stays loaded (MODELS) until the last one finished."""
+    run, configs = task
+    results = []
+    try:
+        for config in configs:
+            args = argparse.Namespace(**config)
+            try:
+                summary = run(args, dataset=shared_dataset(args))
+                results.append({"config": config, "status": "done", "run_dir": summary.pop("run_dir"), "summary": summary})
+            except Exception:
+                # one broken configuration must not cost the rest of the sweep
+                traceback.print_exc()
+                results.append({"config": config, "status": "failed", "run_dir": None, "summary": {}})
+    finally:
+        MODELS.clear()
+    return results
+
+
+def write_results(path, results, varied):
+    """One row per configuration: id, status, run directory, the swept arguments and the result metrics."""
+    columns = ["config_id", "status", "run_dir", *varied, *RESULT_COLUMNS]
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns, extrasaction="ignore")
+        writer.writeheader()
+        for result in results:
+            config = result["config"]
+            row = {name: config.get(name) for name in varied}
+            row.update(result["summary"])
+            row.update(config_id=config_id(config), status=result["status"], run_dir=result["run_dir"])
+            writer.writerow(row)
+
+
+def run_sweep(args, run):
+    """Run every configuration of the --sweep config that has no finished run in its log_dir yet.
+
+    run(args, dataset=...) executes one configuration and returns its summary with the run directory.
+    Groups of configurations sharing a model run on --sweep_workers processes; within a group the
+    model is loaded once and every dataset index is built once per process. The status and metrics
+    of all configurations, finished earlier or now, are written to the base log_dir as sweep_<timestamp>.csv.
+    """
+    spec = load_sweep(args.sweep)
+    configs = expand_sweep(spec, vars(args))
+    results, pending, finished = [], [], {}
+    for config in configs:
+        log_dir = config["log_dir"]
+        if log_dir not in finished:
+            finished[log_dir] = {} if args.rerun else finished_runs(log_dir)
+        run_dir = finished[log_dir].get(config_id(config))
+        if run_dir is not None:
+            results.append({"config": config, "status": "skipped", "run_dir": run_dir, "summary": _read_summary(run_dir)})
+        else:
+            pending.append(config)
+    tasks = [(run, group) for group in group_configs(pending)]
+    print(
+        f"Sweep {args.sweep}: {len(configs)} configurations, {len(results)} already finished, "
+        f"{len(pending)} to run in {len(tasks)} model groups."
+    )
+
+    workers = min(args.sweep_workers, len(tasks))
+    if workers > 1:
+        with mp.Pool(workers) as pool:
+            for group_results in pool.imap_unordered(run_group, tasks):
+                results.extend(group_results)
+    else:
+        for task in tasks:
+            results.extend(run_group(task))
+
+    # pool results come back pickled, match them to the expanded order by id
+    order = {config_id(config) + config["log_dir"]: i for i, config in enumerate(configs)}
+    results.sort(key=lambda result: order[config_id(result["config"]) + result["config"]["log_dir"]])
+    varied = list(dict.fromkeys([*spec.get("grid", {}), *(key for entry in spec.get("runs", []) for key in entry)]))
+    log_dir = dict(vars(args), **spec.get("base", {}))["log_dir"]
+    os.makedirs(log_dir, exist_ok=True)
+    path = os.path.join(log_dir, f"sweep_{datetime.now():%Y%m%d-%H%M%S}.csv")
+    write_results(path, results, varied)
+    counts = {status: sum(result["status"] == status for result in results) for status in ("done", "skipped", "failed")}
+    print(f"Sweep finished: {counts['done']} run, {counts['skipped']} skipped, {counts['failed']} failed. Results in '{path}'.")
+    return results
@@ -0,0 +1,64 @@
+"""Visual-token cost of images for the VLMs referenced by --model_name."""
+
+# LLaVA-1.6 (LLaVA-NeXT): CLIP ViT-L/14 at 336 px gives 24 x 24 features per 336 px tile.
+LLAVA_NEXT_TILE = 336
+LLAVA_NEXT_FEATURES = 24
+LLAVA_NEXT_PINPOINTS = [(336, 672), (672, 336), (672, 672), (1008, 336), (336, 1008)]
+
+
+def select_best_resolution(height, width, pinpoints):
+    """AnyRes grid of an image: the pinpoint keeping most pixels, ties broken by least padding."""
+    best, best_effective, best_wasted = None, 0, float("inf")
+    for grid_height, grid_width in pinpoints:
+        scale = min(grid_width / width, grid_height / height)
+        effective = min(int(width * scale) * int(height * scale), width * height)
+        wasted = grid_width * grid_height - effective
+        if effective > best_effective or (effective == best_effective and wasted < best_wasted):
+            best, best_effective, best_wasted = (grid_height, grid_width), effective, wasted
+    return best
+
+
+def llava_next_tokens(width, height, pinpoints=LLAVA_NEXT_PINPOINTS, tile=LLAVA_NEXT_TILE, features=LLAVA_NEXT_FEATURES):
+    """Visual tokens LLaVA-1.6 spends on one width x height image.
+
+    One low-res base tile, plus the AnyRes tiles with the padding rows/columns removed and
+    one newline token per feature row (same arithmetic as transformers' LlavaNextProcessor).
+    """
+    grid_height, grid_width = select_best_resolution(height, width, pinpoints)
+    current_height = grid_height // tile * features
+    current_width = grid_width // tile * features
+    if width / height > current_width / current_height:
+        new_height = int(round(height * (current_width / width), 7))
+        current_height -= (current_height - new_height) // 2 * 2
+    else:
+        new_width = int(round(width * (current_height / height), 7))
+        current_width -= (current_width - new_width) // 2 * 2
+    return features * features + current_height * current_width + current_height
+
+
+def fixed_tokens(count):
+    """Cost function of models that resize every image to one fixed grid (LLaVA-1.5: 576)."""
+    return lambda width, height: count
+
+
+# Matched as substrings of the lower-cased --model_name, first match wins.
+TOKEN_COUNTERS = [
+    (("llava-1.6", "llava-v1.6", "llava-next"), llava_next_tokens),
+    (("llava-1.5", "llava-v1.5"), fixed_tokens(576)),
+]
+
+
+def token_counter(model_name):
+    """Per-image token cost function (width, height) -> tokens of a model, LLaVA-1.6 by default."""
+    name = (model_name or "").lower()
+    for patterns, counter in TOKEN_COUNTERS:
+        if any(pattern in name for pattern in patterns):
+            return counter
+    return llava_next_tokens
+
+
+def count_visual_tokens(model_name, views):
+    """Total visual tokens of one sample, given as a single HxWx3 image or a list of views."""
+    counter = token_counter(model_name)
+    views = views if isinstance(views, (list, tuple)) else [views]
+    return sum(counter(view.shape[1], view.shape[0]) for view in views)
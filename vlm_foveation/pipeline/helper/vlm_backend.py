@@ -0,0 +1,313 @@
+"""VLM backends selected by --model_name, with dynamic batching, a vision-feature cache and prompt-prefix KV reuse."""
+
+import copy
+import zlib
+
+import numpy as np
+
+from .data_loader import LRUCache
+from .misc_utils import StageTimer
+from .startup import MODELS, lazy_import
+from .visual_tokens import LLAVA_NEXT_FEATURES
+
+# the stub backend never touches torch, transformers is imported by the backend that loads a model
+torch = lazy_import("torch")
+
+DEFAULT_SYSTEM_PROMPT = "Answer the question about the image using a single word or phrase."
+
+# Short --model_name aliases of transformers checkpoints.
+HF_MODEL_IDS = {
+    "llava-1.6-34b": "llava-hf/llava-v1.6-34b-hf",
+    "llava-1.6-vicuna-7b": "llava-hf/llava-v1.6-vicuna-7b-hf",
+    "llava-1.6-mistral-7b": "llava-hf/llava-v1.6-mistral-7b-hf",
+}
+
+# (patterns, backend class), patterns matched as substrings of the lower-cased --model_name.
+BACKENDS = []
+
+
+def register_backend(*patterns):
+    """Class decorator adding a backend for model names containing any of `patterns`."""
+
+    def register(cls):
+        BACKENDS.append((patterns, cls))
+        return cls
+
+    return register
+
+
+def get_backend(model_name, **kwargs):
+    """Instantiate the backend registered for model_name; other names load through transformers."""
+    name = model_name.lower()
+    for patterns, cls in BACKENDS:
+        if any(pattern in name for pattern in patterns):
+            return cls(model_name, **kwargs)
+    return TransformersBackend(model_name, **kwargs)
+
+
+def as_views(image):
+    """The views of one sample: a single HxWx3 image or the list returned by multi-view policies."""
+    return list(image) if isinstance(image, (list, tuple)) else [image]
+
+
+class VLMBackend:
+    """Answer questions about foveated images in batches.
+
+    Samples queued with submit() are answered once max_batch_size samples (or max_batch_tokens
+    visual tokens, read from item['visual_tokens']) are pending, so model batches fill up across
+    loader batches. Vision features are cached per foveation cache key, which lets the questions
+    of one image share a single vision forward pass. With prefix_cache the shared prompt part
+    before the image is encoded once and reused by every batch.
+
+    Subclasses implement encode_images, generate and, if supports_prefix_cache, build_prefix.
+    """
+
+    supports_prefix_cache = False
+
+    def __init__(
+        self,
+        model_name,
+        system_prompt=DEFAULT_SYSTEM_PROMPT,
+        max_batch_size=8,
+        max_batch_tokens=None,
+        max_new_tokens=10,
+        vision_cache_size=256,
+        prefix_cache=True,
+        timer=None,
+        **kwargs,
+    ):
+        self.model_name = model_name
+        self.system_prompt = system_prompt
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_batch_tokens = max_batch_tokens
+        self.max_new_tokens = max_new_tokens
+        self.vision_cache = LRUCache(vision_cache_size)
+        self.prefix_cache = prefix_cache and self.supports_prefix_cache
+        self.timer = timer or StageTimer()
+        self.encoded_samples = 0
+        self._prefix_state = None
+        self._pending = []
+        self._pending_tokens = 0
+
+    def encode_images(self, views):
+        """Vision features of a list of HxWx3 uint8 views, one [tokens, dim] array per view."""
+        raise NotImplementedError
+
+    def build_prefix(self):
+        """Model state after the prompt part shared by all samples (system prompt up to the image)."""
+        raise NotImplementedError
+
+    def generate(self, features, questions, prefix_state=None):
+        """Answer strings for per-sample view features and questions, continuing prefix_state if given."""
+        raise NotImplementedError
+
+    def submit(self, items, images, cache_keys):
+        """Queue samples; returns the items of every model batch that filled up, with item['prediction'] set."""
+        done = []
+        for item, image, key in zip(items, images, cache_keys):
+            cost = item.get("visual_tokens", 0)
+            if self._pending and self.max_batch_tokens and self._pending_tokens + cost > self.max_batch_tokens:
+                done.extend(self.flush())
+            self._pending.append((item, image, key))
+            self._pending_tokens += cost
+            if len(self._pending) >= self.max_batch_size:
+                done.extend(self.flush())
+        return done
+
+    def flush(self):
+        """Answer all queued samples and return their items."""
+        requests, self._pending, self._pending_tokens = self._pending, [], 0
+        if not requests:
+            return []
+        items = [item for item, _, _ in requests]
+        with self.timer("vision"):
+            features = self.features([image for _, image, _ in requests], [key for _, _, key in requests])
+        prefix_state = None
+        if self.prefix_cache:
+            if self._prefix_state is None:
+                with self.timer("prefix"):
+                    self._prefix_state = self.build_prefix()
+            prefix_state = self._prefix_state
+        with self.timer("generate"):
+            answers = self.generate(features, [item["question"] for item in items], prefix_state)
+        for item, answer in zip(items, answers):
+            item["prediction"] = answer
+        return items
+
+    def features(self, images, cache_keys):
+        """Per-sample lists of view features, encoding each cache key missing from the cache once."""
+        first = {}
+        for i, key in enumerate(cache_keys):
+            first.setdefault(key, i)
+        features = {key: self.vision_cache.get(key) for key in first}
+        missing = [key for key, cached in features.items() if cached is None]
+        if missing:
+            views = [as_views(images[first[key]]) for key in missing]
+            encoded = self.encode_images([view for sample in views for view in sample])
+            self.encoded_samples += len(missing)
+            start = 0
+            for key, sample in zip(missing, views):
+                features[key] = encoded[start : start + len(sample)]
+                start += len(sample)
+                self.vision_cache.put(key, features[key])
+        return [features[key] for key in cache_keys]
+
+
+@register_backend("stub")
+class StubBackend(VLMBackend):
+    """Deterministic CPU stand-in with the backend contract, for running the pipeline without a VLM.
+
+    Vision: patch means on a 24 x 24 grid per view, projected to `dim` features. Language model:
+    hashed word embeddings and image features through one tanh layer, mean-pooled and scored
+    against a fixed answer vocabulary. The prefix state is the pooled system prompt.
+    """
+
+    supports_prefix_cache = True
+    ANSWERS = ("yes", "no", "0", "1", "2", "3", "red", "blue", "white", "black", "green", "cat", "dog", "person")
+
+    def __init__(self, model_name, dim=64, vocab_size=4096, **kwargs):
+        super().__init__(model_name, **kwargs)
+        rng = np.random.default_rng(zlib.crc32(model_name.encode()))
+        self.vocab_size = vocab_size
+        self.patch_projection = rng.standard_normal((3, dim)).astype(np.float32)
+        self.embeddings = rng.standard_normal((vocab_size, dim)).astype(np.float32)
+        self.layer = (rng.standard_normal((dim, dim)) / np.sqrt(dim)).astype(np.float32)
+        self.answer_embeddings = rng.standard_normal((len(self.ANSWERS), dim)).astype(np.float32)
+
+    def encode_images(self, views):
+        features = []
+        for view in views:
+            height, width = view.shape[:2]
+            grid = min(LLAVA_NEXT_FEATURES, height, width)
+            rows = np.linspace(0, height, grid + 1).astype(int)
+            cols = np.linspace(0, width, grid + 1).astype(int)
+            sums = np.add.reduceat(np.add.reduceat(view.astype(np.float32), rows[:-1], axis=0), cols[:-1], axis=1)
+            means = sums / (np.outer(np.diff(rows), np.diff(cols))[..., None] * 255.0)
+            features.append(np.tanh(means.reshape(-1, 3) @ self.patch_projection))
+        return features
+
+    def _prefill(self, hidden, state):
+        total, count = state
+        return total + np.tanh(hidden @ self.layer).sum(axis=0), count + len(hidden)
+
+    def _embed(self, text):
+        return self.embeddings[[zlib.crc32(word.encode()) % self.vocab_size for word in text.lower().split()]]
+
+    def build_prefix(self):
+        return self._prefill(self._embed(self.system_prompt), (np.zeros(self.layer.shape[0], np.float32), 0))
+
+    def generate(self, features, questions, prefix_state=None):
+        answers = []
+        for views, question in zip(features, questions):
+            state = prefix_state if prefix_state is not None else self.build_prefix()
+            state = self._prefill(np.concatenate(views), state)
+            total, count = self._prefill(self._embed(question), state)
+            answers.append(self.ANSWERS[int(np.argmax(self.answer_embeddings @ (total / count)))])
+        return answers
+
+
+def load_image_text_to_text(model_id, device, dtype="auto", local_files_only=False):
+    """(processor, eval-mode model on device) of a transformers image-text-to-text checkpoint."""
+    from transformers import AutoModelForImageTextToText, AutoProcessor
+
+    processor = AutoProcessor.from_pretrained(model_id, local_files_only=local_files_only)
+    model = AutoModelForImageTextToText.from_pretrained(model_id, dtype=dtype, local_files_only=local_files_only)
+    return processor, model.to(device).eval()
+
+
+class TransformersBackend(VLMBackend):
+    """LLaVA-style image-text-to-text model loaded with transformers (LLaVA-1.6 checkpoints by default).
+
+    Vision features come from the model's get_image_features. The prompt (tokenizer chat template,
+    plain USER/ASSISTANT text without one) is laid out as [prefix][padding][question part], with
+    every image placeholder expanded to its feature count and the features scattered into the
+    input embeddings. The prefix (everything before the first image) is the same for all samples,
+    so its KV cache is computed once and copied into every batch; position ids follow the
+    attention mask, which makes the padding between prefix and question harmless.
+    """
+
+    supports_prefix_cache = True
+
+    def __init__(self, model_name, device="cpu", dtype="auto", local_files_only=False, **kwargs):
+        super().__init__(model_name, **kwargs)
+        model_id = HF_MODEL_IDS.get(model_name, model_name)
+        self.device = torch.device(device)
+        # loaded once per process, backends of the same checkpoint share processor and weights
+        self.processor, self.model = MODELS.get(
+            ("image-text-to-text", model_id, str(self.device), str(dtype), local_files_only),
+            lambda: load_image_text_to_text(model_id, self.device, dtype, local_files_only),
+        )
+        self.tokenizer = self.processor.tokenizer
+        self.image_token = self.processor.image_token
+        self.image_token_id = self.tokenizer.convert_tokens_to_ids(self.image_token)
+        self.pad_token_id = self.tokenizer.pad_token_id if self.tokenizer.pad_token_id is not None else self.tokenizer.eos_token_id
+        self.chat_template = getattr(self.processor, "chat_template", None)
+        prompt = self.render_prompt("")
+        self.prefix_text = prompt[: prompt.index(self.image_token)]
+        self.prefix_ids = self.tokenizer(self.prefix_text, add_special_tokens=not self.chat_template)["input_ids"]
+
+    def render_prompt(self, question, images=1):
+        """Prompt text with one image placeholder per view."""
+        if self.chat_template:
+            content = [{"type": "image"}] * images + [{"type": "text", "text": question}]
+            conversation = [
+                {"role": "system", "content": [{"type": "text", "text": self.system_prompt}]},
+                {"role": "user", "content": content},
+            ]
+            return self.processor.apply_chat_template(conversation, add_generation_prompt=True)
+        return f"{self.system_prompt}\nUSER: {self.image_token * images}\n{question}\nASSISTANT:"
+
+    def encode_images(self, views):
+        inputs = self.processor.image_processor([np.asarray(view) for view in views], return_tensors="pt")
+        with torch.inference_mode():
+            output = self.model.get_image_features(
+                pixel_values=inputs["pixel_values"].to(self.device, self.model.dtype),
+                image_sizes=inputs["image_sizes"].to(self.device),
+            )
+        return list(getattr(output, "pooler_output", output))
+
+    def build_prefix(self):
+        from transformers import DynamicCache
+
+        cache = DynamicCache(config=self.model.config.get_text_config())
+        input_ids = torch.tensor([self.prefix_ids], device=self.device)
+        with torch.no_grad():
+            self.model(input_ids=input_ids, attention_mask=torch.ones_like(input_ids), past_key_values=cache, use_cache=True)
+        return cache
+
+    def generate(self, features, questions, prefix_state=None):
+        rows = []
+        for views, question in zip(features, questions):
+            prompt = self.render_prompt(question, len(views))
+            if not prompt.startswith(self.prefix_text):
+                raise ValueError("Prompt does not start with the shared prefix; disable the prefix cache for this template")
+            parts = prompt[len(self.prefix_text) :].split(self.image_token)
+            # each placeholder becomes as many image tokens as its view has features
+            suffix = "".join(part + self.image_token * len(view) for part, view in zip(parts, views)) + parts[-1]
+            rows.append(self.tokenizer(suffix, add_special_tokens=False)["input_ids"])
+        length = max(len(row) for row in rows)
+        suffix_ids = torch.tensor([[self.pad_token_id] * (length - len(row)) + row for row in rows])
+        suffix_mask = torch.tensor([[0] * (length - len(row)) + [1] * len(row) for row in rows])
+        prefix_ids = torch.tensor([self.prefix_ids]).expand(len(rows), -1)
+        input_ids = torch.cat([prefix_ids, suffix_ids], dim=1).to(self.device)
+        attention_mask = torch.cat([torch.ones_like(prefix_ids), suffix_mask], dim=1).to(self.device)
+
+        with torch.inference_mode():
+            embeds = self.model.get_input_embeddings()(input_ids)
+            image_features = torch.cat([view for views in features for view in views]).to(embeds.device, embeds.dtype)
+            image_mask = (input_ids == self.image_token_id)[..., None].expand_as(embeds)
+            embeds = embeds.masked_scatter(image_mask, image_features)
+            kwargs = {}
+            if prefix_state is not None:
+                cache = copy.deepcopy(prefix_state)
+                cache.batch_repeat_interleave(len(rows))
+                kwargs["past_key_values"] = cache
+            output = self.model.generate(
+                inputs_embeds=embeds,
+                attention_mask=attention_mask,
+                max_new_tokens=self.max_new_tokens,
+                do_sample=False,
+                pad_token_id=self.pad_token_id,
+                **kwargs,
+            )
+        return [answer.strip() for answer in self.tokenizer.batch_decode(output, skip_special_tokens=True)]
@@ -1,23 +1,146 @@
 """Entry point for Vision–Language Model foveation experiments."""
 
-from helper.argument_reader import get_args
-from helper.misc_utils import create_log_and_csv_files
+import random
+import sys
+import time
 
+from helper.startup import StartupProfiler, when_imported
 
-def main():
-    """Parse CLI arguments and orchestrate the foveation pipeline."""
-    args = get_args()
+# Started before the remaining imports so they are profiled too; the flag is parsed again with the other arguments.
+PROFILER = StartupProfiler(enabled=any(arg in ("--profile_startup", "--profile-startup") for arg in sys.argv)).start()
+
+import numpy as np  # noqa: E402
+
+from helper.argument_reader import get_args  # noqa: E402
+from helper.data_loader import build_loader  # noqa: E402
+from helper.evaluation import VQAAccuracy  # noqa: E402
+from helper.foveation import get_policy  # noqa: E402
+from helper.staged_runner import Stage, StagedRunner  # noqa: E402
+from helper.visual_tokens import count_visual_tokens  # noqa: E402
+from helper.vlm_backend import get_backend  # noqa: E402
+from helper.misc_utils import create_log_and_csv_files  # noqa: E402
+from helper.sweep import run_sweep  # noqa: E402
+
+
+def run(args, dataset=None):
+    """Run the foveation pipeline for one configuration and return its summary (with the run directory).
+
+    `dataset` is a prebuilt index of args' dataset, sweeps pass it to share it between runs.
+    """
     print("Parsed arguments:")
     for key, value in vars(args).items():
         print(f"  {key}: {value}")
 
-    # Initialize logging artifacts for the selected dataset/log directory pair.
-    create_log_and_csv_files(log_dir=args.log_dir, dataset_name=args.dataset)
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    # torch is imported lazily (not at all for stub/uniform runs), seed it once it is
+    when_imported("torch", lambda torch: torch.manual_seed(args.seed))
+    # Run manifest, per-question predictions and per-stage timings under log_dir.
+    run_log = create_log_and_csv_files(
+        log_dir=args.log_dir,
+        dataset_name=args.dataset,
+        args=args,
+        seed=args.seed,
+        file_format=args.log_format,
+        timing=not args.no_timing,
+    )
+    timer = run_log.timer
 
-    # TODO: Load the requested dataset split and metadata into memory-efficient buffers.
-    # TODO: Run the foveation/sampling procedure before image-language encoding.
-    # TODO: Invoke the configured VLM for reasoning or answer generation on foveated inputs.
-    # TODO: Evaluate accuracy, efficiency, and qualitative signals; persist metrics to log_dir.
+    # Index the requested split; images are decoded ahead of the model by a thread pool.
+    with PROFILER.phase("dataset"):
+        dataset, loader = build_loader(args, dataset)
+    print(f"Loaded {len(dataset)} questions ({len(loader)} batches).")
+    with PROFILER.phase("foveation policy"):
+        foveate = get_policy(
+            args.sampling_method,
+            levels=args.fovea_levels,
+            fovea_sigma=args.fovea_sigma,
+            token_budget=args.token_budget,
+            crop_scale=args.crop_scale,
+            crop_sigma=args.crop_sigma,
+            layout=args.crop_layout,
+            model_name=args.model_name,
+        )
+    with PROFILER.phase("backend"):
+        backend = get_backend(
+            args.model_name,
+            device=args.device,
+            max_batch_size=args.vlm_batch_size,
+            max_batch_tokens=args.max_batch_tokens,
+            max_new_tokens=args.max_new_tokens,
+            vision_cache_size=args.vision_cache_size,
+            prefix_cache=not args.no_prefix_cache,
+            timer=timer,
+        )
+    evaluate = VQAAccuracy(dataset.vqa)
+
+    def foveation_stage(batch):
+        images = foveate(
+            [item["image"] for item in batch],
+            attention_maps=[item.get("attention_map") for item in batch],
+        )
+        # Expected visual-token cost of every sample, recorded next to it for the efficiency metrics.
+        for item, views in zip(batch, images):
+            item["visual_tokens"] = count_visual_tokens(args.model_name, views)
+            del item["image"]
+        return batch, images, [foveate.cache_key(item) for item in batch]
+
+    def vlm_stage(request):
+        # Questions are answered once a full VLM batch is queued; item["prediction"] holds the answer.
+        return backend.submit(*request) or None
+
+    # load -> foveate -> VLM -> evaluate run concurrently; the loader decodes on its own thread pool.
+    runner = StagedRunner(
+        [
+            Stage("foveation", foveation_stage, workers=args.foveation_workers),
+            Stage("vlm", vlm_stage, flush=lambda: backend.flush() or None),
+            Stage("evaluation", evaluate, workers=args.eval_workers),
+        ],
+        queue_size=args.queue_size,
+        timer=timer,
+    )
+    visual_tokens = []
+    start = time.perf_counter()
+    try:
+        for answered in runner.run(loader):
+            visual_tokens.extend(item["visual_tokens"] for item in answered)
+            run_log.log_predictions(answered)
+    finally:
+        loader.image_loader.close()
+    elapsed = time.perf_counter() - start
+    images = loader.image_loader
+    print(f"Decoded {images.decodes} images for {images.requests} questions.")
+    if visual_tokens:
+        print(f"Mean visual tokens per sample: {sum(visual_tokens) / len(visual_tokens):.0f} (max {max(visual_tokens)}).")
+        if args.sampling_method == "token-budget" and max(visual_tokens) > args.token_budget:
+            print(f"Samples went over the token budget of {args.token_budget}, see the warning above.")
+    print(f"Answered {evaluate.count} questions with {backend.encoded_samples} vision encoder passes.")
+    print(f"VQA accuracy: {100 * evaluate.mean:.2f}")
+    print(f"Wall time {elapsed:.2f}s ({evaluate.count / max(elapsed, 1e-9):.1f} questions/s). Busy time per stage:")
+    print(timer.summary(evaluate.count))
+    summary = {
+        "questions": evaluate.count,
+        "accuracy": evaluate.mean,
+        "mean_visual_tokens": sum(visual_tokens) / len(visual_tokens) if visual_tokens else None,
+        "vision_encoder_passes": backend.encoded_samples,
+        "wall_s": elapsed,
+    }
+    run_log.close(summary)
+    return dict(summary, run_dir=run_log.run_dir)
+
+
+def main():
+    """Parse CLI arguments and run the foveation pipeline once or, with --sweep, for every configuration of a grid."""
+    with PROFILER.phase("arguments"):
+        args = get_args()
+    if args.sweep:
+        run_sweep(args, run)
+    else:
+        run(args)
+    if PROFILER.enabled:
+        # after the run, so modules imported lazily on first use are included
+        PROFILER.stop()
+        print(PROFILER.report())
 
 
 if __name__ == "__main__":